@@ -1,16 +1,42 @@
 from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Request, Response, stream_with_context
 from flask import session, redirect, url_for, flash # NEW: for session/login management
-from docling.document_converter import DocumentConverter
-import re
+from flask import g
 import os
+import functools
 import tempfile
 from supabase import create_client, Client
 import uuid
 from datetime import datetime, timedelta # NEW: for session lifetime
 import json
+import importlib.metadata
+import base64
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urlsplit, unquote
 import mimetypes # NEW: for content-type
 from werkzeug.utils import secure_filename # NEW: for securing filenames
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv # NEW: for loading .env file
+from postgrest.exceptions import APIError
+from converter_pool import ConverterPool, convert_and_extract, convert_and_extract_in_process
+from ocr_workers import OcrQueueFull, OcrWorkerPool
+from chunked_uploads import ChunkedUploadStore, UploadError
+from url_fetcher import UrlFetcher, UrlFetchError
+from derivatives import DERIVATIVE_VERSION, DerivativeQueue, derivative_path, render_derivatives
+from rate_limits import AdmissionGate, CostExceedsBurst, Overloaded, RateLimited, RateLimiter, RedisBuckets
+from scan_jobs import ScanJobQueue, TERMINAL_STATES
+from scan_cache import ScanResultCache, file_digest
+from bill_parsers import PARSER_VERSION
+from image_prep import max_long_edge, normalized_for_ocr
+from user_clients import UserClientPool
+from ttl_cache import MISSING, SharedGenerations, TTLCache
+from document_outbox import OUTBOX_SENT, DocumentOutbox
+from instrumentation import (
+    Gauge, REQUEST_SECONDS, SlowRequestProfiler, begin_request, log, registry, request_spans,
+    server_timing_header, span_recorder, stage
+)
 
 # Load environment variables from .env file (if you have one)
 load_dotenv() 
@@ -27,30 +53,454 @@ SUPABASE_KEY = os.environ.get('SUPABASE_KEY', 'your-supabase-anon-key-here')
 SUPABASE_SERVICE_KEY = os.environ.get('SUPABASE_SERVICE_KEY', '')  # Service role key for bypassing RLS
 BUCKET_NAME = "documents" # NEW: Define the bucket name for file uploads
 
+# Docling converter pool: number of warm converters per worker process
+CONVERTER_POOL_SIZE = int(os.environ.get('CONVERTER_POOL_SIZE', '1'))
+# When to import docling and load its models (torch, several seconds): 'start' warms in the
+# background at boot, 'page' when the scan page is opened, 'scan' on the first conversion.
+# Workers that only serve login, static files or /documents never load it with 'page' or 'scan'.
+CONVERTER_POOL_WARM = os.environ.get(
+    'CONVERTER_POOL_WARM', 'start' if os.environ.get('CONVERTER_POOL_WARM_ON_START') == '1' else 'page'
+)
+
+# Fast OCR: convert only the first N pages, falling back to the full document
+# when the account number or amount due is missing (0 = always convert everything)
+FAST_OCR_PAGES = int(os.environ.get('FAST_OCR_PAGES', '1'))
+
+# Image uploads are EXIF-rotated, downsampled to IMAGE_TARGET_DPI (for an A4 page)
+# and optionally converted to grayscale before OCR
+IMAGE_PREP_OPTIONS = dict(
+    enabled=os.environ.get('IMAGE_PREPROCESS', '1') == '1',
+    target_dpi=int(os.environ.get('IMAGE_TARGET_DPI', '200')),
+    grayscale=os.environ.get('IMAGE_GRAYSCALE', '1') == '1'
+)
+
+# Per-user authenticated Supabase clients kept warm across requests
+USER_CLIENT_CACHE_SIZE = int(os.environ.get('USER_CLIENT_CACHE_SIZE', '256'))
+
+# /documents page sizes
+DOCUMENTS_PAGE_SIZE = int(os.environ.get('DOCUMENTS_PAGE_SIZE', '50'))
+DOCUMENTS_MAX_PAGE_SIZE = int(os.environ.get('DOCUMENTS_MAX_PAGE_SIZE', '500'))
+
+# account_number -> utility_id matches per user (seconds; misses expire sooner). The cache is
+# per process: with UTILITY_CACHE_REDIS_URL (redis://...; defaults to RATE_LIMIT_REDIS_URL)
+# /utilities/cache/invalidate reaches every process and host, otherwise only the process
+# that handles it, so other processes may serve stale matches for up to UTILITY_CACHE_TTL.
+UTILITY_CACHE_REDIS_URL = os.environ.get('UTILITY_CACHE_REDIS_URL', os.environ.get('RATE_LIMIT_REDIS_URL', ''))
+UTILITY_CACHE_TTL = int(os.environ.get('UTILITY_CACHE_TTL', '600' if UTILITY_CACHE_REDIS_URL else '120'))
+UTILITY_CACHE_MISS_TTL = int(os.environ.get('UTILITY_CACHE_MISS_TTL', '60'))
+
+# Background scan jobs (/scan?async=1). Their status lives in SCAN_JOB_DB_PATH, so every worker
+# process on the host can answer polls and streams; set it to '' to keep jobs in memory, which
+# only works with a single worker process.
+SCAN_JOB_DB_PATH = os.environ.get('SCAN_JOB_DB_PATH', 'scan_jobs.sqlite3')
+SCAN_JOB_WORKERS = int(os.environ.get('SCAN_JOB_WORKERS', '2'))
+SCAN_JOB_RESULT_TTL = int(os.environ.get('SCAN_JOB_RESULT_TTL', '3600')) # seconds to keep finished jobs
+
+# OCR result cache keyed on the SHA-256 of the uploaded file (set SCAN_CACHE_PATH='' to disable)
+SCAN_CACHE_PATH = os.environ.get('SCAN_CACHE_PATH', 'scan_cache.sqlite3')
+SCAN_CACHE_MAX_ENTRIES = int(os.environ.get('SCAN_CACHE_MAX_ENTRIES', '5000'))
+SCAN_CACHE_MAX_BYTES = int(os.environ.get('SCAN_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# Write-behind journal for document inserts (set DOCUMENT_OUTBOX_PATH='' to insert synchronously).
+# Needs SUPABASE_SERVICE_KEY: rows are delivered after the request, without the user's session.
+DOCUMENT_OUTBOX_PATH = os.environ.get('DOCUMENT_OUTBOX_PATH', 'document_outbox.sqlite3')
+DOCUMENT_OUTBOX_BATCH_SIZE = int(os.environ.get('DOCUMENT_OUTBOX_BATCH_SIZE', '50'))
+DOCUMENT_OUTBOX_MAX_DELAY = float(os.environ.get('DOCUMENT_OUTBOX_MAX_DELAY', '300')) # longest retry backoff, seconds
+# Rejections (constraint or validation errors) before a row is marked failed (reported at
+# /documents/pending/<key>). Outages and timeouts are retried until the database is back.
+DOCUMENT_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('DOCUMENT_OUTBOX_MAX_ATTEMPTS', '3'))
+
+# OCR worker processes (set OCR_WORKERS=0 to convert inside the web process with converter_pool).
+# Each worker runs docling with OCR_THREADS_PER_WORKER native threads, so by default the
+# workers together use every core. Sized per web process: run one web process per host
+# (with threads) or divide OCR_WORKERS between them.
+OCR_THREADS_PER_WORKER = int(os.environ.get('OCR_THREADS_PER_WORKER', '2'))
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', str(max(1, (os.cpu_count() or 2) // max(1, OCR_THREADS_PER_WORKER)))))
+OCR_QUEUE_SIZE = int(os.environ.get('OCR_QUEUE_SIZE', str(OCR_WORKERS * 2))) # jobs waiting beyond the busy workers
+OCR_WORKER_MAX_JOBS = int(os.environ.get('OCR_WORKER_MAX_JOBS', '100')) # recycle a worker after this many jobs
+
+# /scan/batch: the largest accepted batch
+BATCH_SCAN_MAX_FILES = int(os.environ.get('BATCH_SCAN_MAX_FILES', '50'))
+
+# Dump a cProfile snapshot of requests slower than this many seconds into PROFILE_DIR (0 = off).
+# Profiling slows every request down, so enable it only while investigating.
+PROFILE_SLOW_REQUEST_SECONDS = float(os.environ.get('PROFILE_SLOW_REQUEST_SECONDS', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+# Upload size limits, enforced from Content-Length before the body is read
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', '20'))
+MAX_BATCH_UPLOAD_MB = int(os.environ.get('MAX_BATCH_UPLOAD_MB', '200'))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+
+# Resumable chunked uploads (set CHUNKED_UPLOAD_DIR='' to disable); chunks are small enough for flaky mobile links
+CHUNKED_UPLOAD_DIR = os.environ.get('CHUNKED_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'bill_scan_uploads'))
+CHUNKED_UPLOAD_CHUNK_KB = int(os.environ.get('CHUNKED_UPLOAD_CHUNK_KB', '512'))
+CHUNKED_UPLOAD_TTL = int(os.environ.get('CHUNKED_UPLOAD_TTL', str(24 * 3600))) # seconds before an abandoned upload is removed
+
+# /process_url downloads: connect/read timeouts and the whole-download deadline (seconds), the
+# size cap, and how many downloads may run at once per web process (more get a 503)
+URL_FETCH_CONNECT_TIMEOUT = float(os.environ.get('URL_FETCH_CONNECT_TIMEOUT', '5'))
+URL_FETCH_READ_TIMEOUT = float(os.environ.get('URL_FETCH_READ_TIMEOUT', '15'))
+URL_FETCH_DEADLINE = float(os.environ.get('URL_FETCH_DEADLINE', '60'))
+URL_FETCH_MAX_MB = int(os.environ.get('URL_FETCH_MAX_MB', str(MAX_UPLOAD_MB)))
+URL_FETCH_CONCURRENCY = int(os.environ.get('URL_FETCH_CONCURRENCY', '8'))
+
+# WebP thumbnail/preview renditions stored next to each original (DERIVATIVE_WORKERS=0 renders
+# them only when first requested). They never change, so clients may cache them this long (seconds).
+DERIVATIVE_WORKERS = int(os.environ.get('DERIVATIVE_WORKERS', '1'))
+DERIVATIVE_QUEUE_SIZE = int(os.environ.get('DERIVATIVE_QUEUE_SIZE', '64'))
+DERIVATIVE_MAX_AGE = int(os.environ.get('DERIVATIVE_MAX_AGE', str(365 * 24 * 3600)))
+
+# Token-bucket rate limits on the OCR endpoints: sustained requests per minute and burst size,
+# per logged-in user and per client IP (0 per minute disables that limit). A batch costs one
+# token per file. Behind a reverse proxy, set TRUSTED_PROXY_COUNT so the IP is the client's.
+RATE_LIMIT_USER_PER_MINUTE = float(os.environ.get('RATE_LIMIT_USER_PER_MINUTE', '20'))
+RATE_LIMIT_USER_BURST = int(os.environ.get('RATE_LIMIT_USER_BURST', '10'))
+RATE_LIMIT_IP_PER_MINUTE = float(os.environ.get('RATE_LIMIT_IP_PER_MINUTE', '60'))
+RATE_LIMIT_IP_BURST = int(os.environ.get('RATE_LIMIT_IP_BURST', '30'))
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', '0'))
+# Share the buckets between web processes and hosts (redis://...; needs the redis package).
+# Without it, or while Redis is unreachable, each process enforces the limits on its own.
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', '')
+# After a Redis error, seconds to limit per process before trying Redis again
+RATE_LIMIT_REDIS_COOLDOWN = float(os.environ.get('RATE_LIMIT_REDIS_COOLDOWN', '30'))
+# OCR requests running at once in this process (0 = no cap); more are refused with 503 and Retry-After
+MAX_CONCURRENT_SCANS = int(os.environ.get('MAX_CONCURRENT_SCANS', '16'))
+
 # Allowed file extensions for security (for file upload)
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
 
+class UploadRequest(Request):
+    """
+    Request whose multipart parser writes each uploaded file straight into a named
+    temp file in chunks, so OCR and the Storage upload both read it from disk and
+    request memory stays flat regardless of file size.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.spooled_uploads = []
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'scan_batch':
+            return MAX_BATCH_UPLOAD_MB * 1024 * 1024
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        _, ext = os.path.splitext(filename or '')
+        stream = tempfile.NamedTemporaryFile('w+b', suffix=ext.lower(), delete=False)
+        self.spooled_uploads.append(stream)
+        return stream
+
+app.request_class = UploadRequest
+
+def spooled_upload_path(file):
+    """Path of the temp file an upload was spooled to (copied into one in chunks if it was not)"""
+    path = getattr(file.stream, 'name', None)
+    if isinstance(path, str) and os.path.exists(path):
+        file.stream.flush()
+        return path
+    _, ext = os.path.splitext(file.filename or '')
+    temp_file = tempfile.NamedTemporaryFile('w+b', suffix=ext.lower(), delete=False)
+    request.spooled_uploads.append(temp_file)
+    file.save(temp_file)
+    temp_file.flush()
+    return temp_file.name
+
+def claim_spooled_upload(file):
+    """Move a spooled upload out of request cleanup so a background job can own (and later delete) it"""
+    path = spooled_upload_path(file)
+    _, ext = os.path.splitext(path)
+    fd, claimed_path = tempfile.mkstemp(suffix=ext)
+    os.close(fd)
+    os.replace(path, claimed_path)
+    return claimed_path
+
+slow_request_profiler = SlowRequestProfiler(PROFILE_SLOW_REQUEST_SECONDS, PROFILE_DIR) if PROFILE_SLOW_REQUEST_SECONDS > 0 else None
+
+@app.before_request
+def start_request_instrumentation():
+    g.request_id = begin_request(request.headers.get('X-Request-ID'))
+    g.request_started = time.perf_counter()
+    g.profiler = slow_request_profiler.start() if slow_request_profiler else None
+
+@app.after_request
+def finish_request_instrumentation(response):
+    elapsed = time.perf_counter() - g.request_started
+    REQUEST_SECONDS.observe(elapsed, request.endpoint or 'unknown', request.method, str(response.status_code))
+    response.headers['X-Request-ID'] = g.request_id
+    spans = request_spans()
+    if spans:
+        response.headers['Server-Timing'] = server_timing_header(spans + [('total', elapsed)])
+    return response
+
+@app.teardown_request
+def stop_request_profiler(exc=None):
+    profiler = g.pop('profiler', None)
+    if profiler:
+        path = slow_request_profiler.finish(profiler, time.perf_counter() - g.request_started, request.endpoint or 'unknown')
+        if path:
+            log(f"Slow request profile written to {path}")
+
+@app.teardown_request
+def remove_spooled_uploads(exc=None):
+    for stream in getattr(request, 'spooled_uploads', ()):
+        try:
+            stream.close()
+            os.unlink(stream.name)
+        except OSError:
+            pass
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    limit_mb = MAX_BATCH_UPLOAD_MB if request.endpoint == 'scan_batch' else MAX_UPLOAD_MB
+    return jsonify({'error': f'Upload too large. The limit is {limit_mb} MB.'}), 413
+
+@app.errorhandler(OcrQueueFull)
+def ocr_queue_full(e):
+    response = jsonify({'error': 'OCR workers are busy. Please retry shortly.', 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+@app.errorhandler(RateLimited)
+def rate_limit_exceeded(e):
+    response = jsonify({'error': 'Too many requests. Please slow down.', 'limit': e.scope, 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+@app.errorhandler(CostExceedsBurst)
+def rate_limit_cost_exceeds_burst(e):
+    # Retrying would never help: the request has to be split (e.g. a smaller batch)
+    return jsonify({'error': f'Too many files in one request: at most {e.burst} at once.', 'limit': e.scope}), 400
+
+@app.errorhandler(Overloaded)
+def server_overloaded(e):
+    response = jsonify({'error': 'The server is busy. Please retry shortly.', 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+@app.errorhandler(UrlFetchError)
+def url_fetch_error(e):
+    response = jsonify({'error': str(e)})
+    if e.retry_after:
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response, e.status
+
 def allowed_file(filename):
     """Checks if a file extension is allowed."""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Initialize Supabase clients
-try:
-    # Regular client for public/authenticated operations
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    
-    # Service role client for database operations (bypasses RLS)
-    if SUPABASE_SERVICE_KEY:
-        supabase_admin: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+def start_ocr_in_background():
+    """Load the OCR models (in the worker processes, or in this process without them) without blocking"""
+    if ocr_workers:
+        threading.Thread(target=ocr_workers.start, name='ocr-workers-start', daemon=True).start()
     else:
-        supabase_admin = supabase
-        print("Service role key not provided, using regular client (RLS may block operations)")
-        
-except Exception as e:
-    print(f"Supabase client initialization warning: {e}")
-    supabase = None
-    supabase_admin = None
+        converter_pool.start_in_background()
+
+def redis_client(url, setting):
+    """redis.Redis for `url`, or None when unset or the redis package is missing (`setting` names it in the log)"""
+    if not url:
+        return None
+    try:
+        import redis # Optional: only needed to share state between processes
+    except ImportError:
+        log(f"{setting} is set but the redis package is not installed; keeping that state per process")
+        return None
+    # Short timeouts: a slow Redis must not slow requests down (its users fall back without it)
+    return redis.Redis.from_url(url, socket_timeout=0.1, socket_connect_timeout=0.1)
+
+def charge_rate_limits(cost=1, charged=0):
+    """
+    Take `cost` tokens from the caller's IP and user buckets, from both or neither; raises
+    RateLimited (429) when either is short. Raises CostExceedsBurst (400) when `cost` plus the
+    `charged` tokens the request already paid is more than a bucket holds.
+    """
+    limits = []
+    if RATE_LIMIT_IP_PER_MINUTE > 0:
+        limits.append(('ip', request.remote_addr or 'unknown', RATE_LIMIT_IP_PER_MINUTE / 60, RATE_LIMIT_IP_BURST))
+    user_session = session.get('supabase_session')
+    if user_session and RATE_LIMIT_USER_PER_MINUTE > 0:
+        limits.append(('user', user_session['user_id'], RATE_LIMIT_USER_PER_MINUTE / 60, RATE_LIMIT_USER_BURST))
+    for scope, _, _, burst in limits:
+        if cost + charged > burst:
+            raise CostExceedsBurst(scope, cost + charged, burst)
+    if limits and cost > 0:
+        with stage('rate_limit'):
+            rate_limiter.check(limits, cost)
+
+def admission_controlled(view):
+    """
+    Decorator for OCR endpoints: charge one token (429 when empty), then run the view
+    within the MAX_CONCURRENT_SCANS cap (503 when full). Both happen before the request
+    body is read; views that do more work per request charge the rest themselves.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        charge_rate_limits()
+        if not scan_admission:
+            return view(*args, **kwargs)
+        with scan_admission.admit():
+            return view(*args, **kwargs)
+    return wrapper
+
+def scan_pipeline_version():
+    """
+    Everything that shapes a cached OCR result: the parser version, the docling release
+    and the OCR settings. Cached results from any other combination are converted again.
+    """
+    try:
+        docling_version = importlib.metadata.version('docling')
+    except importlib.metadata.PackageNotFoundError:
+        docling_version = None
+    return json.dumps({
+        'parser': PARSER_VERSION,
+        'docling': docling_version,
+        'fast_ocr_pages': FAST_OCR_PAGES,
+        'image_prep': IMAGE_PREP_OPTIONS,
+    }, sort_keys=True)
+
+def insert_documents_idempotent(document_rows):
+    """
+    Outbox delivery: insert rows with the service-role client, skipping any whose
+    idempotency_key is already stored. Returns {idempotency_key: document_id}; raises on failure.
+    """
+    insert_result = supabase_admin.table('document') \
+        .upsert(document_rows, on_conflict='idempotency_key', ignore_duplicates=True) \
+        .execute()
+    # Rows that already existed are not returned; they map to None
+    return {row['idempotency_key']: row['id'] for row in insert_result.data or []}
+
+if TRUSTED_PROXY_COUNT > 0:
+    # request.remote_addr becomes the client address from X-Forwarded-For (used by the per-IP limit)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT, x_proto=TRUSTED_PROXY_COUNT)
+
+def init_app():
+    """
+    Create the app's clients, stores, pools and background threads. Runs once on import
+    in the web process (see the end of this section); never in OCR worker processes.
+    """
+    global supabase, supabase_admin, user_clients, converter_pool, ocr_workers, chunked_uploads, url_fetcher
+    global derivative_queue, rate_limit_redis, rate_limiter, scan_admission, utility_cache, utility_cache_redis
+    global utility_generations, scan_jobs, scan_cache, document_outbox
+
+    # Initialize Supabase clients
+    try:
+        # Regular client for public/authenticated operations
+        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+        # Service role client for database operations (bypasses RLS)
+        if SUPABASE_SERVICE_KEY:
+            supabase_admin = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+        else:
+            supabase_admin = supabase
+            log("Service role key not provided, using regular client (RLS may block operations)")
+
+    except Exception as e:
+        log(f"Supabase client initialization warning: {e}")
+        supabase = None
+        supabase_admin = None
+
+    # Scans use one client per user (never the shared `supabase` client's auth state)
+    user_clients = UserClientPool(SUPABASE_URL, SUPABASE_KEY, max_clients=USER_CLIENT_CACHE_SIZE)
+
+    # Load docling models once per worker instead of once per request (docling is imported by the pool).
+    # Only used for conversions when OCR_WORKERS=0.
+    converter_pool = ConverterPool(size=CONVERTER_POOL_SIZE)
+
+    ocr_workers = OcrWorkerPool(
+        OCR_WORKERS, OCR_QUEUE_SIZE, max_jobs_per_worker=OCR_WORKER_MAX_JOBS, threads_per_worker=OCR_THREADS_PER_WORKER
+    ) if OCR_WORKERS > 0 else None
+
+    if CONVERTER_POOL_WARM == 'start':
+        start_ocr_in_background()
+
+    try:
+        chunked_uploads = ChunkedUploadStore(
+            CHUNKED_UPLOAD_DIR, MAX_UPLOAD_MB * 1024 * 1024, CHUNKED_UPLOAD_CHUNK_KB * 1024, CHUNKED_UPLOAD_TTL
+        ) if CHUNKED_UPLOAD_DIR else None
+    except Exception as e:
+        log(f"Chunked uploads disabled: {e}")
+        chunked_uploads = None
+
+    url_fetcher = UrlFetcher(
+        URL_FETCH_MAX_MB * 1024 * 1024,
+        connect_timeout=URL_FETCH_CONNECT_TIMEOUT,
+        read_timeout=URL_FETCH_READ_TIMEOUT,
+        deadline=URL_FETCH_DEADLINE,
+        max_concurrent=URL_FETCH_CONCURRENCY
+    )
+
+    derivative_queue = DerivativeQueue(DERIVATIVE_WORKERS, DERIVATIVE_QUEUE_SIZE) if DERIVATIVE_WORKERS > 0 else None
+
+    rate_limit_redis = redis_client(RATE_LIMIT_REDIS_URL, 'RATE_LIMIT_REDIS_URL')
+    rate_limiter = RateLimiter(
+        shared=RedisBuckets(rate_limit_redis) if rate_limit_redis else None, cooldown=RATE_LIMIT_REDIS_COOLDOWN
+    )
+
+    scan_admission = AdmissionGate(
+        MAX_CONCURRENT_SCANS, retry_after=lambda: ocr_workers.retry_after() if ocr_workers else 1
+    ) if MAX_CONCURRENT_SCANS > 0 else None
+
+    utility_cache = TTLCache(max_entries=50000, ttl=UTILITY_CACHE_TTL)
+    utility_cache_redis = (
+        rate_limit_redis if UTILITY_CACHE_REDIS_URL == RATE_LIMIT_REDIS_URL
+        else redis_client(UTILITY_CACHE_REDIS_URL, 'UTILITY_CACHE_REDIS_URL')
+    )
+    # Per-user generation in the utility_cache keys, bumped by invalidate_utility_cache()
+    utility_generations = SharedGenerations(utility_cache_redis) if utility_cache_redis else None
+
+    scan_jobs = ScanJobQueue(
+        SCAN_JOB_DB_PATH or ':memory:', max_workers=SCAN_JOB_WORKERS, result_ttl=SCAN_JOB_RESULT_TTL
+    ).start()
+
+    try:
+        scan_cache = ScanResultCache(
+            SCAN_CACHE_PATH, SCAN_CACHE_MAX_ENTRIES, SCAN_CACHE_MAX_BYTES, pipeline_version=scan_pipeline_version()
+        ) if SCAN_CACHE_PATH else None
+    except Exception as e:
+        log(f"Scan cache disabled: {e}")
+        scan_cache = None
+
+    try:
+        if DOCUMENT_OUTBOX_PATH and SUPABASE_SERVICE_KEY and supabase_admin:
+            document_outbox = DocumentOutbox(
+                DOCUMENT_OUTBOX_PATH, insert_documents_idempotent,
+                batch_size=DOCUMENT_OUTBOX_BATCH_SIZE, max_delay=DOCUMENT_OUTBOX_MAX_DELAY,
+                max_attempts=DOCUMENT_OUTBOX_MAX_ATTEMPTS
+            ).start()
+        else:
+            document_outbox = None
+            if DOCUMENT_OUTBOX_PATH:
+                log("Document outbox disabled: it needs SUPABASE_SERVICE_KEY; inserting synchronously")
+    except Exception as e:
+        log(f"Document outbox disabled: {e}")
+        document_outbox = None
+
+# OCR worker processes are started with 'spawn'. Under `python app.py` (or -m app) each one
+# imports this file again as __mp_main__, but it only needs converter_pool's worker functions:
+# skip the clients, stores, pools and threads there.
+if __name__ != '__mp_main__':
+    init_app()
+
+# Scrape-time gauges from the components' own stats (per worker process)
+registry.register(Gauge('bill_scan_ocr_jobs_in_flight', 'OCR jobs running or queued on the worker processes.',
+                        lambda: ocr_workers.stats()['in_flight'] if ocr_workers else 0))
+registry.register(Gauge('bill_scan_converters_busy', 'Pooled docling converters in use.',
+                        lambda: converter_pool.stats()['busy']))
+registry.register(Gauge('bill_scan_converter_waiters', 'Requests waiting for a docling converter.',
+                        lambda: converter_pool.stats()['waiting']))
+registry.register(Gauge('bill_scan_scans_in_flight', 'OCR requests admitted and running in this process.',
+                        lambda: scan_admission.stats()['in_flight'] if scan_admission else 0))
+registry.register(Gauge('bill_scan_url_downloads_in_flight', 'Downloads running for /process_url.',
+                        lambda: url_fetcher.stats()['in_flight']))
+registry.register(Gauge('bill_scan_document_outbox_pending', 'Document rows not yet delivered to the database.',
+                        lambda: document_outbox.stats()['pending'] if document_outbox else 0))
+registry.register(Gauge('bill_scan_document_outbox_oldest_pending_seconds',
+                        'Age of the oldest document row not yet delivered (alert when it keeps growing).',
+                        lambda: document_outbox.stats()['oldest_pending_age'] if document_outbox else 0))
+
 
 # --- AUTHENTICATION ROUTES (MODIFIED login function) ---
 
@@ -83,7 +533,9 @@ def login():
 
 @app.route('/logout')
 def logout():
-    session.pop('supabase_session', None) # Clear the session key
+    session_data = session.pop('supabase_session', None) # Clear the session key
+    if session_data:
+        user_clients.discard(session_data['user_id'])
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
 
@@ -97,122 +549,137 @@ def serve_sw():
 def serve_manifest():
     return send_from_directory('static', 'manifest.json', mimetype='application/json')
 
-def is_hk_electric_bill(text):
-    """Check if the document is a HK Electric bill"""
-    return "The Hongkong Electric Co., Ltd." in text and "HK Electric" in text
-
-def extract_bill_info(text):
-    """Extract specific information from HK Electric bill"""
-    info = {
-        'recipient_name': '',
-        'recipient_address': '',
-        'account_number': '',
-        'date_of_bill': '',
-        'amount_due': '',
-        'is_electric_bill': False
+def build_document_row(original_filename, extracted_data, file_url=None, user_id=None, document_type=None, property_id=None, tenant_id=None, lease_id=None, utility_id=None, idempotency_key=None):
+    """Build the `document` row dict for one scanned file (None values dropped)"""
+    document_data = {
+        'document_type': document_type or 'utility_bill',
+        'title': original_filename,
+        'file_urls': [file_url] if file_url else [],
+        'upload_date': datetime.now().isoformat(),
+        'extracted_data': extracted_data, # jsonb column (db/migrations/002)
+        'property_id': property_id,
+        'tenant_id': tenant_id,
+        'lease_id': lease_id,
+        'utility_id': utility_id, # NEW: utility_id added here
+        'user_id': user_id,
+        'idempotency_key': idempotency_key # Client-supplied for retried scans; the outbox adds one otherwise
     }
     
-    # Check if this is an HK Electric bill
-    if not is_hk_electric_bill(text):
-        return info
-    
-    info['is_electric_bill'] = is_hk_electric_bill(text)
-    
-    # Placeholder for extraction logic
-    if info['is_electric_bill']:    
-        # Extract recipient name (under company name)
-        name_pattern = r'The Hongkong Electric Co\., Ltd\.\s*\n([A-Z][A-Z\s]+)\n'
-        name_match = re.search(name_pattern, text)
-        if name_match:
-            info['recipient_name'] = name_match.group(1).strip()
-        
-        # Extract recipient address (multi-line after name)
-        address_section = re.search(r'The Hongkong Electric Co\., Ltd\.\s*\n[A-Z\s]+\n((?:.+\n)+?)(?=Residential|Account|Deposit|$)', text)
-        if address_section:
-            address_lines = address_section.group(1).strip().split('\n')
-            cleaned_address = []
-            for line in address_lines:
-                line = line.strip()
-                if line and not any(keyword in line for keyword in ['Residential', 'Tariff', 'Deposit', 'Account']):
-                    cleaned_address.append(line)
-            if cleaned_address:
-                info['recipient_address'] = ', '.join(cleaned_address)
-        
-        # Extract account number
-        account_pattern = r'Account Number\s*([0-9]{10})'
-        account_match = re.search(account_pattern, text)
-        if account_match:
-            info['account_number'] = account_match.group(1).strip()
-        
-        # Extract date of bill
-        date_pattern = r'Date of Bill\s*([0-9]{2}/[0-9]{2}/[0-9]{4})'
-        date_match = re.search(date_pattern, text)
-        if date_match:
-            info['date_of_bill'] = date_match.group(1).strip()
-        
-        # Extract amount due
-        amount_patterns = [
-            r'Please Pay This Amount\s*\$?\s*([0-9,]+\.?[0-9]*)',
-            r'Total Amount Due\s*\$?\s*([0-9,]+\.?[0-9]*)',
-            r'Amount Due\s*\$?\s*([0-9,]+\.?[0-9]*)'
-        ]
-        
-        for pattern in amount_patterns:
-            amount_matches = re.findall(pattern, text)
-            if amount_matches:
-                amount = amount_matches[-1].replace(',', '')
-                info['amount_due'] = amount
-                break
-        
-    return info
+    # Remove None values
+    return {k: v for k, v in document_data.items() if v is not None}
 
-def save_to_document_table(original_filename, extracted_data, file_url=None, user_id=None, document_type=None, property_id=None, tenant_id=None, lease_id=None, utility_id=None): # NEW: utility_id added
-    """Save document information to the document table using the standard client (MUST be authenticated for RLS)"""
+def save_to_document_table(original_filename, extracted_data, file_url=None, user_id=None, document_type=None, property_id=None, tenant_id=None, lease_id=None, utility_id=None, client=None): # NEW: utility_id added
+    """
+    Save document information to the document table using the standard client (MUST be authenticated for RLS).
+    Pass the user's `client` from user_clients; defaults to the shared anon client.
+    """
+    client = client or supabase
     # ... (Keep existing user_id check) ...
     if not user_id:
-        print("Error: User ID is required for RLS-compliant insert.")
+        log("Error: User ID is required for RLS-compliant insert.")
         return None
     
     try:
         # Prepare document data
-        document_data = {
-            'document_type': document_type or 'utility_bill',
-            'title': original_filename,
-            'file_urls': [file_url] if file_url else [],
-            'upload_date': datetime.now().isoformat(),
-            'extracted_data': json.dumps(extracted_data),
-            'property_id': property_id,
-            'tenant_id': tenant_id,
-            'lease_id': lease_id,
-            'utility_id': utility_id, # NEW: utility_id added here
-            'user_id': user_id
-        }
-        
-        # Remove None values
-        document_data = {k: v for k, v in document_data.items() if v is not None}
+        document_data = build_document_row(
+            original_filename, extracted_data, file_url=file_url, user_id=user_id, document_type=document_type,
+            property_id=property_id, tenant_id=tenant_id, lease_id=lease_id, utility_id=utility_id
+        )
         
         # Insert into document table using the STANDARD client (will be RLS-checked)
-        insert_result = supabase.table('document').insert(document_data).execute()
+        insert_result = client.table('document').insert(document_data).execute()
         
         if hasattr(insert_result, 'error') and insert_result.error:
              # PostgREST/RLS error is often in result.error
-            print(f"Database insert error: {insert_result.error}")
+            log(f"Database insert error: {insert_result.error}")
             return None
         
-        print(f"Document record created with ID: {insert_result.data[0]['id'] if insert_result.data else 'unknown'}")
+        log(f"Document record created with ID: {insert_result.data[0]['id'] if insert_result.data else 'unknown'}")
         return insert_result.data[0]['id'] if insert_result.data else None
         
     except APIError as e: # Catch PostgREST API/RLS errors explicitly
-        print(f"RLS/API Error during database insert: {e.message}")
+        log(f"RLS/API Error during database insert: {e.message}")
         return None
     except Exception as e:
-        print(f"Error saving to document table: {e}")
+        log(f"Error saving to document table: {e}")
         return None
 
+def save_documents_bulk(document_rows, client=None):
+    """
+    Insert many `document` rows in a single PostgREST request. Rows whose idempotency_key
+    is already stored (a retried scan) are skipped and resolve to the existing row's ID.
+    Returns the IDs in input order (None for a row that could not be resolved), or None
+    if the insert failed.
+    """
+    client = client or supabase
+    if not document_rows:
+        return []
+    
+    try:
+        # ON CONFLICT DO NOTHING: a retry with the same Idempotency-Key must not fail on the unique index
+        insert_result = client.table('document') \
+            .upsert(document_rows, on_conflict='idempotency_key', ignore_duplicates=True) \
+            .execute()
+        
+        if hasattr(insert_result, 'error') and insert_result.error:
+            log(f"Database bulk insert error: {insert_result.error}")
+            return None
+        
+        inserted = insert_result.data or []
+        log(f"Created {len(inserted)} document records in one insert")
+        ids_by_key = {row['idempotency_key']: row['id'] for row in inserted if row.get('idempotency_key')}
+        new_ids = iter(row['id'] for row in inserted if not row.get('idempotency_key'))
+        existing_keys = [
+            row['idempotency_key'] for row in document_rows
+            if row.get('idempotency_key') and row['idempotency_key'] not in ids_by_key
+        ]
+        if existing_keys:
+            existing = client.table('document').select('id, idempotency_key') \
+                .in_('idempotency_key', existing_keys).execute()
+            ids_by_key.update((row['idempotency_key'], row['id']) for row in existing.data or [])
+        return [
+            ids_by_key.get(row['idempotency_key']) if row.get('idempotency_key') else next(new_ids, None)
+            for row in document_rows
+        ]
+        
+    except APIError as e:
+        log(f"RLS/API Error during bulk database insert: {e.message}")
+        return None
+    except Exception as e:
+        log(f"Error bulk saving to document table: {e}")
+        return None
+
+def queue_documents(document_rows, client=None):
+    """
+    Journal `document` rows for write-behind delivery and return a save-status dict per
+    row. A journaled row is only queued (database_save_queued): database_save_success
+    stays False and document_id None until the outbox delivers it, which `document_key`
+    (the row's idempotency_key) can be polled for at /documents/pending/<key>. Falls back
+    to one synchronous bulk insert when the outbox is disabled or the journal cannot be written.
+    """
+    if not document_rows:
+        return []
+    if document_outbox:
+        try:
+            keys = document_outbox.enqueue(document_rows)
+            return [
+                {'document_id': None, 'document_key': key, 'database_save_success': False, 'database_save_queued': True}
+                for key in keys
+            ]
+        except Exception as e:
+            log(f"Document outbox write failed, inserting directly: {e}")
+    
+    document_ids = save_documents_bulk(document_rows, client=client)
+    statuses = []
+    for index in range(len(document_rows)):
+        document_id = document_ids[index] if document_ids else None
+        statuses.append({'document_id': document_id, 'database_save_success': document_id is not None})
+    return statuses
+
 def setup_rls_policies():
     """Setup Row Level Security policies for the document table to use auth.uid()"""
     if not supabase_admin or not SUPABASE_SERVICE_KEY:
-        print("Cannot setup RLS policies: Admin client not available (Service Role Key missing)")
+        log("Cannot setup RLS policies: Admin client not available (Service Role Key missing)")
         return False
     
     try:
@@ -238,72 +705,312 @@ def setup_rls_policies():
         
         # Execute the SQL using the ADMIN client
         result = supabase_admin.rpc('exec_sql', {'sql': policies_sql}).execute()
-        print("RLS policies setup completed (INSERT/SELECT limited to auth.uid())")
+        log("RLS policies setup completed (INSERT/SELECT limited to auth.uid())")
         return True
         
     except Exception as e:
-        print(f"Error setting up RLS policies: {e}")
+        log(f"Error setting up RLS policies: {e}")
         return False
 
-def search_utility_by_account(account_number, user_id):
+def search_utility_by_account(account_number, user_id, client=None):
     """
     Searches the utility table for a matching account_number 
-    belonging to the given user. Uses the RLS-authenticated 'supabase' client.
+    belonging to the given user. Uses the user's RLS-authenticated `client`.
     """
-    if not supabase or not account_number or not user_id:
+    if not account_number:
         return None
+    return search_utilities_by_accounts([account_number], user_id, client=client).get(account_number)
+
+def search_utilities_by_accounts(account_numbers, user_id, client=None):
+    """
+    Resolve many account numbers for one user with at most one `utility` query.
+    Answers (including "no match") come from utility_cache when fresh; only the
+    remaining numbers are queried. Returns {account_number: utility_id}; unmatched
+    numbers are simply absent.
+    """
+    client = client or supabase
+    account_numbers = sorted({a for a in account_numbers if a})
+    if not client or not account_numbers or not user_id:
+        return {}
+    
+    # None when the shared generations are unavailable: then the cache is bypassed
+    generation = utility_generations.get(user_id) if utility_generations else 0
+    matches = {}
+    missing = []
+    for account_number in account_numbers:
+        cached = utility_cache.get((user_id, generation, account_number)) if generation is not None else MISSING
+        if cached is MISSING:
+            missing.append(account_number)
+        elif cached is not None:
+            matches[account_number] = cached
+    if not missing:
+        return matches
     
     try:
-        # Assumes utility RLS policy allows SELECT where auth.uid() = user_id
-        result = supabase.table('utility').select('id').eq('account_number', account_number).execute()
+        # Served by utility_user_account_idx (db/migrations/003)
+        result = client.table('utility').select('id, account_number') \
+            .eq('user_id', user_id) \
+            .in_('account_number', missing) \
+            .order('id') \
+            .execute()
         
-        if result.data and len(result.data) > 0:
-            # Return the first matching utility ID
-            return result.data[0]['id']
-        
-        return None
+        found = {}
+        for row in result.data or []:
+            # Return the first matching utility ID per account
+            found.setdefault(row['account_number'], row['id'])
+        for account_number in missing:
+            utility_id = found.get(account_number)
+            # Cache misses for less time: a utility added elsewhere should be picked up soon
+            if generation is not None:
+                utility_cache.set((user_id, generation, account_number), utility_id,
+                                  ttl=None if utility_id is not None else UTILITY_CACHE_MISS_TTL)
+        matches.update(found)
+        return matches
         
     except APIError as e:
         # Catch RLS errors on utility table or other API failures
-        print(f"RLS/API Error during utility search: {e.message}")
-        return None
+        log(f"RLS/API Error during utility search: {e.message}")
+        return matches
     except Exception as e:
-        print(f"Error during utility search: {e}")
-        return None
+        log(f"Error during utility search: {e}")
+        return matches
+
+def invalidate_utility_cache(user_id):
+    """
+    Forget cached account matches for a user; call after their utility rows change.
+    Drops this process's entries and, with shared generations, starts a new generation
+    so every other process stops using its entries too. Returns the local count dropped.
+    """
+    if utility_generations:
+        utility_generations.bump(user_id)
+    return utility_cache.invalidate(lambda key: key[0] == user_id)
 
 @app.route('/')
 def index():
     # NEW: Pass session status to template for UI display
     is_logged_in = 'supabase_session' in session
-    return render_template('index.html', is_logged_in=is_logged_in)
+    if is_logged_in and CONVERTER_POOL_WARM == 'page':
+        # A scan is likely next: load the models while the user picks a file
+        start_ocr_in_background()
+    # The page downscales photos to the size the server would reduce them to anyway
+    return render_template(
+        'index.html', is_logged_in=is_logged_in, max_image_edge=max_long_edge(IMAGE_PREP_OPTIONS['target_dpi'])
+    )
 
-@app.route('/scan', methods=['POST'])
-def scan_document():
-    """Endpoint to scan and process uploaded document, NOW including storage upload"""
+def submit_ocr(source, image_options=None, wait=False):
+    """
+    Start converting `source` and return a Future of (markdown, bill_info). Runs on an OCR
+    worker process, or inline on converter_pool when OCR_WORKERS=0. Raises OcrQueueFull when
+    the workers' queue is full, unless `wait` is set (background jobs wait for a slot).
+    """
+    future = Future()
+    if ocr_workers:
+        record_spans = span_recorder()
+        worker_future = ocr_workers.submit(convert_and_extract_in_process, source, FAST_OCR_PAGES, image_options, wait=wait)
+
+        def unpack(done):
+            # The worker's stage timings are recorded here, before result() returns to the request
+            try:
+                markdown, bill_info, spans = done.result()
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            record_spans(spans)
+            future.set_result((markdown, bill_info))
+        worker_future.add_done_callback(unpack)
+        return future
+    try:
+        with normalized_for_ocr(source, **(image_options or {'enabled': False})) as ocr_path:
+            future.set_result(convert_and_extract(converter_pool, ocr_path, FAST_OCR_PAGES))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def upload_original(digest, file_path, original_filename, file_mime_type, user_id, client):
+    """
+    Upload the original file to Supabase Storage under the user's prefix.
+    Reuses the object this user already uploaded for an identical file.
+    Returns (public_url, duplicate_upload).
+    """
+    storage_path = scan_cache.get_storage_path(digest, user_id) if scan_cache else None
+    duplicate_upload = storage_path is not None
+    if not duplicate_upload:
+        # Use user's ID or UUID + original name for path
+        unique_filename = f"{uuid.uuid4()}-{original_filename}"
+        storage_path = f"{user_id}/{unique_filename}"
+
+        # The upload_response variable now receives a non-dict object (UploadResponse) on success.
+        # We skip the manual dict check as the SDK will raise an exception on failure.
+        with open(file_path, 'rb') as upload_stream: # Streamed from disk, never read into memory
+            client.storage.from_(BUCKET_NAME).upload(
+                file=upload_stream,
+                path=storage_path, 
+                file_options={"content-type": file_mime_type}
+            )
+
+        # The manual error check is removed to resolve the "not iterable" error.
+        # We proceed, assuming the upload was successful since no exception was raised.
+        if scan_cache:
+            scan_cache.set_storage_path(digest, user_id, storage_path)
+        
+        # Thumbnail and preview for list views, rendered after the response
+        if derivative_queue:
+            derivative_queue.submit(
+                file_path, lambda rendered: upload_derivatives(client, storage_path, rendered)
+            )
+
+    # Get the public URL for the saved file (if the bucket is public)
+    return client.storage.from_(BUCKET_NAME).get_public_url(storage_path), duplicate_upload
+
+def upload_derivatives(client, storage_path, rendered):
+    """Store rendered {name: WebP bytes} next to the original at `storage_path`"""
+    for name, data in rendered.items():
+        client.storage.from_(BUCKET_NAME).upload(
+            file=data,
+            path=derivative_path(storage_path, name),
+            file_options={'content-type': 'image/webp', 'cache-control': str(DERIVATIVE_MAX_AGE), 'upsert': 'true'}
+        )
+
+def storage_path_from_url(file_url):
+    """Object path inside BUCKET_NAME for a URL from get_public_url, or None for other URLs"""
+    marker = f'/object/public/{BUCKET_NAME}/'
+    path = urlsplit(file_url or '').path
+    if marker not in path:
+        return None
+    return unquote(path.split(marker, 1)[1])
+
+def run_scan_pipeline(temp_file_path, original_filename, file_mime_type, user_id, client,
+                      document_type=None, property_id=None, tenant_id=None, lease_id=None, report_progress=None,
+                      wait_for_ocr=False, idempotency_key=None):
+    """
+    OCR -> extract_bill_info -> Storage upload -> document insert for one uploaded file.
+    Shared by the synchronous /scan path and background scan jobs. Returns bill_info.
+    Raises OcrQueueFull when the OCR workers are saturated, unless `wait_for_ocr` is set.
+    """
+    def progress(stage, percent):
+        if report_progress:
+            report_progress(stage, percent)
+
+    # --- 2. PERFORM OCR (skipped when this exact file was converted before) ---
+    with stage('digest'):
+        digest = file_digest(temp_file_path)
+    with stage('ocr_cache'):
+        cached = scan_cache.get(digest) if scan_cache else None
+    if cached:
+        progress('extracting', 60)
+        bill_info = cached['bill_info']
+    else:
+        progress('converting', 10)
+        with stage('ocr'): # Queue wait + image prep + docling + extraction on the OCR worker
+            extracted_text, bill_info = submit_ocr(temp_file_path, IMAGE_PREP_OPTIONS, wait=wait_for_ocr).result()
+        progress('extracting', 60)
+        if scan_cache:
+            with stage('ocr_cache'):
+                scan_cache.put(digest, extracted_text, bill_info)
+    bill_info['ocr_cache_hit'] = cached is not None
+
+    utility_id_found = None
+    account_number = bill_info.get('account_number')
     
-    # --- AUTHENTICATION CHECK ---
+    if account_number:
+        with stage('utility_lookup'):
+            utility_id_found = search_utility_by_account(account_number, user_id, client=client)
+    
+    bill_info['utility_id_match'] = utility_id_found
+
+    # --- 3. UPLOAD TO SUPABASE STORAGE ---
+    progress('uploading', 70)
+    with stage('storage_upload'):
+        uploaded_file_url, duplicate_upload = upload_original(
+            digest, temp_file_path, original_filename, file_mime_type, user_id, client
+        )
+    bill_info['duplicate_upload'] = duplicate_upload
+    bill_info['uploaded_file_url'] = uploaded_file_url
+    bill_info['upload_success'] = True
+    
+    # --- 4. SAVE METADATA TO DATABASE (journaled; the outbox delivers it) ---
+    progress('saving', 90)
+    document_row = build_document_row(
+        original_filename=original_filename,
+        extracted_data=bill_info,
+        file_url=uploaded_file_url, # Pass the URL to be saved
+        user_id=user_id,
+        document_type=document_type,
+        property_id=property_id,
+        tenant_id=tenant_id,
+        lease_id=lease_id,
+        utility_id=utility_id_found,
+        idempotency_key=idempotency_key
+    )
+    with stage('db_insert'):
+        bill_info.update(queue_documents([document_row], client=client)[0])
+    
+    return bill_info
+
+def _authenticate_scan_request():
+    """
+    Require a logged-in user and get their authenticated Supabase client.
+    Returns (session_data, client, None) or (None, None, error_response).
+    """
     if 'supabase_session' not in session:
-        return jsonify({'error': 'Authentication required. Please log in first.'}), 401
+        return None, None, (jsonify({'error': 'Authentication required. Please log in first.'}), 401)
     
-    # Get tokens
     session_data = session['supabase_session']
-    access_token = session_data['access_token']
-    refresh_token = session_data['refresh_token']
-    user_id_from_session = session_data['user_id'] # NEW: Retrieve user ID
     
-    # Set the authenticated session on the global client for the request
     try:
-        supabase.auth.set_session(access_token, refresh_token) 
+        client, access_token, refresh_token = user_clients.get(
+            session_data['user_id'], session_data['access_token'], session_data['refresh_token']
+        )
     except Exception as e:
         # Token is likely expired. Clear session and force re-login.
         session.pop('supabase_session', None)
-        return jsonify({'error': f'Session Expired or Error: {str(e)}. Please log in again.'}), 401
+        return None, None, (jsonify({'error': f'Session Expired or Error: {str(e)}. Please log in again.'}), 401)
+    
+    if access_token != session_data['access_token']:
+        # Tokens were refreshed: keep the new pair for the next request
+        session_data = dict(session_data, access_token=access_token, refresh_token=refresh_token)
+        session['supabase_session'] = session_data
+    
+    return session_data, client, None
+
+def _scan_form_metadata():
+    """Read document_type and the optional numeric property/tenant/lease IDs from the scan form"""
+    document_type = request.form.get('document_type', 'utility_bill')
+    
+    def form_int(name):
+        # Convert numeric IDs to integers if provided
+        value = request.form.get(name)
+        if not value:
+            return value
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    
+    return document_type, form_int('property_id'), form_int('tenant_id'), form_int('lease_id')
+
+@app.route('/scan', methods=['POST'])
+@admission_controlled
+def scan_document():
+    """
+    Endpoint to scan and process uploaded document, NOW including storage upload.
+    Send async=1 (query string or form field) to get a job id back immediately instead.
+    """
+    
+    # --- AUTHENTICATION CHECK ---
+    session_data, client, auth_error = _authenticate_scan_request()
+    if auth_error:
+        return auth_error
+    
+    user_id_from_session = session_data['user_id'] # NEW: Retrieve user ID
     
     # --- FILE HANDLING ---
-    if 'file' not in request.files:
+    with stage('upload_spool'): # The multipart body is parsed (and spooled to disk) on first access
+        uploaded_files = request.files
+    if 'file' not in uploaded_files:
         return jsonify({'error': 'No file uploaded'}), 400
     
-    file = request.files['file']
+    file = uploaded_files['file']
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     
@@ -311,115 +1018,383 @@ def scan_document():
     if not allowed_file(original_filename):
         return jsonify({'error': 'File type not allowed.'}), 400
     
-    document_type = request.form.get('document_type', 'utility_bill')
-    property_id = request.form.get('property_id')
-    tenant_id = request.form.get('tenant_id')
-    lease_id = request.form.get('lease_id')
+    try:
+        # --- 1. THE UPLOAD WAS SPOOLED TO A TEMPORARY FILE WHILE THE BODY WAS PARSED ---
+        pipeline_args = _scan_pipeline_args(spooled_upload_path(file), original_filename, user_id_from_session)
+
+        # --- JOB MODE: hand the pipeline to the background queue and return immediately ---
+        if _scan_is_async():
+            # The job owns the temp file from here on and removes it when done
+            pipeline_args['temp_file_path'] = claim_spooled_upload(file)
+            return _submit_scan_job(session_data, pipeline_args)
+
+        bill_info = run_scan_pipeline(client=client, **pipeline_args)
+        return jsonify(bill_info)
+        
+    except OcrQueueFull:
+        raise # Answered with 429 and Retry-After by ocr_queue_full()
+    except Exception as e:
+        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+
+def _scan_pipeline_args(temp_file_path, original_filename, user_id):
+    """run_scan_pipeline arguments for an uploaded file plus the scan form's metadata"""
+    document_type, property_id, tenant_id, lease_id = _scan_form_metadata()
+    file_mime_type, _ = mimetypes.guess_type(original_filename)
+    return dict(
+        temp_file_path=temp_file_path,
+        original_filename=original_filename,
+        file_mime_type=file_mime_type or 'application/octet-stream',
+        user_id=user_id,
+        document_type=document_type,
+        property_id=property_id,
+        tenant_id=tenant_id,
+        lease_id=lease_id,
+        idempotency_key=_scan_idempotency_key(user_id)
+    )
+
+def _scan_idempotency_key(user_id):
+    """
+    Document key for an `Idempotency-Key` request header, so a client replaying a scan
+    (e.g. the service worker's offline queue) gets one document row however often it
+    retries. Any string is accepted; it is mapped to a UUID scoped to the user.
+    """
+    key = request.headers.get('Idempotency-Key')
+    if not key:
+        return None
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f'{user_id}/{key}'))
+
+def _scan_is_async():
+    return request.args.get('async') == '1' or request.form.get('async') == '1'
+
+def _submit_scan_job(session_data, pipeline_args):
+    """Queue the pipeline as a background job (which deletes the temp file) and answer 202 with its URLs"""
+    job_id = scan_jobs.submit(
+        _run_scan_job,
+        access_token=session_data['access_token'],
+        refresh_token=session_data['refresh_token'],
+        owner_id=session_data['user_id'],
+        temp_path=pipeline_args['temp_file_path'],
+        **pipeline_args
+    )
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('get_scan_job', job_id=job_id),
+        'events_url': url_for('stream_scan_job', job_id=job_id)
+    }), 202
+
+# --- RESUMABLE CHUNKED UPLOADS ---
+# POST /uploads {filename, size} -> upload_id; PUT /uploads/<id>?offset=N with each chunk as the raw body;
+# GET /uploads/<id> for the offset to resume from; POST /uploads/<id>/scan runs the /scan pipeline on it.
+
+@app.errorhandler(UploadError)
+def upload_error(e):
+    body = {'error': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    return jsonify(body), e.status
+
+def _require_uploads():
+    if 'supabase_session' not in session:
+        return None, (jsonify({'error': 'Authentication required. Please log in first.'}), 401)
+    if not chunked_uploads:
+        return None, (jsonify({'error': 'Chunked uploads are disabled'}), 404)
+    return session['supabase_session']['user_id'], None
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Endpoint to start a resumable upload; returns its id and the chunk size to use"""
+    user_id, error = _require_uploads()
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    original_filename = secure_filename(data.get('filename') or '')
+    if not original_filename or not allowed_file(original_filename):
+        return jsonify({'error': 'File type not allowed.'}), 400
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size (bytes) is required'}), 400
+    upload = chunked_uploads.create(user_id, original_filename, size)
+    return jsonify({
+        'upload_id': upload['upload_id'],
+        'offset': 0,
+        'size': size,
+        'chunk_size': chunked_uploads.chunk_bytes,
+        'upload_url': url_for('upload_chunk', upload_id=upload['upload_id'])
+    }), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Endpoint to find where an interrupted upload should resume"""
+    user_id, error = _require_uploads()
+    if error:
+        return error
+    upload = chunked_uploads.get(upload_id, user_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify({'upload_id': upload_id, 'offset': upload['offset'], 'size': upload['size']})
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Endpoint to append one chunk (raw body) at ?offset=; a mismatched offset gets 409 with the right one"""
+    user_id, error = _require_uploads()
+    if error:
+        return error
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'error': 'offset is required'}), 400
+    with stage('upload_chunk'):
+        new_offset = chunked_uploads.append(upload_id, user_id, offset, request.stream, request.content_length)
+    return jsonify({'upload_id': upload_id, 'offset': new_offset})
+
+@app.route('/uploads/<upload_id>/scan', methods=['POST'])
+@admission_controlled
+def scan_upload(upload_id):
+    """Endpoint to run the /scan pipeline on a completed upload (same form fields and async=1 as /scan)"""
+    _, error = _require_uploads()
+    if error:
+        return error
+    session_data, client, auth_error = _authenticate_scan_request()
+    if auth_error:
+        return auth_error
     
-    # Convert numeric IDs to integers if provided
-    if property_id:
-        try:
-            property_id = int(property_id)
-        except ValueError:
-            property_id = None
+    upload = chunked_uploads.get(upload_id, session_data['user_id'])
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    _, ext = os.path.splitext(upload['filename'])
+    upload, file_path = chunked_uploads.claim(upload_id, session_data['user_id'], suffix=ext.lower())
     
-    if tenant_id:
+    file_owner = None # Who deletes file_path: the job, this request, or nobody (released back)
+    try:
+        pipeline_args = _scan_pipeline_args(file_path, upload['filename'], session_data['user_id'])
+        if _scan_is_async():
+            response = _submit_scan_job(session_data, pipeline_args)
+            file_owner = 'job'
+            return response
         try:
-            tenant_id = int(tenant_id)
-        except ValueError:
-            tenant_id = None
-    
-    if lease_id:
+            bill_info = run_scan_pipeline(client=client, **pipeline_args)
+        except OcrQueueFull:
+            # Keep the uploaded bytes: the client retries the scan without uploading again
+            chunked_uploads.release(upload_id, file_path)
+            file_owner = 'store'
+            raise
+        return jsonify(bill_info)
+    except OcrQueueFull:
+        raise
+    except Exception as e:
+        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+    finally:
+        if file_owner != 'store':
+            chunked_uploads.forget(upload_id)
+        if file_owner is None:
+            os.unlink(file_path)
+
+def _run_scan_job(temp_file_path, access_token, refresh_token, report_progress=None, **pipeline_args):
+    """Background job body: get the user's Supabase client, run the pipeline, then remove the temp file"""
+    try:
+        # The job may start long after the request, so let the pool refresh the tokens if needed;
+        # it keeps any new pair for the user's next request, which stores it in the session
+        client, _, _ = user_clients.get(pipeline_args['user_id'], access_token, refresh_token, store_back=False)
+        # Jobs were already accepted, so they wait for an OCR slot instead of failing
+        return run_scan_pipeline(
+            temp_file_path=temp_file_path, client=client, report_progress=report_progress, wait_for_ocr=True,
+            **pipeline_args
+        )
+    finally:
         try:
-            lease_id = int(lease_id)
-        except ValueError:
-            lease_id = None
+            os.unlink(temp_file_path)
+        except OSError:
+            pass
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_scan_job(job_id):
+    """Endpoint to poll the status, progress and final bill_info of a queued scan"""
+    job = _get_owned_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(_public_job(job))
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_scan_job(job_id):
+    """Server-Sent Events stream of a scan job's progress, closed once the job finishes"""
+    job = _get_owned_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        current = job
+        while True:
+            yield f"data: {json.dumps(_public_job(current))}\n\n"
+            if current['status'] in TERMINAL_STATES:
+                return
+            changed = scan_jobs.wait_for_change(job_id, current['version'])
+            if changed is None:
+                return
+            if changed['version'] == current['version']:
+                yield ": keep-alive\n\n"
+            current = changed
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _get_owned_job(job_id):
+    """Look up a job, hiding jobs that belong to another user"""
+    if 'supabase_session' not in session:
+        return None
+    job = scan_jobs.get(job_id)
+    if job is None or job['owner_id'] != session['supabase_session']['user_id']:
+        return None
+    return job
+
+def _public_job(job):
+    return {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'progress': job['progress'],
+        'bill_info': job['result'],
+        'error': job['error']
+    }
+
+@app.route('/scan/batch', methods=['POST'])
+@admission_controlled
+def scan_batch():
+    """
+    Endpoint to scan many uploaded files (form field `files`) in one request.
+    Conversions run in parallel on a process pool, account numbers are resolved with
+    one `utility` query and all `document` rows are written with one bulk insert.
+    """
+    session_data, client, auth_error = _authenticate_scan_request()
+    if auth_error:
+        return auth_error
+    user_id_from_session = session_data['user_id']
+    
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+    if len(files) > BATCH_SCAN_MAX_FILES:
+        return jsonify({'error': f'Too many files: at most {BATCH_SCAN_MAX_FILES} per batch.'}), 400
+    # admission_controlled charged one token; a batch costs one per file
+    charge_rate_limits(len(files) - 1, charged=1)
     
-    temp_file_path = None
-    uploaded_file_url = None
+    document_type, property_id, tenant_id, lease_id = _scan_form_metadata()
+    
+    # One entry per uploaded file, in request order; 'error' marks a failed file
+    items = []
     
     try:
-        # Read file content for both OCR (via temp file) and Supabase upload
-        file_content = file.read()
-        file_mime_type, _ = mimetypes.guess_type(original_filename)
-        if not file_mime_type:
-            file_mime_type = 'application/octet-stream'
-
-        # --- 1. SAVE TO TEMPORARY FILE FOR OCR ---
-        # Create temporary file (use original extension for DocumentConverter)
-        _, ext = os.path.splitext(original_filename)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as temp_file:
-            temp_file.write(file_content)
-            temp_file_path = temp_file.name
-
-        # --- 2. PERFORM OCR ---
-        converter = DocumentConverter()
-        result = converter.convert(temp_file_path)
-        extracted_text = result.document.export_to_markdown()
-        bill_info = extract_bill_info(extracted_text)
-
-        utility_id_found = None
-        account_number = bill_info.get('account_number')
+        # --- 1. CHECK THE OCR CACHE FOR EACH SPOOLED FILE ---
+        for file in files:
+            original_filename = secure_filename(file.filename)
+            item = {'filename': original_filename}
+            items.append(item)
+            if not allowed_file(original_filename):
+                item['error'] = 'File type not allowed.'
+                continue
+            
+            file_mime_type, _ = mimetypes.guess_type(original_filename)
+            item['file_path'] = spooled_upload_path(file)
+            item['file_mime_type'] = file_mime_type or 'application/octet-stream'
+            item['digest'] = file_digest(item['file_path'])
+            
+            cached = scan_cache.get(item['digest']) if scan_cache else None
+            if cached:
+                item['bill_info'] = cached['bill_info']
+                item['bill_info']['ocr_cache_hit'] = True
         
-        if account_number:
-            utility_id_found = search_utility_by_account(account_number, user_id_from_session)
+        # --- 2. CONVERT CACHE MISSES IN PARALLEL ON THE OCR WORKERS ---
+        futures = {}
+        retry_after = None
+        for item in items:
+            if 'file_path' not in item or 'bill_info' in item:
+                continue
+            try:
+                futures[id(item)] = submit_ocr(item['file_path'], IMAGE_PREP_OPTIONS)
+            except OcrQueueFull as e:
+                # Files that did not fit in the queue fail individually; the client resubmits them
+                item['error'] = 'OCR workers are busy. Please retry this file shortly.'
+                retry_after = e.retry_after
+        if retry_after and not futures and not any('bill_info' in item for item in items):
+            raise OcrQueueFull(retry_after)
+        for item in items:
+            future = futures.get(id(item))
+            if future is None:
+                continue
+            try:
+                # Conversion runs on an OCR worker; this span is the wait for its result
+                with stage('batch_convert_wait'):
+                    extracted_text, bill_info = future.result()
+                if scan_cache:
+                    scan_cache.put(item['digest'], extracted_text, bill_info)
+                item['bill_info'] = bill_info
+                item['bill_info']['ocr_cache_hit'] = False
+            except Exception as e:
+                item['error'] = f'Processing failed: {str(e)}'
         
-        bill_info['utility_id_match'] = utility_id_found
-
-        # --- 3. UPLOAD TO SUPABASE STORAGE ---
-        # Use user's ID or UUID + original name for path
-        unique_filename = f"{uuid.uuid4()}-{original_filename}"
-        storage_path = f"{user_id_from_session}/{unique_filename}"
-
-        # The upload_response variable now receives a non-dict object (UploadResponse) on success.
-        # We skip the manual dict check as the SDK will raise an exception on failure.
-        supabase.storage.from_(BUCKET_NAME).upload(
-            file=file_content, # Upload the content read earlier
-            path=storage_path, 
-            file_options={"content-type": file_mime_type}
-        )
-
-        # The manual error check is removed to resolve the "not iterable" error.
-        # We proceed, assuming the upload was successful since no exception was raised.
-
-        # Get the public URL for the saved file (if the bucket is public)
-        uploaded_file_url = supabase.storage.from_(BUCKET_NAME).get_public_url(storage_path)
-        bill_info['uploaded_file_url'] = uploaded_file_url
-        bill_info['upload_success'] = True
+        # --- 3. RESOLVE ALL ACCOUNT NUMBERS WITH ONE QUERY ---
+        scanned = [item for item in items if 'bill_info' in item]
+        with stage('utility_lookup'):
+            utility_ids = search_utilities_by_accounts(
+                [item['bill_info'].get('account_number') for item in scanned], user_id_from_session, client=client
+            )
         
-        # --- 4. SAVE METADATA TO DATABASE ---
-        document_id = save_to_document_table(
-            original_filename=original_filename,
-            extracted_data=bill_info,
-            file_url=uploaded_file_url, # Pass the URL to be saved
-            user_id=user_id_from_session,
-            document_type=document_type,
-            property_id=property_id,
-            tenant_id=tenant_id,
-            lease_id=lease_id,
-            utility_id=utility_id_found
-        )
+        # --- 4. UPLOAD ORIGINALS ---
+        rows = []
+        for item in scanned:
+            bill_info = item['bill_info']
+            utility_id_found = utility_ids.get(bill_info.get('account_number'))
+            bill_info['utility_id_match'] = utility_id_found
+            try:
+                uploaded_file_url, duplicate_upload = upload_original(
+                    item['digest'], item['file_path'], item['filename'], item['file_mime_type'],
+                    user_id_from_session, client
+                )
+            except Exception as e:
+                item['error'] = f'Upload failed: {str(e)}'
+                continue
+            bill_info['duplicate_upload'] = duplicate_upload
+            bill_info['uploaded_file_url'] = uploaded_file_url
+            bill_info['upload_success'] = True
+            rows.append((item, build_document_row(
+                original_filename=item['filename'],
+                extracted_data=bill_info,
+                file_url=uploaded_file_url,
+                user_id=user_id_from_session,
+                document_type=document_type,
+                property_id=property_id,
+                tenant_id=tenant_id,
+                lease_id=lease_id,
+                utility_id=utility_id_found
+            )))
         
-        if document_id:
-            bill_info['document_id'] = document_id
-            bill_info['database_save_success'] = True
-        else:
-            bill_info['document_id'] = None
-            bill_info['database_save_success'] = False
+        # --- 5. SAVE ALL METADATA (one journal write, delivered in batches) ---
+        with stage('db_insert'):
+            statuses = queue_documents([row for _, row in rows], client=client)
+        for (item, _), status in zip(rows, statuses):
+            item['bill_info'].update(status)
         
-        return jsonify(bill_info)
+        results = []
+        for item in items:
+            if 'error' in item:
+                results.append({'filename': item['filename'], 'error': item['error']})
+            else:
+                results.append(dict(item['bill_info'], filename=item['filename']))
+        failed = sum(1 for result in results if 'error' in result)
+        response = jsonify({'results': results, 'processed': len(results) - failed, 'failed': failed,
+                            'retry_after': retry_after})
+        if retry_after:
+            response.headers['Retry-After'] = str(retry_after)
+        return response
         
+    except OcrQueueFull:
+        raise
     except Exception as e:
-        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
-    finally:
-        # Clean up temporary file
-        if temp_file_path:
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
+        return jsonify({'error': f'Batch processing failed: {str(e)}'}), 500
 
 @app.route('/process_url', methods=['POST'])
+@admission_controlled
 def process_url():
     """Endpoint to process document from URL - only save to database"""
     data = request.get_json()
@@ -437,27 +1412,23 @@ def process_url():
         return jsonify({'error': 'No URL provided'}), 400
     
     try:
-        # Convert URL to document
-        converter = DocumentConverter()
-        result = converter.convert(url)
-        extracted_text = result.document.export_to_markdown()
-        
-        # Extract bill information
-        bill_info = extract_bill_info(extracted_text)
+        # Download (or revalidate) the document and extract bill information
+        bill_info = convert_url(url)
         
         # For URL processing, store the original URL in file_urls
         bill_info['original_url'] = url
         
         # Save to document table with extracted data
-        document_id = save_to_document_table(
-            original_filename=url.split('/')[-1] if '/' in url else url,
-            extracted_data=bill_info,
-            user_id=user_id,
-            document_type=document_type,
-            property_id=property_id,
-            tenant_id=tenant_id,
-            lease_id=lease_id
-        )
+        with stage('db_insert'):
+            document_id = save_to_document_table(
+                original_filename=url.split('/')[-1] if '/' in url else url,
+                extracted_data=bill_info,
+                user_id=user_id,
+                document_type=document_type,
+                property_id=property_id,
+                tenant_id=tenant_id,
+                lease_id=lease_id
+            )
         
         if document_id:
             bill_info['document_id'] = document_id
@@ -471,10 +1442,44 @@ def process_url():
         
         return jsonify(bill_info)
         
+    except (OcrQueueFull, UrlFetchError):
+        raise
     except Exception as e:
         return jsonify({'error': f'Processing failed: {str(e)}'}), 500
 
+def convert_url(url):
+    """
+    bill_info for a remote document. The download is conditional when the URL was fetched
+    before (ETag / Last-Modified): an unchanged document reuses the cached conversion
+    without being downloaded again, and a changed one is converted only if its content
+    (digest) is new.
+    """
+    validators = scan_cache.get_url_validators(url) if scan_cache else None
+    with stage('url_fetch'):
+        fetched = url_fetcher.fetch(url, validators)
+    try:
+        cached = scan_cache.get(fetched.digest) if scan_cache else None
+        if cached is None and fetched.not_modified:
+            # The cached result was evicted after the validators were read: download it again
+            with stage('url_fetch'):
+                fetched = url_fetcher.fetch(url)
+        if scan_cache and not fetched.not_modified and (fetched.etag or fetched.last_modified):
+            scan_cache.set_url_validators(url, fetched.etag, fetched.last_modified, fetched.digest)
+        if cached:
+            bill_info = cached['bill_info']
+        else:
+            with stage('ocr'):
+                extracted_text, bill_info = submit_ocr(fetched.path, IMAGE_PREP_OPTIONS).result()
+            if scan_cache:
+                scan_cache.put(fetched.digest, extracted_text, bill_info)
+        bill_info['ocr_cache_hit'] = cached is not None
+        bill_info['download_skipped'] = fetched.not_modified
+        return bill_info
+    finally:
+        fetched.close()
+
 @app.route('/test_sample')
+@admission_controlled
 def test_sample():
     """Test endpoint using the sample address.jpeg - only save to database"""
     try:
@@ -484,12 +1489,8 @@ def test_sample():
         if not os.path.exists(sample_path):
             return jsonify({'error': 'Sample file not found'}), 404
             
-        converter = DocumentConverter()
-        result = converter.convert(sample_path)
-        extracted_text = result.document.export_to_markdown()
-        
-        # Extract bill information
-        bill_info = extract_bill_info(extracted_text)
+        # Convert and extract bill information
+        extracted_text, bill_info = submit_ocr(sample_path, IMAGE_PREP_OPTIONS).result()
         
         # Save to document table (skip storage upload)
         document_id = save_to_document_table(
@@ -526,9 +1527,129 @@ def setup_rls_endpoint():
     except Exception as e:
         return jsonify({'error': f'RLS setup failed: {str(e)}'}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint: per-stage and per-request latency histograms plus pool gauges (this worker process)"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ocr_workers/stats', methods=['GET'])
+def ocr_workers_stats():
+    """Endpoint to inspect the OCR worker processes (queue depth, rejections, restarts, job latency)"""
+    if not ocr_workers:
+        return jsonify({'enabled': False})
+    return jsonify(dict(ocr_workers.stats(), enabled=True))
+
+@app.route('/rate_limits/stats', methods=['GET'])
+def rate_limits_stats():
+    """Endpoint to inspect admission control: requests allowed and limited per scope, scans in flight, rejections"""
+    return jsonify({
+        'rate_limits': rate_limiter.stats(),
+        'concurrent_scans': scan_admission.stats() if scan_admission else {'limit': None}
+    })
+
+@app.route('/url_fetcher/stats', methods=['GET'])
+def url_fetcher_stats():
+    """Endpoint to inspect /process_url downloads (in flight, 304 revalidations, failures, rejections)"""
+    return jsonify(url_fetcher.stats())
+
+@app.route('/derivatives/stats', methods=['GET'])
+def derivatives_stats():
+    """Endpoint to inspect background thumbnail/preview rendering (pending, failed, skipped when full)"""
+    if not derivative_queue:
+        return jsonify({'enabled': False})
+    return jsonify(dict(derivative_queue.stats(), enabled=True))
+
+@app.route('/converter_pool/stats', methods=['GET'])
+def converter_pool_stats():
+    """Endpoint to inspect the warm DocumentConverter pool (wait time, busy count, warm-up time)"""
+    return jsonify(converter_pool.stats())
+
+@app.route('/user_clients/stats', methods=['GET'])
+def user_clients_stats():
+    """Endpoint to inspect the per-user Supabase client cache"""
+    return jsonify(user_clients.stats())
+
+@app.route('/utilities/cache/stats', methods=['GET'])
+def utility_cache_stats():
+    """Endpoint to inspect the account_number -> utility_id match cache"""
+    return jsonify(utility_cache.stats())
+
+@app.route('/utilities/cache/invalidate', methods=['POST'])
+def invalidate_utilities_cache():
+    """Endpoint for clients that edit utility rows: drop the caller's cached account matches"""
+    if 'supabase_session' not in session:
+        return jsonify({'error': 'Authentication required. Please log in first.'}), 401
+    dropped = invalidate_utility_cache(session['supabase_session']['user_id'])
+    return jsonify({'invalidated': dropped, 'all_processes': utility_generations is not None})
+
+@app.route('/documents/pending/<document_key>', methods=['GET'])
+def get_pending_document(document_key):
+    """Endpoint to check whether a write-behind document row has reached the database (pending, sent or failed)"""
+    if 'supabase_session' not in session:
+        return jsonify({'error': 'Authentication required. Please log in first.'}), 401
+    status = document_outbox.status(document_key) if document_outbox else None
+    if status is None or status.pop('owner_id') != session['supabase_session']['user_id']:
+        return jsonify({'error': 'Pending document not found'}), 404
+    return jsonify(dict(status, document_key=document_key, database_save_success=status['status'] == OUTBOX_SENT))
+
+@app.route('/document_outbox/stats', methods=['GET'])
+def document_outbox_stats():
+    """Endpoint to inspect the write-behind journal (backlog size and age, delivery failures)"""
+    if not document_outbox:
+        return jsonify({'enabled': False})
+    return jsonify(dict(document_outbox.stats(), enabled=True))
+
+@app.route('/scan_cache/stats', methods=['GET'])
+def scan_cache_stats():
+    """Endpoint to inspect OCR result cache hit/miss counters"""
+    if not scan_cache:
+        return jsonify({'enabled': False})
+    return jsonify(dict(scan_cache.stats(), enabled=True))
+
+# Columns /documents may return; `fields=` selects a subset (id and created_at are always included for the cursor)
+DOCUMENT_FIELDS = (
+    'id', 'created_at', 'document_type', 'title', 'notes', 'file_urls', 'upload_date',
+    'extracted_data', 'property_id', 'tenant_id', 'lease_id', 'user_id', 'utility_id',
+    'bill_account_number', 'bill_date', 'bill_amount_due'
+)
+
+def parse_extracted_data(document):
+    """Rows written before extracted_data became jsonb may still hold a JSON string"""
+    value = document.get('extracted_data')
+    if isinstance(value, str) and value:
+        try:
+            document['extracted_data'] = json.loads(value)
+        except ValueError:
+            # If parsing fails, keep as string
+            pass
+    return document
+
+def encode_documents_cursor(document):
+    """Opaque keyset cursor pointing just past `document` in (created_at, id) descending order"""
+    raw = json.dumps([document['created_at'], document['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_documents_cursor(cursor):
+    """
+    (created_at, id) from a cursor, both re-serialised from parsed values: they go into a
+    PostgREST filter string, so nothing the client sent is passed through verbatim.
+    Raises ValueError (or another decoding error) for a malformed cursor.
+    """
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    created_at, document_id = json.loads(raw)
+    if not isinstance(created_at, str) or isinstance(document_id, bool):
+        raise ValueError('Malformed cursor')
+    return datetime.fromisoformat(created_at).isoformat(), int(document_id)
+
 @app.route('/documents', methods=['GET'])
 def get_documents():
-    """Endpoint to retrieve documents from the database"""
+    """
+    Endpoint to retrieve documents from the database, newest first, one page at a time.
+    Query params: limit (default DOCUMENTS_PAGE_SIZE), cursor (next_cursor of the previous page),
+    fields (comma-separated columns), the user_id/property_id/tenant_id/document_type filters and
+    bill filters evaluated in Postgres: account_number, bill_date_from/bill_date_to (YYYY-MM-DD),
+    amount_min/amount_max.
+    """
     if not supabase:
         return jsonify({'error': 'Supabase client not available'}), 500
         
@@ -538,8 +1659,23 @@ def get_documents():
         tenant_id = request.args.get('tenant_id')
         document_type = request.args.get('document_type')
         
+        try:
+            limit = min(max(int(request.args.get('limit', DOCUMENTS_PAGE_SIZE)), 1), DOCUMENTS_MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        
+        fields = request.args.get('fields')
+        if fields:
+            columns = [f.strip() for f in fields.split(',') if f.strip()]
+            unknown = [c for c in columns if c not in DOCUMENT_FIELDS]
+            if unknown:
+                return jsonify({'error': f'Unknown fields: {", ".join(unknown)}'}), 400
+            columns = ['id', 'created_at'] + [c for c in columns if c not in ('id', 'created_at')]
+        else:
+            columns = list(DOCUMENT_FIELDS)
+        
         # Use admin client to bypass RLS for reading
-        query = supabase_admin.table('document').select('*')
+        query = supabase_admin.table('document').select(','.join(columns))
         
         if user_id:
             query = query.eq('user_id', user_id)
@@ -550,26 +1686,112 @@ def get_documents():
         if document_type:
             query = query.eq('document_type', document_type)
         
+        # Bill filters run against the indexed generated columns (db/migrations/002)
+        account_number = request.args.get('account_number')
+        if account_number:
+            query = query.eq('bill_account_number', account_number)
+        try:
+            for param, column, op, parse in (
+                ('bill_date_from', 'bill_date', 'gte', lambda v: datetime.strptime(v, '%Y-%m-%d').date().isoformat()),
+                ('bill_date_to', 'bill_date', 'lte', lambda v: datetime.strptime(v, '%Y-%m-%d').date().isoformat()),
+                ('amount_min', 'bill_amount_due', 'gte', lambda v: str(float(v))),
+                ('amount_max', 'bill_amount_due', 'lte', lambda v: str(float(v))),
+            ):
+                value = request.args.get(param)
+                if value:
+                    query = getattr(query, op)(column, parse(value))
+        except ValueError:
+            return jsonify({'error': 'Dates must be YYYY-MM-DD and amounts numeric'}), 400
+        
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                cursor_created_at, cursor_id = decode_documents_cursor(cursor)
+            except Exception:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            # Keyset: rows strictly after the cursor in (created_at desc, id desc) order
+            query = query.or_(
+                f'created_at.lt."{cursor_created_at}",'
+                f'and(created_at.eq."{cursor_created_at}",id.lt.{cursor_id})'
+            )
+        
+        # Fetch one extra row to know whether another page exists
+        query = query.order('created_at', desc=True).order('id', desc=True).limit(limit + 1)
         result = query.execute()
         
         if hasattr(result, 'error') and result.error:
             return jsonify({'error': f'Database query failed: {result.error}'}), 500
         
-        # Parse extracted_data from JSON string back to object for response
-        documents = result.data
-        for doc in documents:
-            if doc.get('extracted_data'):
-                try:
-                    doc['extracted_data'] = json.loads(doc['extracted_data'])
-                except:
-                    # If parsing fails, keep as string
-                    pass
+        documents = result.data[:limit]
+        next_cursor = encode_documents_cursor(documents[-1]) if len(result.data) > limit else None
+        
+        def generate():
+            # Stream the page row by row instead of building one large JSON body
+            yield '{"documents": ['
+            for index, doc in enumerate(documents):
+                yield (',' if index else '') + json.dumps(parse_extracted_data(doc))
+            yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
         
-        return jsonify({'documents': documents})
+        return Response(stream_with_context(generate()), mimetype='application/json')
         
     except Exception as e:
         return jsonify({'error': f'Query failed: {str(e)}'}), 500
 
+@app.route('/documents/<int:document_id>/<any(thumbnail, preview):kind>', methods=['GET'])
+def get_document_derivative(document_id, kind):
+    """
+    Endpoint serving the owner a document's WebP thumbnail (256 px) or first-page preview
+    (1024 px) for list views. A document's derivatives never change, so they carry a
+    strong ETag and may be cached for DERIVATIVE_MAX_AGE; one not rendered yet (older
+    documents, a full render queue) is rendered from the original and stored now.
+    """
+    session_data, client, auth_error = _authenticate_scan_request()
+    if auth_error:
+        return auth_error
+    
+    etag = f'{document_id}-{kind}-v{DERIVATIVE_VERSION}'
+    cache_headers = {'Cache-Control': f'private, max-age={DERIVATIVE_MAX_AGE}, immutable'}
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=cache_headers)
+        response.set_etag(etag)
+        return response
+    
+    try:
+        result = client.table('document').select('user_id,file_urls').eq('id', document_id).execute()
+        document = result.data[0] if result.data else None
+        if not document or document.get('user_id') != session_data['user_id']:
+            return jsonify({'error': 'Document not found'}), 404
+        storage_path = storage_path_from_url((document.get('file_urls') or [None])[0])
+        if storage_path is None:
+            return jsonify({'error': 'This document has no stored original'}), 404
+        
+        bucket = client.storage.from_(BUCKET_NAME)
+        try:
+            with stage('derivative_download'):
+                data = bucket.download(derivative_path(storage_path, kind))
+        except Exception:
+            # Not rendered yet: render from the original and keep the result for next time
+            with stage('derivative_render'):
+                _, ext = os.path.splitext(storage_path)
+                with tempfile.NamedTemporaryFile(suffix=ext.lower()) as original:
+                    original.write(bucket.download(storage_path))
+                    original.flush()
+                    rendered = render_derivatives(original.name)
+            if not rendered:
+                return jsonify({'error': 'No preview is available for this document'}), 404
+            try:
+                upload_derivatives(client, storage_path, rendered)
+            except Exception as e:
+                log(f"Storing derivatives for document {document_id} failed: {e}")
+            data = rendered[kind]
+        
+        response = Response(data, mimetype='image/webp', headers=cache_headers)
+        response.set_etag(etag)
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': f'Preview failed: {str(e)}'}), 500
+
 @app.route('/documents/<int:document_id>', methods=['GET'])
 def get_document(document_id):
     """Endpoint to retrieve a specific document by ID"""
@@ -585,29 +1807,104 @@ def get_document(document_id):
         if not result.data:
             return jsonify({'error': 'Document not found'}), 404
         
-        document = result.data[0]
-        
-        # Parse extracted_data from JSON string back to object
-        if document.get('extracted_data'):
-            try:
-                document['extracted_data'] = json.loads(document['extracted_data'])
-            except:
-                # If parsing fails, keep as string
-                pass
+        document = parse_extracted_data(result.data[0])
         
         return jsonify({'document': document})
         
     except Exception as e:
         return jsonify({'error': f'Query failed: {str(e)}'}), 500
 
+# /analytics groupings -> document_bill_rollup columns (db/migrations/005)
+ANALYTICS_GROUPS = {
+    'month': 'month',
+    'account': 'account_number',
+    'property': 'property_id',
+    'tenant': 'tenant_id',
+}
+ANALYTICS_PAGE_SIZE = 1000 # PostgREST's default max-rows
+
+@app.route('/analytics', methods=['GET'])
+def get_analytics():
+    """
+    Endpoint for the logged-in user's bill totals (amount_due sum and bill count) per
+    group, read from the trigger-maintained document_bill_rollup table rather than
+    the documents themselves. Query params: group_by (comma-separated month, account,
+    property, tenant; default month), from/to (YYYY-MM, inclusive) and the
+    account_number/property_id/tenant_id filters.
+    """
+    session_data, client, auth_error = _authenticate_scan_request()
+    if auth_error:
+        return auth_error
+    
+    group_by = [name.strip() for name in request.args.get('group_by', 'month').split(',') if name.strip()]
+    unknown = [name for name in group_by if name not in ANALYTICS_GROUPS]
+    if unknown or not group_by:
+        return jsonify({'error': f'group_by must be a list of: {", ".join(ANALYTICS_GROUPS)}'}), 400
+    
+    filters = [('eq', 'user_id', session_data['user_id']), ('gt', 'bill_count', 0)]
+    try:
+        for param, op in (('from', 'gte'), ('to', 'lte')):
+            value = request.args.get(param)
+            if value:
+                filters.append((op, 'month', datetime.strptime(value, '%Y-%m').date().isoformat()))
+        for param in ('property_id', 'tenant_id'):
+            value = request.args.get(param)
+            if value:
+                filters.append(('eq', param, int(value)))
+    except ValueError:
+        return jsonify({'error': 'from/to must be YYYY-MM and property_id/tenant_id integers'}), 400
+    account_number = request.args.get('account_number')
+    if account_number:
+        filters.append(('eq', 'account_number', account_number))
+    
+    try:
+        rows = []
+        with stage('analytics_query'):
+            while True:
+                # Query builders are single-use; the rollup's unique key orders rows stably between pages
+                query = client.table('document_bill_rollup') \
+                    .select('month,account_number,property_id,tenant_id,bill_count,amount_due_total')
+                for op, column, value in filters:
+                    query = getattr(query, op)(column, value)
+                page = query.order('month').order('account_number').order('property_id').order('tenant_id') \
+                    .range(len(rows), len(rows) + ANALYTICS_PAGE_SIZE - 1).execute()
+                rows.extend(page.data or [])
+                if len(page.data or []) < ANALYTICS_PAGE_SIZE:
+                    break
+        
+        columns = [ANALYTICS_GROUPS[name] for name in group_by]
+        groups = {}
+        for row in rows:
+            key = tuple(row[c][:7] if c == 'month' else row[c] for c in columns) # month as YYYY-MM
+            group = groups.setdefault(key, {'bill_count': 0, 'amount_due_total': 0.0})
+            group['bill_count'] += row['bill_count']
+            group['amount_due_total'] += float(row['amount_due_total'])
+        
+        results = []
+        for key in sorted(groups, key=lambda k: tuple((v is None, v) for v in k)):
+            result = dict(zip(columns, key))
+            result['bill_count'] = groups[key]['bill_count']
+            result['amount_due_total'] = round(groups[key]['amount_due_total'], 2)
+            results.append(result)
+        
+        return jsonify({
+            'group_by': group_by,
+            'groups': results,
+            'bill_count': sum(group['bill_count'] for group in results),
+            'amount_due_total': round(sum(group['amount_due_total'] for group in results), 2)
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Query failed: {str(e)}'}), 500
+
 if __name__ == '__main__':
-    print("Starting development server on http://localhost:5000")
-    print("For mobile testing, use the IP address of your computer")
-    print("Note: Files will be processed and saved to database only (no storage upload)")
+    log("Starting development server on http://localhost:5000")
+    log("For mobile testing, use the IP address of your computer")
+    log("Note: Files will be processed and saved to database only (no storage upload)")
     
-    # Try to setup RLS policies on startup
-    if supabase_admin:
-        print("Attempting to setup RLS policies...")
+    # Setting up RLS policies is a database round trip on every start, so it is opt-in
+    if supabase_admin and os.environ.get('SETUP_RLS_ON_START') == '1':
+        log("Attempting to setup RLS policies...")
         setup_rls_policies()
     
     app.run(host="0.0.0.0", port='5000', debug=True)
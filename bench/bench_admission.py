@@ -0,0 +1,165 @@
+"""
+Benchmark for admission control on POST /scan: one client bursts scans while a few
+quiet users scan now and then, with Supabase replaced by fake_supabase.py and docling
+by the fake converter from bench_scan.py.
+
+Cases:
+  unlimited     no rate limits and no concurrency cap (the burst queues for converters)
+  local         per-user/IP token buckets in this process, plus MAX_CONCURRENT_SCANS
+  shared        the same limits kept in fake_redis.py (as with RATE_LIMIT_REDIS_URL)
+  shared_down   the shared backend failing: the limiter falls back to local buckets
+
+For each client group it reports the accepted scans' latency, and how many were
+refused with 429 (rate limit) or 503 (busy) and how quickly.
+
+    python bench/bench_admission.py [--burst 60] [--max-concurrent 4] [--json results.json]
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_scan import FakeConverter, bench_access_token, load_app, percentile, run_metadata, summarize  # noqa: E402
+from corpus import write_corpus  # noqa: E402
+from fake_redis import FakeRedis  # noqa: E402
+from fake_supabase import FakeSupabase  # noqa: E402
+
+
+def user_id(index):
+    return f'00000000-0000-4000-8000-{index:012d}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--burst', type=int, default=60, help='scans the bursting client sends')
+    parser.add_argument('--burst-concurrency', type=int, default=16)
+    parser.add_argument('--quiet-users', type=int, default=4)
+    parser.add_argument('--quiet-requests', type=int, default=4, help='scans per quiet user, one at a time')
+    parser.add_argument('--quiet-interval-ms', type=float, default=150)
+    parser.add_argument('--converters', type=int, default=2)
+    parser.add_argument('--fake-convert-ms', type=float, default=100)
+    parser.add_argument('--db-latency-ms', type=float, default=5)
+    parser.add_argument('--redis-latency-ms', type=float, default=1)
+    parser.add_argument('--user-per-minute', type=float, default=20)
+    parser.add_argument('--user-burst', type=int, default=10)
+    parser.add_argument('--ip-per-minute', type=float, default=60)
+    parser.add_argument('--ip-burst', type=int, default=30)
+    parser.add_argument('--max-concurrent', type=int, default=4, help='MAX_CONCURRENT_SCANS for the limited cases')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    # load_app() settings: in-process fake converter, no OCR cache (every scan converts), synchronous inserts
+    args.concurrency = [args.burst_concurrency]
+    args.fast_pages = 1
+    args.fake_converter = True
+    args.ocr_cache = False
+    args.outbox = False
+
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus = write_corpus(os.path.join(workdir, 'corpus'), 4, formats=('pdf',))
+        uploads = []
+        for entry in corpus:
+            with open(entry['path'], 'rb') as f:
+                uploads.append((os.path.basename(entry['path']), f.read()))
+
+        app_module = load_app(args, FakeSupabase(db_latency=args.db_latency_ms / 1000), workdir)
+        from converter_pool import ConverterPool
+        from rate_limits import AdmissionGate, RateLimiter, RedisBuckets
+        markdowns = [entry['markdown'] for entry in corpus]
+        app_module.converter_pool = ConverterPool(
+            size=args.converters, factory=lambda: FakeConverter(markdowns, args.fake_convert_ms / 1000), warm=False
+        )
+        app_module.converter_pool.start()
+        local = threading.local()
+
+        def scan(user_index, request_index):
+            clients = getattr(local, 'clients', None)
+            if clients is None:
+                clients = local.clients = {}
+            client = clients.get(user_index)
+            if client is None:
+                # One user per client IP
+                client = clients[user_index] = app_module.app.test_client()
+                client.environ_base['REMOTE_ADDR'] = f'10.0.0.{user_index + 1}'
+                with client.session_transaction() as flask_session:
+                    flask_session['supabase_session'] = {
+                        'access_token': bench_access_token(user_id(user_index)),
+                        'refresh_token': 'bench-refresh-token',
+                        'user_id': user_id(user_index),
+                    }
+            filename, content = uploads[request_index % len(uploads)]
+            started = time.perf_counter()
+            response = client.post('/scan', data={'file': (io.BytesIO(content), filename)},
+                                   content_type='multipart/form-data')
+            return time.perf_counter() - started, response.status_code
+
+        def configure(case):
+            limited = case != 'unlimited'
+            app_module.RATE_LIMIT_USER_PER_MINUTE = args.user_per_minute if limited else 0
+            app_module.RATE_LIMIT_USER_BURST = args.user_burst
+            app_module.RATE_LIMIT_IP_PER_MINUTE = args.ip_per_minute if limited else 0
+            app_module.RATE_LIMIT_IP_BURST = args.ip_burst
+            app_module.scan_admission = AdmissionGate(args.max_concurrent) if limited else None
+            shared = None
+            if case.startswith('shared'):
+                redis = FakeRedis(args.redis_latency_ms / 1000)
+                redis.down = case == 'shared_down'
+                shared = RedisBuckets(redis)
+            app_module.rate_limiter = RateLimiter(shared=shared)
+
+        print(f"{'phase':<8}{'case':<22}{'conc':>4}{'n':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}"
+              f"{'per s':>10}{'RSS MB':>10}")
+        rows = []
+        for case in ('unlimited', 'local', 'shared', 'shared_down'):
+            configure(case)
+            outcomes = {'burst': [], 'quiet': []}
+
+            def quiet_user(user_index):
+                for request_index in range(args.quiet_requests):
+                    outcomes['quiet'].append(scan(user_index, request_index))
+                    time.sleep(args.quiet_interval_ms / 1000)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.burst_concurrency) as burst, \
+                    ThreadPoolExecutor(max_workers=args.quiet_users) as quiet:
+                burst_results = burst.map(lambda index: scan(0, index), range(args.burst))
+                quiet_futures = [quiet.submit(quiet_user, index + 1) for index in range(args.quiet_users)]
+                outcomes['burst'] = list(burst_results)
+                for future in quiet_futures:
+                    future.result()
+            wall = time.perf_counter() - started
+
+            for group, results in outcomes.items():
+                accepted = [elapsed for elapsed, status in results if status == 200]
+                refused = sorted(elapsed for elapsed, status in results if status in (429, 503))
+                extra = {
+                    'rejected_429': sum(1 for _, status in results if status == 429),
+                    'rejected_503': sum(1 for _, status in results if status == 503),
+                    'errors': sum(1 for _, status in results if status not in (200, 429, 503)),
+                    'refused_p99_ms': round(percentile(refused, 99) * 1000, 3) if refused else None,
+                }
+                if not accepted:
+                    print(f"{group:<8}{case:<22} no scan accepted: {extra}")
+                    continue
+                concurrency = args.burst_concurrency if group == 'burst' else args.quiet_users
+                row = summarize(group, case, accepted, wall, concurrency=concurrency, **extra)
+                print(f"{'':<8}{'':<22}   refused 429={extra['rejected_429']} 503={extra['rejected_503']} "
+                      f"errors={extra['errors']} p99={extra['refused_p99_ms']} ms")
+                rows.append(row)
+            print(f"{'':<8}{case:<22} limiter: {app_module.rate_limiter.stats()}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'meta': run_metadata(args), 'results': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark provider detection as the parser registry grows.
+
+Registers HK Electric plus K synthetic providers and times ParserRegistry.detect
+on a large HK Electric bill. With pyahocorasick installed, detection switches to a
+single Aho-Corasick pass once there are enough tokens, so time stays flat as K grows.
+
+    python bench/bench_detect.py [--repeat 20] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bill_parsers  # noqa: E402
+from bench_extract import synthetic_bill  # noqa: E402
+
+PROVIDER_COUNTS = (1, 4, 16, 64)
+
+
+def build_registry(extra_providers):
+    registry = bill_parsers.ParserRegistry()
+    for index in range(extra_providers):
+        registry.register(bill_parsers.BillParser(
+            f'provider_{index}',
+            (f'Synthetic Utility Company {index} Limited', f'Customer Service Hotline 9{index:03d}'),
+            lambda text, info: info
+        ))
+    registry.register(bill_parsers.BillParser(
+        'hk_electric',
+        (bill_parsers.HK_ELECTRIC_COMPANY, bill_parsers.HK_ELECTRIC_BRAND),
+        bill_parsers.parse_hk_electric,
+        is_electric_bill=True
+    ))
+    return registry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    text = synthetic_bill(20_000)
+    print(f"{len(text)} chars, pyahocorasick {'installed' if bill_parsers.ahocorasick else 'not installed'}")
+    print(f"{'providers':>10}{'matcher':>18}{'detect ms':>12}")
+
+    results = []
+    for count in PROVIDER_COUNTS:
+        registry = build_registry(count - 1)
+        assert registry.detect(text).provider == 'hk_electric'
+        seconds = min(timeit.repeat(lambda: registry.detect(text), number=1, repeat=args.repeat))
+        matcher = 'aho-corasick' if registry._matcher.uses_automaton else 'substring search'
+        results.append({'providers': count, 'matcher': matcher, 'detect_seconds': seconds})
+        print(f"{count:>10}{matcher:>18}{seconds * 1000:>12.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
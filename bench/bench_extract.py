@@ -0,0 +1,169 @@
+"""
+Micro-benchmark for bill field extraction on large synthetic HK Electric bills.
+
+Compares bill_parsers.extract_bill_info against the original multi-regex
+implementation (kept below as legacy_extract_bill_info) and checks both return
+the same fields on well-formed bills.
+
+    python bench/bench_extract.py [--repeat 20] [--json results.json]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bill_parsers import extract_bill_info  # noqa: E402
+
+
+# --- ORIGINAL IMPLEMENTATION (for comparison only) ---
+
+def legacy_is_hk_electric_bill(text):
+    """Check if the document is a HK Electric bill"""
+    return "The Hongkong Electric Co., Ltd." in text and "HK Electric" in text
+
+def legacy_extract_bill_info(text):
+    """Extract specific information from HK Electric bill"""
+    info = {
+        'recipient_name': '',
+        'recipient_address': '',
+        'account_number': '',
+        'date_of_bill': '',
+        'amount_due': '',
+        'is_electric_bill': False
+    }
+    
+    # Check if this is an HK Electric bill
+    if not legacy_is_hk_electric_bill(text):
+        return info
+    
+    info['is_electric_bill'] = legacy_is_hk_electric_bill(text)
+    
+    # Placeholder for extraction logic
+    if info['is_electric_bill']:    
+        # Extract recipient name (under company name)
+        name_pattern = r'The Hongkong Electric Co\., Ltd\.\s*\n([A-Z][A-Z\s]+)\n'
+        name_match = re.search(name_pattern, text)
+        if name_match:
+            info['recipient_name'] = name_match.group(1).strip()
+        
+        # Extract recipient address (multi-line after name)
+        address_section = re.search(r'The Hongkong Electric Co\., Ltd\.\s*\n[A-Z\s]+\n((?:.+\n)+?)(?=Residential|Account|Deposit|$)', text)
+        if address_section:
+            address_lines = address_section.group(1).strip().split('\n')
+            cleaned_address = []
+            for line in address_lines:
+                line = line.strip()
+                if line and not any(keyword in line for keyword in ['Residential', 'Tariff', 'Deposit', 'Account']):
+                    cleaned_address.append(line)
+            if cleaned_address:
+                info['recipient_address'] = ', '.join(cleaned_address)
+        
+        # Extract account number
+        account_pattern = r'Account Number\s*([0-9]{10})'
+        account_match = re.search(account_pattern, text)
+        if account_match:
+            info['account_number'] = account_match.group(1).strip()
+        
+        # Extract date of bill
+        date_pattern = r'Date of Bill\s*([0-9]{2}/[0-9]{2}/[0-9]{4})'
+        date_match = re.search(date_pattern, text)
+        if date_match:
+            info['date_of_bill'] = date_match.group(1).strip()
+        
+        # Extract amount due
+        amount_patterns = [
+            r'Please Pay This Amount\s*\$?\s*([0-9,]+\.?[0-9]*)',
+            r'Total Amount Due\s*\$?\s*([0-9,]+\.?[0-9]*)',
+            r'Amount Due\s*\$?\s*([0-9,]+\.?[0-9]*)'
+        ]
+        
+        for pattern in amount_patterns:
+            amount_matches = re.findall(pattern, text)
+            if amount_matches:
+                amount = amount_matches[-1].replace(',', '')
+                info['amount_due'] = amount
+                break
+        
+    return info
+
+
+# --- SYNTHETIC BILLS ---
+
+def synthetic_bill(filler_lines):
+    """A well-formed HK Electric bill with `filler_lines` lines of usage tables after the header"""
+    header = (
+        "HK Electric\n"
+        "The Hongkong Electric Co., Ltd.\n"
+        "CHAN TAI MAN\n"
+        "Flat 12A, 8/F, Block 3\n"
+        "88 Hing Fat Street\n"
+        "North Point, Hong Kong\n"
+        "Residential Tariff\n"
+        "Account Number 1234567890\n"
+        "Date of Bill 05/09/2025\n"
+    )
+    filler = "".join(
+        f"| {day:02d}/08/2025 | Units {day * 7} kWh | Charge ${day * 3}.50 | Amount Due $0.00 |\n"
+        for day in range(1, filler_lines + 1)
+    )
+    footer = "Total Amount Due $1,234.50\nPlease Pay This Amount $1,234.50\n"
+    return header + filler + footer
+
+
+def pathological_bill(lines):
+    """Upper-case lines and no address terminator: forces the legacy address regex to backtrack"""
+    return (
+        "HK Electric\nThe Hongkong Electric Co., Ltd.\n"
+        + "ABC DEF\n" * lines
+        + "trailing text without a newline"
+    )
+
+
+def non_bill(lines):
+    return "Some other utility statement\n" * lines
+
+
+CASES = [
+    ('bill_1k_lines', synthetic_bill(1_000), True),
+    ('bill_20k_lines', synthetic_bill(20_000), True),
+    ('pathological_500_lines', pathological_bill(500), False),
+    ('pathological_2k_lines', pathological_bill(2_000), False),
+    ('non_bill_20k_lines', non_bill(20_000), True),
+]
+
+
+def best_of(fn, text, repeat):
+    return min(timeit.repeat(lambda: fn(text), number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'case':<26}{'chars':>10}{'legacy ms':>12}{'new ms':>10}{'speedup':>10}")
+    for name, text, must_match in CASES:
+        if must_match:
+            fields = extract_bill_info(text)
+            fields.pop('provider')
+            assert fields == legacy_extract_bill_info(text), name
+        legacy_s = best_of(legacy_extract_bill_info, text, args.repeat)
+        new_s = best_of(extract_bill_info, text, args.repeat)
+        speedup = legacy_s / new_s if new_s else float('inf')
+        results.append({'case': name, 'chars': len(text), 'legacy_seconds': legacy_s,
+                        'new_seconds': new_s, 'speedup': speedup})
+        print(f"{name:<26}{len(text):>10}{legacy_s * 1000:>12.3f}{new_s * 1000:>10.3f}{speedup:>9.1f}x")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
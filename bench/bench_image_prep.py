@@ -0,0 +1,125 @@
+"""
+Benchmark image normalisation before OCR on synthetic phone-camera photos.
+
+Generates 12 MP and 48 MP JPEG "photos" of a bill (rotated via EXIF), then reports
+normalisation time, pixel reduction and, when docling is installed, conversion
+time and peak RSS with and without normalisation.
+
+    python bench/bench_image_prep.py [--dpi 200] [--color] [--no-ocr] [--json results.json]
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_prep import EXIF_ORIENTATION, normalize_image  # noqa: E402
+
+# (name, width, height) of common phone sensors
+SENSORS = [('12MP', 4032, 3024), ('48MP', 8064, 6048)]
+
+BILL_LINES = [
+    'HK Electric',
+    'The Hongkong Electric Co., Ltd.',
+    'CHAN TAI MAN',
+    'Flat 12A, 8/F, Block 3, 88 Hing Fat Street',
+    'Residential Tariff',
+    'Account Number 1234567890',
+    'Date of Bill 05/09/2025',
+    'Please Pay This Amount $1,234.50',
+]
+
+
+def synthetic_photo(path, width, height):
+    """A bill photo stored rotated on the sensor, with EXIF orientation 6 to turn it upright"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    image = Image.new('RGB', (width, height), (236, 232, 220))
+    draw = ImageDraw.Draw(image)
+    font_size = height // 40
+    try:
+        font = ImageFont.load_default(size=font_size)
+    except TypeError:
+        font = ImageFont.load_default()
+    for index, line in enumerate(BILL_LINES):
+        draw.text((width // 10, height // 10 + index * font_size * 2), line, fill=(20, 20, 20), font=font)
+    # Store the page rotated on the sensor, as phones do
+    image = image.rotate(90, expand=True)
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    image.save(path, format='JPEG', quality=92, exif=exif)
+
+
+def time_conversion(path):
+    try:
+        from docling.document_converter import DocumentConverter
+    except ImportError:
+        return None
+    converter = DocumentConverter()
+    converter.convert(path)  # load models outside the timed run
+    started = time.perf_counter()
+    converter.convert(path)
+    return time.perf_counter() - started
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dpi', type=int, default=200)
+    parser.add_argument('--color', action='store_true', help='keep colour instead of converting to grayscale')
+    parser.add_argument('--no-ocr', action='store_true', help='skip docling conversion timings')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    from PIL import Image
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, width, height in SENSORS:
+            photo = os.path.join(workdir, f'{name}.jpg')
+            synthetic_photo(photo, width, height)
+
+            started = time.perf_counter()
+            normalized = normalize_image(photo, target_dpi=args.dpi, grayscale=not args.color)
+            prep_seconds = time.perf_counter() - started
+            with Image.open(normalized) as image:
+                normalized_size = image.size
+
+            row = {
+                'sensor': name,
+                'original_pixels': width * height,
+                'normalized_pixels': normalized_size[0] * normalized_size[1],
+                'normalized_size': normalized_size,
+                'original_bytes': os.path.getsize(photo),
+                'normalized_bytes': os.path.getsize(normalized),
+                'normalize_seconds': prep_seconds,
+            }
+            if not args.no_ocr:
+                row['ocr_seconds_original'] = time_conversion(photo)
+                row['ocr_seconds_normalized'] = time_conversion(normalized)
+            row['peak_rss_mb'] = peak_rss_mb()
+            results.append(row)
+            os.unlink(normalized)
+
+            print(f"{name}: {width}x{height} -> {normalized_size[0]}x{normalized_size[1]} "
+                  f"({row['original_pixels'] / row['normalized_pixels']:.1f}x fewer pixels), "
+                  f"{row['original_bytes'] // 1024} KiB -> {row['normalized_bytes'] // 1024} KiB, "
+                  f"normalised in {prep_seconds * 1000:.0f} ms")
+            if row.get('ocr_seconds_original') is not None:
+                print(f"    OCR {row['ocr_seconds_original']:.2f}s -> {row['ocr_seconds_normalized']:.2f}s")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark for /process_url against a local origin (fake_origin.py), with Supabase
+replaced by fake_supabase.py and docling by the fake converter from bench_scan.py.
+
+Cases, each at several concurrency levels over the corpus URLs:
+  cold          first fetch of each URL: download + conversion
+  revalidated   same URLs again: conditional GET answered 304, cached conversion reused
+  no_validators origin sends no ETag/Last-Modified: downloaded again, conversion reused by digest
+  changed       origin publishes new content: downloaded and converted again
+
+Then single requests that must be refused: a trickling origin (deadline, 504), an
+oversized document (413) and a request past the download concurrency limit (503).
+
+    python bench/bench_process_url.py [--origin-latency-ms 20] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_scan import FakeConverter, load_app, run_metadata, summarize  # noqa: E402
+from corpus import write_corpus  # noqa: E402
+from fake_origin import FakeDocument, FakeOrigin  # noqa: E402
+from fake_supabase import FakeSupabase  # noqa: E402
+
+BENCH_USER_ID = '00000000-0000-4000-8000-000000000001'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--bills', type=int, default=8)
+    parser.add_argument('--concurrency', default='1,4')
+    parser.add_argument('--origin-latency-ms', type=float, default=20)
+    parser.add_argument('--fake-convert-ms', type=float, default=50)
+    parser.add_argument('--db-latency-ms', type=float, default=5)
+    parser.add_argument('--deadline', type=float, default=2, help='URL_FETCH_DEADLINE for the run, seconds')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    args.concurrency = [int(level) for level in args.concurrency.split(',')]
+    # load_app() settings: in-process fake converter, OCR cache on, synchronous inserts
+    args.converters = 2
+    args.fast_pages = 1
+    args.fake_converter = True
+    args.ocr_cache = True
+    args.outbox = False
+
+    with tempfile.TemporaryDirectory() as workdir, FakeOrigin(args.origin_latency_ms / 1000) as origin:
+        corpus = write_corpus(os.path.join(workdir, 'corpus'), args.bills, formats=('pdf',))
+        for index, entry in enumerate(corpus):
+            with open(entry['path'], 'rb') as f:
+                content = f.read()
+            origin.documents[f'/bills/{index}.pdf'] = FakeDocument(content)
+            origin.documents[f'/plain/{index}.pdf'] = FakeDocument(content, validators=False)
+        origin.documents['/slow.pdf'] = FakeDocument(b'%PDF' + b'0' * 64, trickle_bytes_per_s=8)
+        origin.documents['/large.pdf'] = FakeDocument(b'%PDF' + b'0' * (2 * 1024 * 1024))
+
+        os.environ.update({
+            'URL_FETCH_DEADLINE': str(args.deadline),
+            'URL_FETCH_MAX_MB': '1',
+            'URL_FETCH_CONCURRENCY': str(max(args.concurrency)),
+        })
+        app_module = load_app(args, FakeSupabase(db_latency=args.db_latency_ms / 1000), workdir)
+        from converter_pool import ConverterPool
+        markdowns = [entry['markdown'] for entry in corpus]
+        app_module.converter_pool = ConverterPool(
+            size=args.converters, factory=lambda: FakeConverter(markdowns, args.fake_convert_ms / 1000), warm=False
+        )
+        app_module.converter_pool.start()
+        local = threading.local()
+
+        def process(url):
+            client = getattr(local, 'client', None) or app_module.app.test_client()
+            local.client = client
+            started = time.perf_counter()
+            response = client.post('/process_url', json={'url': url, 'user_id': BENCH_USER_ID})
+            return time.perf_counter() - started, response.status_code, response.get_json(silent=True) or {}
+
+        print(f"{'phase':<8}{'case':<22}{'conc':>4}{'n':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}"
+              f"{'per s':>10}{'RSS MB':>10}")
+        rows = []
+
+        def run_case(case, prefix, prepare=None):
+            for concurrency in args.concurrency:
+                if prepare:
+                    prepare()
+                urls = [origin.url(f'{prefix}/{index}.pdf') for index in range(args.bills)]
+                requests_before, bytes_before = origin.requests, origin.bytes_sent
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    outcomes = list(executor.map(process, urls))
+                wall = time.perf_counter() - started
+                rows.append(summarize(
+                    'url', case, [o[0] for o in outcomes], wall, concurrency=concurrency,
+                    errors=sum(1 for o in outcomes if o[1] != 200),
+                    downloads_skipped=sum(1 for o in outcomes if o[2].get('download_skipped')),
+                    ocr_cache_hits=sum(1 for o in outcomes if o[2].get('ocr_cache_hit')),
+                    origin_requests=origin.requests - requests_before,
+                    origin_bytes=origin.bytes_sent - bytes_before
+                ))
+
+        def publish_new_versions():
+            for index in range(args.bills):
+                document = origin.documents[f'/bills/{index}.pdf']
+                document.replace(document.content + b'\n%% revised %f' % time.time())
+
+        # Every concurrency level of 'cold' must start cold: new versions are new digests
+        run_case('cold', '/bills', prepare=publish_new_versions)
+        run_case('revalidated', '/bills')
+        run_case('no_validators', '/plain')
+        run_case('changed', '/bills', prepare=publish_new_versions)
+
+        refusals = {}
+        for case, url in (('slow_origin', origin.url('/slow.pdf')), ('too_large', origin.url('/large.pdf'))):
+            elapsed, status, body = process(url)
+            refusals[case] = {'status': status, 'ms': round(elapsed * 1000, 1), 'error': body.get('error')}
+        # Hold every download slot with trickling downloads, then ask for one more
+        with ThreadPoolExecutor(max_workers=max(args.concurrency)) as executor:
+            holders = [executor.submit(process, origin.url('/slow.pdf')) for _ in range(max(args.concurrency))]
+            while app_module.url_fetcher.stats()['in_flight'] < max(args.concurrency):
+                time.sleep(0.01)
+            elapsed, status, body = process(origin.url('/bills/0.pdf'))
+            refusals['over_concurrency'] = {'status': status, 'ms': round(elapsed * 1000, 1), 'error': body.get('error')}
+            for holder in holders:
+                holder.result()
+        for case, outcome in refusals.items():
+            print(f"{case:<18} HTTP {outcome['status']} in {outcome['ms']:.1f} ms: {outcome['error']}")
+        print(f"fetcher: {app_module.url_fetcher.stats()}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'meta': run_metadata(args), 'results': rows, 'refusals': refusals}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+"""
+Benchmark suite for the scan pipeline on a synthetic HK Electric corpus.
+
+Phases (all by default, or pick with --phases):
+  extract  extract_bill_info on the exported markdown of each bill
+  convert  docling conversion + extraction (convert_and_extract) of each PDF/JPEG
+  scan     POST /scan through Flask's test client at several concurrency levels,
+           with Supabase replaced by the in-memory stand-in in fake_supabase.py
+
+Each phase reports p50/p95/p99 latency, throughput and peak RSS; the full run is
+written as JSON (with the commit and machine it ran on) for comparing commits:
+
+    python bench/bench_scan.py --json before.json
+    python bench/bench_scan.py --json after.json --baseline before.json
+
+--fake-converter swaps docling for a converter that sleeps and returns the bill's
+markdown, to measure the route's own overhead (uploads, hashing, Storage, inserts).
+"""
+import argparse
+import base64
+import io
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import write_corpus  # noqa: E402
+from fake_supabase import FakeSupabase  # noqa: E402
+
+BENCH_USER_ID = '00000000-0000-4000-8000-000000000001'
+FIELDS = ('recipient_name', 'recipient_address', 'account_number', 'date_of_bill', 'amount_due')
+
+
+# --- MEASUREMENT HELPERS ---
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux; includes conversion worker processes that have exited
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / 1024, 1)
+
+
+def summarize(phase, case, latencies, wall_seconds, concurrency=1, **extra):
+    values = sorted(latencies)
+    row = {
+        'phase': phase,
+        'case': case,
+        'concurrency': concurrency,
+        'requests': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        'throughput_per_s': round(len(values) / wall_seconds, 3) if wall_seconds else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    row.update(extra)
+    print(f"{phase:<8}{case:<22}{concurrency:>4}{row['requests']:>7}{row['p50_ms']:>11.2f}"
+          f"{row['p95_ms']:>11.2f}{row['p99_ms']:>11.2f}{row['throughput_per_s'] or 0:>10.2f}{row['peak_rss_mb']:>10.1f}")
+    return row
+
+
+def field_accuracy(pairs):
+    """Share of expected fields extracted exactly, over (bill_info, expected) pairs"""
+    checked = matched = 0
+    for bill_info, expected in pairs:
+        for field in FIELDS:
+            checked += 1
+            matched += (bill_info or {}).get(field) == expected[field]
+    return round(matched / checked, 4) if checked else None
+
+
+# --- PHASES ---
+
+def run_extract(corpus, repeat):
+    from bill_parsers import extract_bill_info
+
+    bills = [entry for entry in corpus if entry['format'] == corpus[0]['format']]
+    latencies = []
+    pairs = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for entry in bills:
+            call_started = time.perf_counter()
+            bill_info = extract_bill_info(entry['markdown'])
+            latencies.append(time.perf_counter() - call_started)
+            pairs.append((bill_info, entry['expected']))
+    return [summarize('extract', 'markdown', latencies, time.perf_counter() - started,
+                      field_accuracy=field_accuracy(pairs))]
+
+
+def run_convert(corpus, fast_pages):
+    try:
+        from docling.document_converter import DocumentConverter
+    except ImportError:
+        print("convert: docling is not installed, skipped")
+        return []
+    from converter_pool import _warm_converter, convert_and_extract
+
+    load_started = time.perf_counter()
+    converter = DocumentConverter()
+    _warm_converter(converter)
+    print(f"convert: converter loaded and warmed in {time.perf_counter() - load_started:.2f}s")
+
+    rows = []
+    for file_format in sorted({entry['format'] for entry in corpus}):
+        latencies = []
+        pairs = []
+        started = time.perf_counter()
+        for entry in corpus:
+            if entry['format'] != file_format:
+                continue
+            call_started = time.perf_counter()
+            _, bill_info = convert_and_extract(converter, entry['path'], fast_pages)
+            latencies.append(time.perf_counter() - call_started)
+            pairs.append((bill_info, entry['expected']))
+        rows.append(summarize('convert', file_format, latencies, time.perf_counter() - started,
+                              fast_pages=fast_pages, field_accuracy=field_accuracy(pairs)))
+    return rows
+
+
+class FakeConverter:
+    """Stands in for DocumentConverter: sleeps `delay` seconds and returns the next bill's markdown"""
+
+    def __init__(self, markdowns, delay):
+        self.markdowns = markdowns
+        self.delay = delay
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def convert(self, source, page_range=None, **kwargs):
+        time.sleep(self.delay)
+        with self._lock:
+            markdown = self.markdowns[self._next % len(self.markdowns)]
+            self._next += 1
+
+        class Document:
+            def export_to_markdown(self):
+                return markdown
+
+        class Input:
+            page_count = 1
+
+        class Result:
+            document = Document()
+            input = Input()
+        return Result()
+
+
+def bench_access_token(user_id):
+    """Unsigned JWT-shaped token with a far-off expiry, so the client pool never refreshes it"""
+    def part(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+    return f"{part({'alg': 'none'})}.{part({'sub': user_id, 'exp': 4102444800})}.bench"
+
+
+def load_app(args, backend, workdir):
+    """Import app.py with Supabase replaced by `backend` and local state kept in `workdir`"""
+    import supabase
+
+    supabase.create_client = backend.create_client
+    os.environ.update({
+        'SUPABASE_URL': 'https://bench.invalid',
+        'SUPABASE_KEY': 'bench-anon-key',
+        'SUPABASE_SERVICE_KEY': 'bench-service-key',
+        'FLASK_SECRET_KEY': 'bench',
+        'CONVERTER_POOL_WARM': 'scan',
+        'CONVERTER_POOL_SIZE': str(args.converters),
+        # The fake converter lives in this process, so it needs the in-process converter pool
+        'OCR_WORKERS': '0' if args.fake_converter else str(args.converters),
+        'OCR_QUEUE_SIZE': str(max(args.concurrency)), # Measure queueing, not 429s
+        'FAST_OCR_PAGES': str(args.fast_pages),
+        'SCAN_CACHE_PATH': os.path.join(workdir, 'scan_cache.sqlite3') if args.ocr_cache else '',
+        'SCAN_JOB_DB_PATH': os.path.join(workdir, 'scan_jobs.sqlite3'),
+        'DOCUMENT_OUTBOX_PATH': os.path.join(workdir, 'document_outbox.sqlite3') if args.outbox else '',
+    })
+    # Measure the pipeline, not admission control (bench_admission.py turns it on)
+    for name in ('RATE_LIMIT_USER_PER_MINUTE', 'RATE_LIMIT_IP_PER_MINUTE', 'MAX_CONCURRENT_SCANS'):
+        os.environ.setdefault(name, '0')
+    import app as app_module
+    return app_module
+
+
+def run_scan(corpus, args, workdir):
+    backend = FakeSupabase(db_latency=args.db_latency_ms / 1000, storage_latency=args.storage_latency_ms / 1000)
+    # Half the meters are known utilities, so both lookup outcomes are exercised
+    backend.seed('utility', [
+        {'account_number': entry['fields']['account_number'], 'user_id': BENCH_USER_ID}
+        for entry in corpus[::2]
+    ])
+    app_module = load_app(args, backend, workdir)
+
+    from converter_pool import ConverterPool
+    if args.fake_converter:
+        markdowns = [entry['markdown'] for entry in corpus]
+        app_module.converter_pool = ConverterPool(
+            size=args.converters, factory=lambda: FakeConverter(markdowns, args.fake_convert_ms / 1000), warm=False
+        )
+    if not app_module.ocr_workers:
+        warm_started = time.perf_counter()
+        app_module.converter_pool.start()
+        print(f"scan: {args.converters} converter(s) ready in {time.perf_counter() - warm_started:.2f}s")
+
+    uploads = []
+    for entry in corpus:
+        with open(entry['path'], 'rb') as f:
+            uploads.append((os.path.basename(entry['path']), f.read(), entry['expected']))
+
+    session_data = {
+        'access_token': bench_access_token(BENCH_USER_ID),
+        'refresh_token': 'bench-refresh-token',
+        'user_id': BENCH_USER_ID,
+    }
+    local = threading.local()
+
+    def test_client():
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app_module.app.test_client()
+            with client.session_transaction() as flask_session:
+                flask_session['supabase_session'] = session_data
+        return client
+
+    def scan_once(index):
+        filename, content, expected = uploads[index % len(uploads)]
+        started = time.perf_counter()
+        response = test_client().post('/scan', data={'file': (io.BytesIO(content), filename)},
+                                      content_type='multipart/form-data')
+        elapsed = time.perf_counter() - started
+        return elapsed, response.status_code, response.get_json(silent=True), expected
+
+    warm_started = time.perf_counter()
+    scan_once(0) # First request pays for lazy initialisation (OCR workers load their models)
+    print(f"scan: first request done in {time.perf_counter() - warm_started:.2f}s")
+
+    rows = []
+    for concurrency in args.concurrency:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(scan_once, range(args.requests)))
+        wall = time.perf_counter() - started
+        errors = sum(1 for _, status, _, _ in outcomes if status != 200)
+        rows.append(summarize(
+            'scan', 'fake_converter' if args.fake_converter else 'docling', [o[0] for o in outcomes], wall,
+            concurrency=concurrency, errors=errors,
+            field_accuracy=None if args.fake_converter else field_accuracy((o[2], o[3]) for o in outcomes if o[1] == 200)
+        ))
+
+    if app_module.document_outbox:
+        app_module.document_outbox.flush()
+    if app_module.ocr_workers:
+        app_module.ocr_workers.shutdown()
+    return rows
+
+
+# --- REPORTING ---
+
+def run_metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args),
+    }
+
+
+def print_comparison(rows, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(row['phase'], row['case'], row['concurrency']): row for row in baseline['results']}
+    print(f"\nvs {baseline_path} (commit {baseline['meta'].get('commit')}): p50 and p95 ratio, new / old")
+    for row in rows:
+        old = before.get((row['phase'], row['case'], row['concurrency']))
+        if old:
+            print(f"{row['phase']:<8}{row['case']:<22}{row['concurrency']:>4}"
+                  f"{row['p50_ms'] / old['p50_ms']:>9.2f}x{row['p95_ms'] / old['p95_ms']:>9.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--phases', default='extract,convert,scan')
+    parser.add_argument('--bills', type=int, default=4, help='synthetic bills per format')
+    parser.add_argument('--formats', default='pdf,jpg')
+    parser.add_argument('--corpus-dir', help='keep the rendered corpus here (default: a temp dir)')
+    parser.add_argument('--repeat', type=int, default=200, help='extract phase: passes over the corpus')
+    parser.add_argument('--requests', type=int, default=24, help='scan phase: requests per concurrency level')
+    parser.add_argument('--concurrency', default='1,2,4,8')
+    parser.add_argument('--converters', type=int, default=2, help='scan phase: OCR_WORKERS (CONVERTER_POOL_SIZE with --fake-converter)')
+    parser.add_argument('--fast-pages', type=int, default=1)
+    parser.add_argument('--fake-converter', action='store_true', help='scan phase: skip docling')
+    parser.add_argument('--fake-convert-ms', type=float, default=50)
+    parser.add_argument('--db-latency-ms', type=float, default=5)
+    parser.add_argument('--storage-latency-ms', type=float, default=20)
+    parser.add_argument('--ocr-cache', action='store_true', help='scan phase: leave the OCR result cache on')
+    parser.add_argument('--outbox', action='store_true', help='scan phase: write-behind document inserts')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='earlier --json output to compare against')
+    args = parser.parse_args()
+    args.concurrency = [int(level) for level in args.concurrency.split(',')]
+    phases = set(args.phases.split(','))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus = write_corpus(args.corpus_dir or os.path.join(workdir, 'corpus'), args.bills,
+                              formats=tuple(args.formats.split(',')))
+        print(f"{'phase':<8}{'case':<22}{'conc':>4}{'n':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}"
+              f"{'per s':>10}{'RSS MB':>10}")
+        rows = []
+        if 'extract' in phases:
+            rows += run_extract(corpus, args.repeat)
+        if 'convert' in phases:
+            rows += run_convert(corpus, args.fast_pages)
+        if 'scan' in phases:
+            rows += run_scan(corpus, args, workdir)
+
+    if args.baseline:
+        print_comparison(rows, args.baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'meta': run_metadata(args), 'results': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Startup benchmark for web workers: time to import app.py and serve a first light
+request (/login), in fresh interpreters, plus whether the OCR stack was loaded.
+
+Each run is a new `python` process so import caches do not carry over. Supabase
+is pointed at an unroutable URL (creating clients makes no network calls).
+
+    python bench/bench_startup.py [--runs 5] [--top 15] [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules whose presence after startup means a worker paid for the OCR stack
+HEAVY_MODULES = ('docling', 'torch', 'transformers', 'PIL')
+
+CHILD = """
+import json, resource, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps({
+    'import_seconds': imported - started,
+    'first_request_seconds': served - imported,
+    'status': response.status_code,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'loaded': [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def child_env(workdir):
+    env = dict(os.environ)
+    env.update({
+        'SUPABASE_URL': 'https://bench.supabase.invalid',
+        'SUPABASE_KEY': 'bench-anon-key',
+        'FLASK_SECRET_KEY': 'bench',
+        'SCAN_CACHE_PATH': os.path.join(workdir, 'scan_cache.sqlite3'),
+        'SCAN_JOB_DB_PATH': os.path.join(workdir, 'scan_jobs.sqlite3'),
+        'DOCUMENT_OUTBOX_PATH': os.path.join(workdir, 'document_outbox.sqlite3'),
+    })
+    return env
+
+
+def run_once(env, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', CHILD]
+    result = subprocess.run(command, cwd=REPO_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"startup run failed:\n{result.stderr[-2000:]}")
+    measured = json.loads(result.stdout.strip().splitlines()[-1])
+    return measured, result.stderr
+
+
+def slowest_imports(importtime_output, top):
+    """
+    Modules imported directly by app.py (and app itself), by cumulative import time in
+    microseconds, from -X importtime output. Nested imports are inside their parent's total.
+    """
+    totals = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth > 1:
+            continue
+        try:
+            totals[name.strip()] = max(totals.get(name.strip(), 0), int(cumulative))
+        except ValueError:
+            continue
+    return sorted(totals.items(), key=lambda item: -item[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='slowest of app.py and its direct imports to list')
+    parser.add_argument('--warm', default='page', help="CONVERTER_POOL_WARM for the runs ('start' loads docling at boot)")
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = child_env(workdir)
+        env['CONVERTER_POOL_WARM'] = args.warm
+        runs = [run_once(env)[0] for _ in range(args.runs)]
+        _, importtime_output = run_once(env, importtime=True)
+
+    summary = {
+        'warm': args.warm,
+        'runs': runs,
+        'import_seconds_median': statistics.median(run['import_seconds'] for run in runs),
+        'first_request_seconds_median': statistics.median(run['first_request_seconds'] for run in runs),
+        'rss_mb_median': statistics.median(run['rss_mb'] for run in runs),
+        'heavy_modules_loaded': sorted({name for run in runs for name in run['loaded']}),
+        'slowest_imports': [{'module': name, 'cumulative_ms': us / 1000}
+                            for name, us in slowest_imports(importtime_output, args.top)],
+    }
+    print(f"import app:        {summary['import_seconds_median'] * 1000:8.1f} ms (median of {args.runs})")
+    print(f"first GET /login:  {summary['first_request_seconds_median'] * 1000:8.1f} ms")
+    print(f"peak RSS:          {summary['rss_mb_median']:8.1f} MB")
+    print(f"heavy modules:     {', '.join(summary['heavy_modules_loaded']) or 'none'}")
+    print("slowest imports (app.py and its direct imports, cumulative):")
+    for entry in summary['slowest_imports']:
+        print(f"  {entry['cumulative_ms']:8.1f} ms  {entry['module']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
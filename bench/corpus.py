@@ -0,0 +1,110 @@
+"""
+Deterministic corpus of synthetic HK Electric bills for the benchmarks: the bill
+text (as docling would export it) plus rendered A4 JPEG and PDF versions.
+"""
+import os
+import random
+
+FIRST_NAMES = ['TAI MAN', 'SIU MING', 'KA YAN', 'WING SZE', 'CHI KEUNG', 'MEI LING']
+SURNAMES = ['CHAN', 'WONG', 'LEE', 'CHEUNG', 'LAU', 'NG']
+STREETS = ['Hing Fat Street', 'King\'s Road', 'Java Road', 'Electric Road', 'Tin Hau Temple Road']
+DISTRICTS = ['North Point', 'Quarry Bay', 'Causeway Bay', 'Tin Hau', 'Fortress Hill']
+
+# A4 at 200 dpi, the resolution image_prep normalises photos to
+PAGE_SIZE = (1654, 2339)
+PAGE_DPI = 200
+
+
+def bill_fields(index, seed=0):
+    """The fields extract_bill_info should find on bill number `index`"""
+    rng = random.Random(seed * 100_003 + index)
+    return {
+        'recipient_name': f'{rng.choice(SURNAMES)} {rng.choice(FIRST_NAMES)}',
+        'address_lines': [
+            f'Flat {rng.randint(1, 30)}{rng.choice("ABCDEF")}, {rng.randint(1, 40)}/F, Block {rng.randint(1, 8)}',
+            f'{rng.randint(1, 300)} {rng.choice(STREETS)}',
+            f'{rng.choice(DISTRICTS)}, Hong Kong',
+        ],
+        'account_number': f'{rng.randrange(10 ** 9, 10 ** 10)}',
+        'date_of_bill': f'{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2025',
+        'amount_due': f'{rng.randint(80, 4000)}.{rng.randint(0, 99):02d}',
+    }
+
+
+def bill_lines(fields, usage_days=30):
+    """Lines of a bill: header block, a usage table of `usage_days` rows and the totals"""
+    amount = f'{float(fields["amount_due"]):,.2f}'
+    lines = ['HK Electric', 'The Hongkong Electric Co., Ltd.', fields['recipient_name']]
+    lines += fields['address_lines']
+    lines += [
+        'Residential Tariff',
+        f'Account Number {fields["account_number"]}',
+        f'Date of Bill {fields["date_of_bill"]}',
+    ]
+    lines += [f'| {day:02d} | Units {day * 7} kWh | Charge ${day * 3}.50 |' for day in range(1, usage_days + 1)]
+    lines += [f'Total Amount Due ${amount}', f'Please Pay This Amount ${amount}']
+    return lines
+
+
+def bill_markdown(fields, usage_days=30):
+    return '\n'.join(bill_lines(fields, usage_days)) + '\n'
+
+
+def expected_bill_info(fields):
+    return {
+        'recipient_name': fields['recipient_name'],
+        'recipient_address': ', '.join(fields['address_lines']),
+        'account_number': fields['account_number'],
+        'date_of_bill': fields['date_of_bill'],
+        'amount_due': fields['amount_due'],
+        'is_electric_bill': True,
+        'provider': 'hk_electric',
+    }
+
+
+def render_pages(lines, lines_per_page=45):
+    """Render `lines` onto white A4 pages (PIL images)"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    width, height = PAGE_SIZE
+    font_size = height // 70
+    try:
+        font = ImageFont.load_default(size=font_size)
+    except TypeError:
+        font = ImageFont.load_default()
+    pages = []
+    for start in range(0, len(lines), lines_per_page):
+        page = Image.new('L', PAGE_SIZE, 255)
+        draw = ImageDraw.Draw(page)
+        for row, line in enumerate(lines[start:start + lines_per_page]):
+            draw.text((width // 12, height // 20 + row * font_size * 1.4), line, fill=0, font=font)
+        pages.append(page)
+    return pages
+
+
+def write_corpus(directory, count=4, formats=('pdf', 'jpg'), usage_days=30, seed=0):
+    """
+    Write `count` bills in each of `formats` to `directory` and return one entry per file:
+    {'path', 'format', 'fields', 'markdown', 'expected'}. PDFs get every page, JPEGs the first.
+    """
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for index in range(count):
+        fields = bill_fields(index, seed)
+        lines = bill_lines(fields, usage_days)
+        pages = render_pages(lines)
+        for file_format in formats:
+            path = os.path.join(directory, f'bill_{index:03d}.{file_format}')
+            if not os.path.exists(path):
+                if file_format == 'pdf':
+                    pages[0].save(path, format='PDF', resolution=PAGE_DPI, save_all=True, append_images=pages[1:])
+                else:
+                    pages[0].save(path, format='JPEG', quality=90, dpi=(PAGE_DPI, PAGE_DPI))
+            corpus.append({
+                'path': path,
+                'format': file_format,
+                'fields': fields,
+                'markdown': bill_markdown(fields, usage_days),
+                'expected': expected_bill_info(fields),
+            })
+    return corpus
@@ -0,0 +1,111 @@
+"""
+Local HTTP stand-in for the origins /process_url downloads from. Serves in-memory
+documents with ETag / Last-Modified validation (or without, per document), plus a
+per-request latency and a trickle mode for exercising timeouts and size caps.
+"""
+import email.utils
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeDocument:
+    def __init__(self, content, content_type='application/pdf', validators=True, trickle_bytes_per_s=None):
+        self.content_type = content_type
+        self.validators = validators
+        self.trickle_bytes_per_s = trickle_bytes_per_s
+        self.replace(content)
+
+    def replace(self, content):
+        """Change the document, as an origin publishing a new version would"""
+        self.content = content
+        self.etag = '"%s"' % hashlib.sha256(content).hexdigest()[:16]
+        self.last_modified = email.utils.formatdate(time.time(), usegmt=True)
+
+
+class FakeOrigin:
+    """Serves `documents` ({path: FakeDocument}) on 127.0.0.1; use url(path) for their URLs"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.documents = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep-alive, so the app's connection pooling shows
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionResetError:
+                    pass # The client dropped a kept-alive connection (timeout or size cap)
+
+            def do_GET(self):
+                origin.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-origin', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server.server_port}{path}'
+
+    def handle(self, request):
+        time.sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+        document = self.documents.get(request.path)
+        if document is None:
+            request.send_response(404)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+
+        # If-None-Match takes precedence over the (one-second resolution) If-Modified-Since
+        if_none_match = request.headers.get('If-None-Match')
+        if document.validators and (
+            if_none_match == document.etag if if_none_match
+            else request.headers.get('If-Modified-Since') == document.last_modified
+        ):
+            with self.lock:
+                self.not_modified += 1
+            request.send_response(304)
+            request.send_header('ETag', document.etag)
+            request.end_headers()
+            return
+
+        request.send_response(200)
+        request.send_header('Content-Type', document.content_type)
+        request.send_header('Content-Length', str(len(document.content)))
+        if document.validators:
+            request.send_header('ETag', document.etag)
+            request.send_header('Last-Modified', document.last_modified)
+        request.end_headers()
+        try:
+            if document.trickle_bytes_per_s:
+                for offset in range(0, len(document.content), document.trickle_bytes_per_s):
+                    request.wfile.write(document.content[offset:offset + document.trickle_bytes_per_s])
+                    request.wfile.flush()
+                    time.sleep(1)
+            else:
+                request.wfile.write(document.content)
+        except (BrokenPipeError, ConnectionResetError):
+            return # The client gave up (timeout or size cap)
+        with self.lock:
+            self.bytes_sent += len(document.content)
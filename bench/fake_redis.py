@@ -0,0 +1,59 @@
+"""
+In-memory stand-in for the redis client behind rate_limits.RedisBuckets and
+ttl_cache.SharedGenerations. eval() runs TOKEN_BUCKET_SCRIPT's logic in Python;
+get() and incr() cover the generation counters. Each round trip has a fixed latency,
+and a `down` switch exercises the fail-open paths.
+"""
+import math
+import threading
+import time
+
+from rate_limits import TOKEN_BUCKET_SCRIPT
+
+
+class FakeRedis:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.down = False
+        self._buckets = {} # key -> (tokens, updated, expires_at)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def eval(self, script, numkeys, *keys_and_args):
+        if script != TOKEN_BUCKET_SCRIPT:
+            raise NotImplementedError('FakeRedis only runs the token bucket script')
+        self._round_trip()
+        keys = keys_and_args[:numkeys]
+        cost = float(keys_and_args[numkeys])
+        limits = [(float(rate), float(burst)) for rate, burst in
+                  zip(keys_and_args[numkeys + 1::2], keys_and_args[numkeys + 2::2])]
+        now = time.time()
+        with self._lock:
+            refilled = []
+            for key, (rate, burst) in zip(keys, limits):
+                tokens, updated, expires_at = self._buckets.get(key, (burst, now, math.inf))
+                if expires_at <= now:
+                    tokens, updated = burst, now
+                refilled.append(min(burst, tokens + max(0.0, now - updated) * rate))
+            waits = [max(0.0, (cost - tokens) / rate) for tokens, (rate, _) in zip(refilled, limits)]
+            admitted = not any(waits)
+            for key, tokens, (rate, burst) in zip(keys, refilled, limits):
+                self._buckets[key] = (tokens - cost if admitted else tokens, now, now + math.ceil(burst / rate) + 1)
+        return [str(wait).encode() for wait in waits]
+
+    def get(self, key):
+        self._round_trip()
+        with self._lock:
+            value = self._values.get(key)
+        return None if value is None else str(value).encode()
+
+    def incr(self, key):
+        self._round_trip()
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + 1
+            return self._values[key]
+
+    def _round_trip(self):
+        time.sleep(self.latency)
+        if self.down:
+            raise ConnectionError('FakeRedis is down')
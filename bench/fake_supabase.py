@@ -0,0 +1,149 @@
+"""
+In-memory stand-in for the supabase-py client, for benchmarking the Flask routes
+without a network. Covers the calls app.py makes (table queries, inserts and
+upserts, Storage uploads and downloads) and adds a fixed latency to each round trip.
+"""
+import itertools
+import threading
+import time
+
+
+class FakeResult:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+
+
+class FakeQuery:
+    """Chainable query builder; eq/in_ filter rows, other modifiers are accepted and ignored"""
+
+    def __init__(self, backend, table):
+        self.backend = backend
+        self.table = table
+        self.filters = []
+        self.rows_to_write = None
+        self.ignore_duplicates_on = None
+
+    def select(self, *args, **kwargs):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def in_(self, column, values):
+        values = {str(value) for value in values}
+        self.filters.append(lambda row: str(row.get(column)) in values)
+        return self
+
+    def __getattr__(self, name):
+        # order, limit, lt, gt, gte, lte, or_, ... : accepted, not applied
+        return lambda *args, **kwargs: self
+
+    def insert(self, rows):
+        self.rows_to_write = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False, **kwargs):
+        self.rows_to_write = rows if isinstance(rows, list) else [rows]
+        self.ignore_duplicates_on = on_conflict if ignore_duplicates else None
+        return self
+
+    def execute(self):
+        time.sleep(self.backend.db_latency)
+        if self.rows_to_write is not None:
+            return FakeResult(self.backend.write(self.table, self.rows_to_write, self.ignore_duplicates_on))
+        return FakeResult(self.backend.read(self.table, self.filters))
+
+
+class FakeBucket:
+    def __init__(self, backend, bucket):
+        self.backend = backend
+        self.bucket = bucket
+
+    def upload(self, file, path, file_options=None):
+        time.sleep(self.backend.storage_latency)
+        content = file if isinstance(file, bytes) else b''.join(iter(lambda: file.read(1024 * 1024), b''))
+        with self.backend.lock:
+            if (self.bucket, path) in self.backend.objects and (file_options or {}).get('upsert') != 'true':
+                raise RuntimeError(f'Duplicate: {path} already exists')
+            self.backend.objects[(self.bucket, path)] = content
+        return {'path': path}
+
+    def download(self, path):
+        time.sleep(self.backend.storage_latency)
+        with self.backend.lock:
+            content = self.backend.objects.get((self.bucket, path))
+        if content is None:
+            raise RuntimeError(f'Object not found: {path}')
+        return content
+
+    def get_public_url(self, path):
+        return f'https://storage.invalid/storage/v1/object/public/{self.bucket}/{path}'
+
+
+class FakeStorage:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def from_(self, bucket):
+        return FakeBucket(self.backend, bucket)
+
+
+class FakeAuth:
+    def refresh_session(self, refresh_token):
+        raise RuntimeError('FakeSupabase does not refresh sessions; use a token that does not expire')
+
+    def sign_in_with_password(self, credentials):
+        raise RuntimeError('FakeSupabase does not sign in; put a session in the Flask test client instead')
+
+
+class FakeSupabase:
+    """Shared state behind every fake client (all clients see the same tables)"""
+
+    def __init__(self, db_latency=0.0, storage_latency=0.0):
+        self.db_latency = db_latency
+        self.storage_latency = storage_latency
+        self.tables = {}
+        self.objects = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def seed(self, table, rows):
+        with self.lock:
+            for row in rows:
+                self.tables.setdefault(table, []).append(dict(row, id=next(self._ids)))
+
+    def read(self, table, filters):
+        with self.lock:
+            return [dict(row) for row in self.tables.get(table, []) if all(f(row) for f in filters)]
+
+    def write(self, table, rows, ignore_duplicates_on=None):
+        stored = []
+        with self.lock:
+            existing = self.tables.setdefault(table, [])
+            seen = {row.get(ignore_duplicates_on) for row in existing} if ignore_duplicates_on else set()
+            for row in rows:
+                # Like a unique index, NULL never conflicts
+                if ignore_duplicates_on and row.get(ignore_duplicates_on) is not None \
+                        and row[ignore_duplicates_on] in seen:
+                    continue
+                seen.add(row.get(ignore_duplicates_on))
+                row = dict(row, id=next(self._ids))
+                existing.append(row)
+                stored.append(dict(row))
+        return stored
+
+    def create_client(self, url, key, options=None):
+        """Drop-in replacement for supabase.create_client"""
+        return FakeClient(self)
+
+
+class FakeClient:
+    def __init__(self, backend):
+        self.backend = backend
+        self.storage = FakeStorage(backend)
+        self.auth = FakeAuth()
+
+    def table(self, name):
+        return FakeQuery(self.backend, name)
@@ -0,0 +1,222 @@
+"""Field extraction for scanned utility bills (markdown exported by docling)."""
+import re
+
+try:
+    import ahocorasick  # pyahocorasick: optional, C implementation of Aho-Corasick
+except ImportError:
+    ahocorasick = None
+
+# Bump whenever extract_bill_info gives different output for the same markdown:
+# cached scan results from an older parser are then converted again (see scan_cache)
+PARSER_VERSION = 1
+
+HK_ELECTRIC_COMPANY = 'The Hongkong Electric Co., Ltd.'
+HK_ELECTRIC_BRAND = 'HK Electric'
+
+# Lines that end the recipient address block, and lines dropped from it
+_ADDRESS_TERMINATORS = ('Residential', 'Account', 'Deposit')
+_ADDRESS_SKIP_KEYWORDS = ('Residential', 'Tariff', 'Deposit', 'Account')
+
+# Recipient name: a single upper-case line directly under the company name
+_NAME_RE = re.compile(r'[A-Z][A-Z ]+')
+
+# Each pattern starts with a literal label, so re can skip ahead with a fast literal
+# search instead of trying every position, and has no nested or overlapping
+# quantifiers, so a match attempt is linear in its length.
+_ACCOUNT_RE = re.compile(r'Account Number\s*([0-9]{10})')
+_DATE_RE = re.compile(r'Date of Bill\s*([0-9]{2}/[0-9]{2}/[0-9]{4})')
+_AMOUNT_VALUE = r'\s*(?:\$\s*)?([0-9,]+(?:\.[0-9]*)?)'
+
+# Highest priority first: the last match of the best label present wins
+_AMOUNT_PATTERNS = tuple(
+    (label, re.compile(re.escape(label) + _AMOUNT_VALUE))
+    for label in ('Please Pay This Amount', 'Total Amount Due', 'Amount Due')
+)
+
+
+def empty_bill_info():
+    return {
+        'recipient_name': '',
+        'recipient_address': '',
+        'account_number': '',
+        'date_of_bill': '',
+        'amount_due': '',
+        'is_electric_bill': False,
+        'provider': ''
+    }
+
+
+def is_hk_electric_bill(text):
+    """Check if the document is a HK Electric bill"""
+    return HK_ELECTRIC_COMPANY in text and HK_ELECTRIC_BRAND in text
+
+
+def _iter_lines(text, pos):
+    """Yield the lines of `text` from `pos` on without splitting the whole document"""
+    while True:
+        end = text.find('\n', pos)
+        if end == -1:
+            yield text[pos:]
+            return
+        yield text[pos:end]
+        pos = end + 1
+
+
+def _extract_recipient(text):
+    """
+    Return (name, address) from the block under the company name: the name is the
+    first upper-case line, the address the following lines up to the tariff/account
+    section. Walks the lines once instead of backtracking a multi-line regex.
+    """
+    start = text.find(HK_ELECTRIC_COMPANY)
+    while start != -1:
+        lines = _iter_lines(text, start + len(HK_ELECTRIC_COMPANY))
+        # The company name must end its line
+        if not next(lines).strip():
+            line = next(lines, None)
+            while line is not None and not line.strip():
+                line = next(lines, None)
+            if line is not None and _NAME_RE.fullmatch(line.rstrip()):
+                name = line.strip()
+                address = []
+                for line in lines:
+                    if line.startswith(_ADDRESS_TERMINATORS):
+                        break
+                    line = line.strip()
+                    if line and not any(keyword in line for keyword in _ADDRESS_SKIP_KEYWORDS):
+                        address.append(line)
+                return name, ', '.join(address)
+        start = text.find(HK_ELECTRIC_COMPANY, start + 1)
+    return '', ''
+
+
+def _last_match(text, label, pattern):
+    """Value of the last `label` occurrence that `pattern` matches, found by searching backwards"""
+    end = len(text)
+    while True:
+        end = text.rfind(label, 0, end)
+        if end == -1:
+            return None
+        match = pattern.match(text, end)
+        if match:
+            return match.group(1)
+
+
+def parse_hk_electric(text, info):
+    """Fill `info` with the HK Electric fields found in `text`"""
+    info['recipient_name'], info['recipient_address'] = _extract_recipient(text)
+
+    account_match = _ACCOUNT_RE.search(text)
+    if account_match:
+        info['account_number'] = account_match.group(1)
+
+    date_match = _DATE_RE.search(text)
+    if date_match:
+        info['date_of_bill'] = date_match.group(1)
+
+    for label, pattern in _AMOUNT_PATTERNS:
+        amount = _last_match(text, label, pattern)
+        if amount is not None:
+            info['amount_due'] = amount.replace(',', '')
+            break
+    return info
+
+
+# --- PROVIDER REGISTRY ---
+
+class SignatureMatcher:
+    """
+    Reports which of a fixed set of signature tokens occur in a text. With pyahocorasick
+    installed and enough tokens this is a single Aho-Corasick pass whatever the number
+    of tokens; otherwise each token is a separate (C-speed) substring search, run only
+    when a parser asks for it, which is faster while there are only a few.
+    """
+
+    # Measured crossover on a 1.4 MB bill: below this many tokens substring search wins
+    AUTOMATON_MIN_TOKENS = 16
+
+    def __init__(self, tokens):
+        self.tokens = frozenset(tokens)
+        self._automaton = None
+        if ahocorasick and len(self.tokens) >= self.AUTOMATON_MIN_TOKENS:
+            self._automaton = ahocorasick.Automaton()
+            for token in self.tokens:
+                self._automaton.add_word(token, token)
+            self._automaton.make_automaton()
+
+    @property
+    def uses_automaton(self):
+        return self._automaton is not None
+
+    def lookup(self, text):
+        """Return `present(token)` for `text`; substring searches are made on demand and remembered"""
+        if self._automaton is None:
+            searched = {}
+
+            def present(token):
+                if token not in searched:
+                    searched[token] = token in text
+                return searched[token]
+            return present
+        found = set()
+        for _, token in self._automaton.iter(text):
+            found.add(token)
+            if len(found) == len(self.tokens):
+                break
+        return found.__contains__
+
+
+class BillParser:
+    """A provider's signature tokens (all must appear) and the function that fills in its fields"""
+
+    def __init__(self, provider, signatures, parse, is_electric_bill=False):
+        self.provider = provider
+        self.signatures = tuple(signatures)
+        # Longest first: a longer token is usually the rarer one, and substring search skips
+        # through text faster the longer the token, so a non-matching document fails fast
+        self.check_order = tuple(sorted(self.signatures, key=len, reverse=True))
+        self.parse = parse
+        self.is_electric_bill = is_electric_bill
+
+
+class ParserRegistry:
+    """Picks the parser for a document from one signature scan, so only that parser's extraction runs"""
+
+    def __init__(self):
+        self._parsers = []
+        self._matcher = None
+
+    def register(self, parser):
+        self._parsers.append(parser)
+        self._matcher = None  # Rebuilt with the new tokens on the next detect()
+        return parser
+
+    def detect(self, text):
+        """Return the first registered parser whose signatures all occur in `text`, or None"""
+        if self._matcher is None:
+            self._matcher = SignatureMatcher(token for parser in self._parsers for token in parser.signatures)
+        present = self._matcher.lookup(text)
+        for parser in self._parsers:
+            if all(present(token) for token in parser.check_order):
+                return parser
+        return None
+
+    def extract(self, text):
+        info = empty_bill_info()
+        parser = self.detect(text)
+        if parser is None:
+            return info
+        info['provider'] = parser.provider
+        info['is_electric_bill'] = parser.is_electric_bill
+        return parser.parse(text, info)
+
+
+parsers = ParserRegistry()
+parsers.register(BillParser(
+    'hk_electric', (HK_ELECTRIC_COMPANY, HK_ELECTRIC_BRAND), parse_hk_electric, is_electric_bill=True
+))
+
+
+def extract_bill_info(text):
+    """Extract specific information from a utility bill using the parser of the detected provider"""
+    return parsers.extract(text)
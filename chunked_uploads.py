@@ -0,0 +1,186 @@
+"""Resumable chunked uploads: files are appended chunk by chunk at the offset the server reports."""
+import json
+import os
+import re
+import time
+import uuid
+
+try:
+    import fcntl  # Serialises appends across worker processes (POSIX only)
+except ImportError:
+    fcntl = None
+
+_UPLOAD_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+
+class UploadError(Exception):
+    """Rejected chunk or upload; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class ChunkedUploadStore:
+    """
+    Upload state lives next to the data in `directory` (`<id>.part` + `<id>.json`), so
+    any worker process can accept the next chunk and an interrupted client resumes
+    from get()['offset'] instead of starting over. Chunks must arrive in order: a
+    chunk is accepted only at the current offset, which makes retries idempotent.
+    Uploads expire `ttl` seconds after their last chunk (`updated_at` in the metadata).
+    """
+
+    def __init__(self, directory, max_bytes, chunk_bytes=1024 * 1024, ttl=24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_bytes = chunk_bytes
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self, owner_id, filename, size):
+        if size <= 0 or size > self.max_bytes:
+            raise UploadError(f'Upload size must be between 1 byte and {self.max_bytes // (1024 * 1024)} MB', 413)
+        self._remove_expired()
+        upload_id = uuid.uuid4().hex
+        now = time.time()
+        meta = {'upload_id': upload_id, 'owner_id': owner_id, 'filename': filename, 'size': size,
+                'created_at': now, 'updated_at': now}
+        open(self._part_path(upload_id), 'wb').close()
+        self._write_meta(meta)
+        return dict(meta, offset=0)
+
+    def get(self, upload_id, owner_id):
+        """Upload metadata plus the current `offset`; None if unknown, expired or someone else's"""
+        if not _UPLOAD_ID_RE.fullmatch(upload_id or ''):
+            return None
+        try:
+            with open(self._meta_path(upload_id)) as f:
+                meta = json.load(f)
+            offset = os.path.getsize(self._part_path(upload_id))
+        except (OSError, ValueError):
+            return None
+        if meta['owner_id'] != owner_id:
+            return None
+        return dict(meta, offset=offset)
+
+    def append(self, upload_id, owner_id, offset, stream, length):
+        """Write `length` bytes from `stream` at `offset`, which must be the current end; returns the new offset"""
+        meta = self.get(upload_id, owner_id)
+        if meta is None:
+            raise UploadError('Upload not found', 404)
+        if length is None or length <= 0 or length > self.chunk_bytes:
+            raise UploadError(f'Chunks must be 1 to {self.chunk_bytes} bytes with a Content-Length', 400)
+        if offset + length > meta['size']:
+            raise UploadError('Chunk runs past the declared upload size', 400, meta['size'])
+
+        # Only this upload's file is locked: other uploads carry on while a slow client sends its chunk
+        with open(self._part_path(upload_id), 'r+b') as part:
+            if fcntl:
+                fcntl.flock(part, fcntl.LOCK_EX)
+            current = part.seek(0, os.SEEK_END)
+            if offset != current:
+                # A retried or out-of-order chunk: tell the client where to continue
+                raise UploadError('Offset mismatch', 409, current)
+            written = 0
+            try:
+                while written < length:
+                    data = stream.read(min(64 * 1024, length - written))
+                    if not data:
+                        break
+                    part.write(data)
+                    written += len(data)
+            except BaseException:
+                # The read failed (e.g. ClientDisconnected): discard the partial write so the retry lines up
+                part.truncate(current)
+                raise
+            if written != length:
+                # Connection closed mid-chunk: discard the partial write likewise
+                part.truncate(current)
+                raise UploadError('Incomplete chunk', 400, current)
+            meta.pop('offset')
+            self._write_meta(dict(meta, updated_at=time.time()))
+        return current + written
+
+    def claim(self, upload_id, owner_id, suffix=''):
+        """
+        Move a complete upload's file out of the store for processing; returns (meta, path).
+        The caller then either forget()s the upload (and deletes the file when done) or
+        release()s the file back so the client can ask to process it again later.
+        """
+        meta = self.get(upload_id, owner_id)
+        if meta is None:
+            raise UploadError('Upload not found', 404)
+        if meta['offset'] != meta['size']:
+            raise UploadError('Upload is incomplete', 409, meta['offset'])
+        claimed_path = self._part_path(upload_id) + '.claimed' + suffix
+        try:
+            os.replace(self._part_path(upload_id), claimed_path)
+        except FileNotFoundError:
+            raise UploadError('Upload not found', 404) # Claimed concurrently
+        return meta, claimed_path
+
+    def release(self, upload_id, claimed_path):
+        os.replace(claimed_path, self._part_path(upload_id))
+
+    def forget(self, upload_id):
+        try:
+            os.unlink(self._meta_path(upload_id))
+        except OSError:
+            pass
+
+    def _remove_expired(self):
+        """
+        Remove uploads whose last chunk is older than the ttl. Claimed files belong to a
+        scan in progress (which deletes or releases them) and are never touched.
+        """
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            upload_id, ext = os.path.splitext(name)
+            if not _UPLOAD_ID_RE.fullmatch(upload_id):
+                continue
+            try:
+                if ext == '.json':
+                    with open(self._meta_path(upload_id)) as f:
+                        meta = json.load(f)
+                    if meta.get('updated_at', meta['created_at']) < cutoff:
+                        self._remove_upload(upload_id, cutoff)
+                elif ext == '.part' and not os.path.exists(self._meta_path(upload_id)):
+                    # Orphaned by a crash during create(); without metadata it takes no chunks
+                    if os.path.getmtime(self._part_path(upload_id)) < cutoff:
+                        os.unlink(self._part_path(upload_id))
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def _remove_upload(self, upload_id, cutoff):
+        try:
+            part = open(self._part_path(upload_id), 'r+b')
+        except FileNotFoundError:
+            claimed_prefix = f'{upload_id}.part.claimed'
+            if any(name.startswith(claimed_prefix) for name in os.listdir(self.directory)):
+                return # Being scanned; the scan forgets or releases it
+            part = None
+        try:
+            if part and fcntl:
+                fcntl.flock(part, fcntl.LOCK_EX) # Wait out a chunk being written right now
+            with open(self._meta_path(upload_id)) as f:
+                if json.load(f).get('updated_at', 0) >= cutoff:
+                    return # A chunk arrived meanwhile
+            if part:
+                os.unlink(self._part_path(upload_id))
+            os.unlink(self._meta_path(upload_id))
+        finally:
+            if part:
+                part.close()
+
+    def _write_meta(self, meta):
+        tmp_path = self._meta_path(meta['upload_id']) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path(meta['upload_id']))
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.directory, f'{upload_id}.part')
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.directory, f'{upload_id}.json')
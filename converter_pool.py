@@ -0,0 +1,196 @@
+"""Process-wide pool of warm docling DocumentConverter instances."""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from bill_parsers import extract_bill_info
+from image_prep import normalized_for_ocr
+from instrumentation import collected_spans, log, stage
+
+# Fields that must be found on the first pages before full conversion is skipped
+REQUIRED_BILL_FIELDS = ('account_number', 'amount_due')
+
+
+def _default_factory():
+    from docling.document_converter import DocumentConverter
+    return DocumentConverter()
+
+
+def _warm_converter(converter):
+    """Force docling to load its layout/OCR models now instead of on the first convert() call"""
+    if not hasattr(converter, 'initialize_pipeline'):
+        return
+    try:
+        from docling.datamodel.base_models import InputFormat
+    except ImportError:
+        return
+    for input_format in (InputFormat.PDF, InputFormat.IMAGE):
+        try:
+            converter.initialize_pipeline(input_format)
+        except Exception as e:
+            log(f"Converter warm-up skipped for {input_format}: {e}")
+
+
+class ConverterPool:
+    """
+    Keeps `size` DocumentConverter instances loaded for the lifetime of the process
+    and lends them out one request at a time.
+    """
+
+    def __init__(self, size=1, factory=None, warm=True):
+        self.size = max(1, int(size))
+        self._factory = factory or _default_factory
+        self._warm = warm
+        self._idle = queue.Queue()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._started = False
+        self._warming = False
+        self._busy = 0
+        self._waiting = 0
+        self._acquired_total = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+        self._warmup_seconds = None
+
+    def start(self):
+        """Create and warm every converter. Safe to call repeatedly; only the first call does work."""
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            started_at = time.monotonic()
+            converters = []
+            for _ in range(self.size):
+                converter = self._factory()
+                if self._warm:
+                    _warm_converter(converter)
+                converters.append(converter)
+            for converter in converters:
+                self._idle.put(converter)
+            self._warmup_seconds = time.monotonic() - started_at
+            self._started = True
+            log(f"Converter pool ready: {self.size} converter(s) warmed in {self._warmup_seconds:.2f}s")
+
+    def start_in_background(self):
+        """Warm the pool on a daemon thread so the web server can bind while models load"""
+        # Not _start_lock: that is held for the whole warm-up, and callers must not wait on it
+        with self._stats_lock:
+            if self._started or self._warming:
+                return
+            self._warming = True
+
+        def _run():
+            try:
+                self.start()
+            except Exception as e:
+                # The next acquire() retries start() and surfaces the error to the request
+                log(f"Converter pool warm-up failed: {e}")
+            finally:
+                self._warming = False
+
+        threading.Thread(target=_run, name='converter-pool-warmup', daemon=True).start()
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Borrow a converter, blocking until one is free (or `timeout` seconds pass)"""
+        self.start()
+        wait_started = time.monotonic()
+        with self._stats_lock:
+            self._waiting += 1
+        try:
+            with stage('converter_wait'):
+                converter = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No document converter became available within {timeout}s")
+        finally:
+            with self._stats_lock:
+                self._waiting -= 1
+
+        waited = time.monotonic() - wait_started
+        with self._stats_lock:
+            self._busy += 1
+            self._acquired_total += 1
+            self._wait_seconds_total += waited
+            self._wait_seconds_max = max(self._wait_seconds_max, waited)
+        try:
+            yield converter
+        finally:
+            with self._stats_lock:
+                self._busy -= 1
+            self._idle.put(converter)
+
+    def convert(self, source, **kwargs):
+        """Run `DocumentConverter.convert` on a pooled converter"""
+        with self.acquire() as converter:
+            return converter.convert(source, **kwargs)
+
+    def stats(self):
+        with self._stats_lock:
+            acquired = self._acquired_total
+            return {
+                'size': self.size,
+                'ready': self._started,
+                'idle': self._idle.qsize(),
+                'busy': self._busy,
+                'waiting': self._waiting,
+                'acquired_total': acquired,
+                'wait_seconds_total': round(self._wait_seconds_total, 6),
+                'wait_seconds_avg': round(self._wait_seconds_total / acquired, 6) if acquired else 0.0,
+                'wait_seconds_max': round(self._wait_seconds_max, 6),
+                'warmup_seconds': round(self._warmup_seconds, 6) if self._warmup_seconds is not None else None,
+            }
+
+
+def convert_and_extract(converter, source, fast_pages=0):
+    """
+    Convert `source` and run extract_bill_info on the markdown. Returns (markdown, bill_info).
+
+    With `fast_pages` > 0 only the first `fast_pages` pages are converted; the whole
+    document is converted again only when a required field is missing and there are
+    pages left that could contain it.
+    """
+    if fast_pages > 0:
+        with stage('convert'):
+            result = converter.convert(source, page_range=(1, fast_pages))
+            markdown = result.document.export_to_markdown()
+        with stage('extract'):
+            bill_info = extract_bill_info(markdown)
+        page_count = getattr(result.input, 'page_count', 0) or 0
+        if all(bill_info.get(field) for field in REQUIRED_BILL_FIELDS) or page_count <= fast_pages:
+            return markdown, bill_info
+
+    # Named apart from 'convert' so the cost of fast-path misses shows up on its own
+    with stage('convert_full' if fast_pages > 0 else 'convert'):
+        markdown = converter.convert(source).document.export_to_markdown()
+    with stage('extract'):
+        return markdown, extract_bill_info(markdown)
+
+
+# --- PROCESS-POOL WORKERS (used with concurrent.futures.ProcessPoolExecutor) ---
+
+_process_converter = None
+
+
+def init_process_converter(warm=True):
+    """ProcessPoolExecutor initializer: load one converter per worker process"""
+    global _process_converter
+    _process_converter = _default_factory()
+    if warm:
+        _warm_converter(_process_converter)
+
+
+def convert_and_extract_in_process(source, fast_pages=0, image_options=None):
+    """
+    Normalise an image upload (see image_prep) and run convert_and_extract with this worker
+    process's converter. Returns (markdown, bill_info, spans): the stage timings measured
+    here, for the web process to record (this process's metrics are never scraped).
+    """
+    if _process_converter is None:
+        init_process_converter()
+    with collected_spans() as spans:
+        with normalized_for_ocr(source, **(image_options or {'enabled': False})) as ocr_path:
+            markdown, bill_info = convert_and_extract(_process_converter, ocr_path, fast_pages)
+    return markdown, bill_info, spans
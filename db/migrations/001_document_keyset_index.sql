@@ -0,0 +1,8 @@
+-- Keyset pagination for GET /documents: newest first, optionally per user.
+-- Serves ORDER BY created_at DESC, id DESC with the (created_at, id) cursor predicate.
+
+CREATE INDEX IF NOT EXISTS document_user_created_at_id_idx
+  ON public.document (user_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS document_created_at_id_idx
+  ON public.document (created_at DESC, id DESC);
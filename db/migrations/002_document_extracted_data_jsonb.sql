@@ -0,0 +1,67 @@
+-- Store document.extracted_data as JSONB and expose the bill fields as indexed,
+-- generated columns so /documents can filter in Postgres instead of Python.
+--
+-- Backfill: the ALTER ... USING below converts every existing row in place, and the
+-- generated columns are computed for existing rows when they are added. Rows whose
+-- text is not valid JSON are kept as a JSON string instead of failing the migration.
+
+-- Text -> jsonb that never raises
+CREATE OR REPLACE FUNCTION public.safe_jsonb(value text) RETURNS jsonb
+LANGUAGE plpgsql IMMUTABLE AS $$
+BEGIN
+  IF value IS NULL OR btrim(value) = '' THEN
+    RETURN NULL;
+  END IF;
+  RETURN value::jsonb;
+EXCEPTION WHEN others THEN
+  RETURN to_jsonb(value);
+END;
+$$;
+
+-- 'DD/MM/YYYY' (as printed on HK bills) -> date, NULL when missing or invalid
+CREATE OR REPLACE FUNCTION public.bill_date_from_text(value text) RETURNS date
+LANGUAGE plpgsql IMMUTABLE AS $$
+BEGIN
+  IF value IS NULL OR value !~ '^\d{2}/\d{2}/\d{4}$' THEN
+    RETURN NULL;
+  END IF;
+  RETURN make_date(substr(value, 7, 4)::int, substr(value, 4, 2)::int, substr(value, 1, 2)::int);
+EXCEPTION WHEN others THEN
+  RETURN NULL;
+END;
+$$;
+
+-- '1234.50' -> numeric, NULL when missing or not a number
+CREATE OR REPLACE FUNCTION public.bill_amount_from_text(value text) RETURNS numeric
+LANGUAGE plpgsql IMMUTABLE AS $$
+BEGIN
+  IF value IS NULL OR value !~ '^\d+(\.\d*)?$' THEN
+    RETURN NULL;
+  END IF;
+  RETURN value::numeric;
+END;
+$$;
+
+ALTER TABLE public.document
+  ALTER COLUMN extracted_data TYPE jsonb USING public.safe_jsonb(extracted_data);
+
+ALTER TABLE public.document
+  ADD COLUMN IF NOT EXISTS bill_account_number text
+    GENERATED ALWAYS AS (NULLIF(extracted_data ->> 'account_number', '')) STORED,
+  ADD COLUMN IF NOT EXISTS bill_date date
+    GENERATED ALWAYS AS (public.bill_date_from_text(extracted_data ->> 'date_of_bill')) STORED,
+  ADD COLUMN IF NOT EXISTS bill_amount_due numeric
+    GENERATED ALWAYS AS (public.bill_amount_from_text(extracted_data ->> 'amount_due')) STORED;
+
+CREATE INDEX IF NOT EXISTS document_user_bill_account_idx
+  ON public.document (user_id, bill_account_number);
+
+CREATE INDEX IF NOT EXISTS document_user_bill_date_idx
+  ON public.document (user_id, bill_date DESC);
+
+CREATE INDEX IF NOT EXISTS document_user_bill_amount_idx
+  ON public.document (user_id, bill_amount_due);
+
+-- Ad-hoc containment queries on any extracted field, e.g. extracted_data @> '{"provider": "hk_electric"}'
+CREATE INDEX IF NOT EXISTS document_extracted_data_gin_idx
+  ON public.document USING gin (extracted_data jsonb_path_ops);
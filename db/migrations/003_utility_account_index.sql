@@ -0,0 +1,4 @@
+-- Account-number matching during scans filters utility by owner and account number.
+
+CREATE INDEX IF NOT EXISTS utility_user_account_idx
+  ON public.utility (user_id, account_number);
@@ -0,0 +1,7 @@
+-- Write-behind document inserts are delivered at least once; the key makes redelivery a no-op
+-- (INSERT ... ON CONFLICT (idempotency_key) DO NOTHING via PostgREST upsert).
+
+ALTER TABLE public.document ADD COLUMN IF NOT EXISTS idempotency_key uuid;
+
+CREATE UNIQUE INDEX IF NOT EXISTS document_idempotency_key_key
+  ON public.document (idempotency_key);
@@ -0,0 +1,81 @@
+-- Monthly bill totals per user, account, property and tenant for GET /analytics.
+-- A trigger on document keeps the rollup current for every write path (scans, the
+-- write-behind outbox, bulk inserts, edits and deletes), so /analytics reads a few
+-- rollup rows instead of every document. Documents without a parsed bill date or
+-- amount due (the generated columns from 002) are not counted.
+
+CREATE TABLE IF NOT EXISTS public.document_bill_rollup (
+  user_id uuid NOT NULL,
+  month date NOT NULL, -- first day of the bill's month
+  account_number text,
+  property_id bigint,
+  tenant_id bigint,
+  bill_count integer NOT NULL DEFAULT 0,
+  amount_due_total numeric NOT NULL DEFAULT 0
+);
+
+-- One row per combination, with a missing account/property/tenant as its own group (Postgres 15+).
+-- Its (user_id, month) prefix also serves /analytics' per-user month-range reads.
+CREATE UNIQUE INDEX IF NOT EXISTS document_bill_rollup_key
+  ON public.document_bill_rollup (user_id, month, account_number, property_id, tenant_id) NULLS NOT DISTINCT;
+
+ALTER TABLE public.document_bill_rollup ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Users can view own bill rollups" ON public.document_bill_rollup;
+CREATE POLICY "Users can view own bill rollups" ON public.document_bill_rollup
+  AS PERMISSIVE FOR SELECT TO authenticated USING (auth.uid() = user_id);
+
+-- Add (sign = 1) or remove (sign = -1) one bill from its rollup row
+CREATE OR REPLACE FUNCTION public.document_bill_rollup_apply(
+  p_user_id uuid, p_bill_date date, p_account_number text, p_property_id bigint, p_tenant_id bigint,
+  p_amount_due numeric, p_sign integer
+) RETURNS void
+LANGUAGE sql AS $$
+  INSERT INTO public.document_bill_rollup AS r
+    (user_id, month, account_number, property_id, tenant_id, bill_count, amount_due_total)
+  VALUES
+    (p_user_id, date_trunc('month', p_bill_date)::date, p_account_number, p_property_id, p_tenant_id,
+     p_sign, p_sign * p_amount_due)
+  ON CONFLICT (user_id, month, account_number, property_id, tenant_id)
+  DO UPDATE SET bill_count = r.bill_count + EXCLUDED.bill_count,
+                amount_due_total = r.amount_due_total + EXCLUDED.amount_due_total;
+$$;
+
+-- Runs as the table owner: users insert documents but cannot write rollups directly
+CREATE OR REPLACE FUNCTION public.document_bill_rollup_sync() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE')
+     AND OLD.user_id IS NOT NULL AND OLD.bill_date IS NOT NULL AND OLD.bill_amount_due IS NOT NULL THEN
+    PERFORM public.document_bill_rollup_apply(
+      OLD.user_id, OLD.bill_date, OLD.bill_account_number, OLD.property_id, OLD.tenant_id, OLD.bill_amount_due, -1
+    );
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE')
+     AND NEW.user_id IS NOT NULL AND NEW.bill_date IS NOT NULL AND NEW.bill_amount_due IS NOT NULL THEN
+    PERFORM public.document_bill_rollup_apply(
+      NEW.user_id, NEW.bill_date, NEW.bill_account_number, NEW.property_id, NEW.tenant_id, NEW.bill_amount_due, 1
+    );
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+-- Backfill and attach the trigger with document writes blocked, so no row is missed or
+-- counted twice (the lock is held until the migration's transaction commits)
+LOCK TABLE public.document IN SHARE ROW EXCLUSIVE MODE;
+
+DELETE FROM public.document_bill_rollup;
+
+INSERT INTO public.document_bill_rollup
+  (user_id, month, account_number, property_id, tenant_id, bill_count, amount_due_total)
+SELECT user_id, date_trunc('month', bill_date)::date, bill_account_number, property_id, tenant_id,
+       count(*), sum(bill_amount_due)
+FROM public.document
+WHERE user_id IS NOT NULL AND bill_date IS NOT NULL AND bill_amount_due IS NOT NULL
+GROUP BY 1, 2, 3, 4, 5;
+
+DROP TRIGGER IF EXISTS document_bill_rollup_sync ON public.document;
+CREATE TRIGGER document_bill_rollup_sync
+  AFTER INSERT OR DELETE OR UPDATE OF extracted_data, user_id, property_id, tenant_id ON public.document
+  FOR EACH ROW EXECUTE FUNCTION public.document_bill_rollup_sync();
@@ -9,14 +9,27 @@ CREATE TABLE public.document (
   notes text,
   file_urls ARRAY,
   upload_date text,
-  extracted_data text,
+  extracted_data jsonb,
   property_id bigint,
   tenant_id bigint,
   lease_id bigint,
   user_id uuid,
   utility_id bigint,
+  bill_account_number text GENERATED ALWAYS AS (NULLIF(extracted_data ->> 'account_number', '')) STORED,
+  bill_date date GENERATED ALWAYS AS (public.bill_date_from_text(extracted_data ->> 'date_of_bill')) STORED,
+  bill_amount_due numeric GENERATED ALWAYS AS (public.bill_amount_from_text(extracted_data ->> 'amount_due')) STORED,
+  idempotency_key uuid UNIQUE,
   CONSTRAINT document_pkey PRIMARY KEY (id)
 );
+CREATE TABLE public.document_bill_rollup (
+  user_id uuid NOT NULL,
+  month date NOT NULL,
+  account_number text,
+  property_id bigint,
+  tenant_id bigint,
+  bill_count integer NOT NULL DEFAULT 0,
+  amount_due_total numeric NOT NULL DEFAULT 0
+);
 CREATE TABLE public.expense (
   id bigint GENERATED ALWAYS AS IDENTITY NOT NULL,
   created_at timestamp with time zone NOT NULL DEFAULT now(),
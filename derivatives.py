@@ -0,0 +1,138 @@
+"""Small WebP renditions of uploaded documents for list views: a thumbnail and a first-page preview."""
+import io
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from image_prep import IMAGE_EXTENSIONS
+from instrumentation import log, stage
+
+# Rendition name -> long edge in pixels
+DERIVATIVE_SIZES = {'thumbnail': 256, 'preview': 1024}
+# Part of every derivative's ETag: bump it when the sizes or the encoding change
+DERIVATIVE_VERSION = 1
+WEBP_QUALITY = 80
+
+
+def derivative_path(storage_path, name):
+    """Storage path of a rendition, next to the original under the user's prefix"""
+    return f'{storage_path}.{name}.webp'
+
+
+def render_derivatives(path, sizes=DERIVATIVE_SIZES, quality=WEBP_QUALITY):
+    """{name: WebP bytes} for the image, or the first page of the PDF, at `path`; {} for other files"""
+    first_page = _first_page_image(path, max(sizes.values()))
+    if first_page is None:
+        return {}
+
+    from PIL import Image
+
+    rendered = {}
+    for name, long_edge in sizes.items():
+        image = first_page.copy()
+        image.thumbnail((long_edge, long_edge), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format='WEBP', quality=quality, method=4)
+        rendered[name] = out.getvalue()
+    return rendered
+
+
+def _first_page_image(path, long_edge):
+    _, ext = os.path.splitext(path)
+    ext = ext.lower()
+    if ext in IMAGE_EXTENSIONS:
+        from PIL import Image, ImageOps
+
+        with Image.open(path) as original:
+            # JPEGs are decoded at a reduced scale when that still covers the largest rendition
+            original.draft('RGB', (long_edge, long_edge))
+            return ImageOps.exif_transpose(original).convert('RGB')
+    if ext == '.pdf':
+        try:
+            import pypdfium2  # Installed with docling
+        except ImportError:
+            log("PDF previews need pypdfium2 (installed with docling); skipped")
+            return None
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            page = pdf[0]
+            width, height = page.get_size() # PDF points
+            return page.render(scale=long_edge / max(width, height)).to_pil().convert('RGB')
+        finally:
+            pdf.close()
+    return None
+
+
+class DerivativeQueue:
+    """
+    Renders derivatives on `workers` background threads after the scan has answered,
+    and hands them to an upload callback. At most `max_pending` documents wait; past
+    that submit() skips the document, whose derivatives are then rendered the first
+    time they are requested.
+    """
+
+    def __init__(self, workers=1, max_pending=64, sizes=DERIVATIVE_SIZES):
+        self.sizes = sizes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='derivatives')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._failed = 0
+        self._skipped = 0
+
+    def submit(self, source_path, upload):
+        """
+        Render the file at `source_path` in the background, then call upload({name: bytes}).
+        The file is copied first, so the caller may delete it. Returns False if skipped.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._skipped += 1
+            return False
+        try:
+            fd, copy_path = tempfile.mkstemp(suffix=os.path.splitext(source_path)[1].lower())
+            os.close(fd)
+            shutil.copyfile(source_path, copy_path)
+        except OSError as e:
+            self._slots.release()
+            log(f"Derivatives skipped, could not copy {source_path}: {e}")
+            return False
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(self._run, copy_path, upload)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'completed': self._completed,
+                'failed': self._failed,
+                'skipped': self._skipped,
+            }
+
+    def _run(self, path, upload):
+        failed = False
+        try:
+            with stage('derivatives'):
+                rendered = render_derivatives(path, self.sizes)
+                if rendered:
+                    upload(rendered)
+        except Exception as e:
+            failed = True
+            log(f"Derivative rendering failed: {e}")
+        finally:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            with self._lock:
+                self._pending -= 1
+                if failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+            self._slots.release()
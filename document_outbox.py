@@ -0,0 +1,283 @@
+"""Durable write-behind journal for `document` inserts (SQLite), delivered in batches with retry."""
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from instrumentation import log
+
+OUTBOX_PENDING = 'pending'
+OUTBOX_SENT = 'sent'
+OUTBOX_FAILED = 'failed' # Rejected by the database; kept for inspection, never retried
+
+# SQLSTATE classes that mean "try again later" rather than "this row is bad": connection
+# exceptions, transaction rollbacks (serialization, deadlock), insufficient resources,
+# operator intervention (statement timeout, shutdown), system and internal errors.
+TRANSIENT_SQLSTATE_CLASSES = ('08', '40', '53', '57', '58', 'XX')
+
+
+def is_transient(error):
+    """
+    True when `error` says nothing about the rows themselves: transport errors, HTTP 5xx,
+    408/429, PostgREST connection (PGRST0xx) and JWT (PGRST3xx) errors, and the SQLSTATE
+    classes above. Request and schema errors (PGRST1xx/2xx, other 4xx) and constraint or
+    data errors (SQLSTATE 22, 23, 42...) are the row's fault.
+    """
+    code = getattr(error, 'code', None) # postgrest.APIError; other exceptions are transport failures
+    if code is None:
+        return True
+    if isinstance(code, int): # A non-JSON error response (e.g. a gateway's 502 page) carries the HTTP status
+        return code >= 500 or code in (408, 429)
+    code = str(code)
+    if code.startswith('PGRST'):
+        return code[5:6] in ('0', '3')
+    return code[:2] in TRANSIENT_SQLSTATE_CLASSES
+
+
+class DocumentOutbox:
+    """
+    Scans append their `document` row to a local SQLite journal and return at once;
+    a background thread sends pending rows in batches through `send(rows)` and retries
+    failures with capped exponential backoff. A row only leaves the pending state once
+    `send` returned for it, so delivery is at-least-once: every row carries an
+    `idempotency_key` and `send` must make repeated deliveries of a key a no-op.
+
+    `is_transient(error)` sorts failures. A transient one (the database or the network
+    is down) retries the whole batch, for as long as it takes; the backlog shows up in
+    stats() as oldest_pending_age. Any other error is blamed on the rows: the batch is
+    split to find the bad one, and a row rejected `max_attempts` times (a schema
+    reload can reject a good row once) is marked failed.
+
+    `send(rows)` returns {idempotency_key: document_id} for the rows it stored (the id
+    may be None when the row already existed) and raises on failure.
+    """
+
+    def __init__(self, path, send, batch_size=50, linger=0.2, base_delay=1.0, max_delay=300.0,
+                 lease=60.0, sent_ttl=86400, max_attempts=3, is_transient=is_transient):
+        self.path = path
+        self.send = send
+        self.batch_size = batch_size
+        self.linger = linger
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease # Seconds a claimed batch is hidden from other workers sharing the journal
+        self.sent_ttl = sent_ttl # Seconds sent and failed rows stay queryable through status()
+        self.max_attempts = max_attempts # Rejections (not transient failures) before a row is marked failed
+        self.is_transient = is_transient
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._delivered = 0
+        self._failures = 0
+        self._dead = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL') # An acknowledged scan must survive a crash
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS document_outbox (
+                idempotency_key TEXT PRIMARY KEY,
+                owner_id TEXT,
+                row TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                rejections INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                document_id INTEGER,
+                created_at REAL NOT NULL,
+                sent_at REAL
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(document_outbox)')}
+        if 'rejections' not in columns:
+            # Journals from before transient failures were told apart
+            self._conn.execute('ALTER TABLE document_outbox ADD COLUMN rejections INTEGER NOT NULL DEFAULT 0')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS document_outbox_due ON document_outbox (status, next_attempt_at)'
+        )
+
+    def enqueue(self, rows):
+        """Journal `rows` (adding an idempotency_key where missing) and return their keys in order"""
+        now = time.time()
+        keys = []
+        records = []
+        for row in rows:
+            row = dict(row)
+            row.setdefault('idempotency_key', str(uuid.uuid4()))
+            keys.append(row['idempotency_key'])
+            records.append((row['idempotency_key'], row.get('user_id'), json.dumps(row), OUTBOX_PENDING, now, now))
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO document_outbox '
+                    '(idempotency_key, owner_id, row, status, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                    records
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        self._wake.set()
+        return keys
+
+    def status(self, idempotency_key):
+        """{'status', 'document_id', 'attempts', 'last_error', 'owner_id'} for a journaled row, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT status, document_id, attempts, last_error, owner_id FROM document_outbox '
+                'WHERE idempotency_key = ?', (idempotency_key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('status', 'document_id', 'attempts', 'last_error', 'owner_id'), row))
+
+    def start(self):
+        """Start the delivery thread (also drains rows left over from a previous run)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='document-outbox', daemon=True)
+                self._thread.start()
+        return self
+
+    def flush(self):
+        """Deliver every due batch now, on the calling thread; returns the number of rows delivered"""
+        delivered = 0
+        started = time.time() # Rows that fail now come back later, not in this same flush
+        while True:
+            batch = self._claim(started)
+            if not batch:
+                return delivered
+            delivered += self._deliver(batch)
+
+    def stats(self):
+        with self._lock:
+            pending, oldest = self._conn.execute(
+                'SELECT COUNT(*), MIN(created_at) FROM document_outbox WHERE status = ?', (OUTBOX_PENDING,)
+            ).fetchone()
+            (failed,) = self._conn.execute(
+                'SELECT COUNT(*) FROM document_outbox WHERE status = ?', (OUTBOX_FAILED,)
+            ).fetchone()
+            return {
+                'pending': pending,
+                'oldest_pending_age': round(time.time() - oldest, 3) if oldest else 0.0,
+                'failed': failed,
+                'delivered': self._delivered,
+                'failures': self._failures,
+                'given_up': self._dead,
+                'batch_size': self.batch_size,
+            }
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._seconds_until_due())
+            self._wake.clear()
+            # Give concurrent scans a moment to land in the same batch
+            time.sleep(self.linger)
+            try:
+                self.flush()
+            except Exception as e:
+                log(f"Document outbox delivery error: {e}")
+                time.sleep(self.base_delay)
+
+    def _seconds_until_due(self):
+        with self._lock:
+            (next_due,) = self._conn.execute(
+                'SELECT MIN(next_attempt_at) FROM document_outbox WHERE status = ?', (OUTBOX_PENDING,)
+            ).fetchone()
+        if next_due is None:
+            return self.max_delay
+        return min(max(next_due - time.time(), 0), self.max_delay)
+
+    def _claim(self, due_by):
+        """Take up to batch_size rows due by `due_by`, leasing them so another worker process skips them meanwhile"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                claimed = self._conn.execute(
+                    'SELECT idempotency_key, row, attempts, rejections, created_at FROM document_outbox '
+                    'WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?',
+                    (OUTBOX_PENDING, due_by, self.batch_size)
+                ).fetchall()
+                self._conn.executemany(
+                    'UPDATE document_outbox SET next_attempt_at = ? WHERE idempotency_key = ?',
+                    [(now + self.lease, key) for key, *_ in claimed]
+                )
+                # Failed rows record when they were given up in sent_at too
+                self._conn.execute(
+                    'DELETE FROM document_outbox WHERE status IN (?, ?) AND sent_at < ?',
+                    (OUTBOX_SENT, OUTBOX_FAILED, now - self.sent_ttl)
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return [(key, json.loads(row), *counts) for key, row, *counts in claimed]
+
+    def _deliver(self, batch):
+        try:
+            document_ids = self.send([row for _, row, *_ in batch])
+        except Exception as e:
+            if self.is_transient(e):
+                # Retry the batch as a whole: splitting it would only multiply requests to a database that is down
+                self._retry_later(batch, e)
+            elif len(batch) > 1:
+                # Send one by one so a single bad row cannot hold back the rest of the batch
+                return sum(self._deliver([entry]) for entry in batch)
+            else:
+                self._reject(batch[0], e)
+            return 0
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'UPDATE document_outbox SET status = ?, sent_at = ?, document_id = ?, last_error = NULL '
+                'WHERE idempotency_key = ?',
+                [(OUTBOX_SENT, now, document_ids.get(key), key) for key, *_ in batch]
+            )
+            self._delivered += len(batch)
+        return len(batch)
+
+    def _retry_later(self, batch, error):
+        """Back off a batch that failed through no fault of its rows (outage, timeout); never gives up"""
+        attempts = max(entry[2] for entry in batch) + 1
+        # Full jitter keeps workers that failed together from retrying together
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** min(attempts, 32)))
+        oldest = time.time() - min(entry[4] for entry in batch)
+        log(f"Document insert of {len(batch)} rows failed (attempt {attempts}, oldest queued {oldest:.0f}s ago), "
+            f"retrying in {delay:.1f}s: {error}")
+        with self._lock:
+            self._conn.executemany(
+                'UPDATE document_outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? '
+                'WHERE idempotency_key = ?',
+                [(time.time() + delay, str(error)[:500], key) for key, *_ in batch]
+            )
+            self._failures += 1
+
+    def _reject(self, entry, error):
+        """A row the database refused: retry it a few times, then mark it failed"""
+        key, _, attempts, rejections, _ = entry
+        attempts += 1
+        rejections += 1
+        if rejections < self.max_attempts:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** rejections))
+            log(f"Document insert {key} rejected (attempt {attempts}), retrying in {delay:.1f}s: {error}")
+            with self._lock:
+                self._conn.execute(
+                    'UPDATE document_outbox SET attempts = ?, rejections = ?, next_attempt_at = ?, last_error = ? '
+                    'WHERE idempotency_key = ?',
+                    (attempts, rejections, time.time() + delay, str(error)[:500], key)
+                )
+                self._failures += 1
+            return
+        log(f"Document insert {key} rejected {rejections} times, giving up: {error}")
+        with self._lock:
+            self._conn.execute(
+                'UPDATE document_outbox SET status = ?, attempts = ?, rejections = ?, sent_at = ?, last_error = ? '
+                'WHERE idempotency_key = ?',
+                (OUTBOX_FAILED, attempts, rejections, time.time(), str(error)[:500], key)
+            )
+            self._failures += 1
+            self._dead += 1
@@ -0,0 +1,78 @@
+"""Normalise phone-camera uploads before OCR: EXIF rotation, downsampling and grayscale."""
+import os
+import tempfile
+from contextlib import contextmanager
+
+from instrumentation import log, stage
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+EXIF_ORIENTATION = 0x0112
+
+# Long edge of an A4 page in inches; the target DPI is applied to this
+A4_LONG_EDGE_INCHES = 11.69
+
+
+def max_long_edge(target_dpi):
+    """Pixel budget for the long edge of a page-sized photo scanned at `target_dpi`"""
+    return round(A4_LONG_EDGE_INCHES * target_dpi)
+
+
+def normalize_image(path, target_dpi=200, grayscale=True):
+    """
+    Write an OCR-ready copy of the image at `path` and return its path, or None when
+    `path` is not an image or already needs no changes. The caller deletes the copy.
+    """
+    _, ext = os.path.splitext(path)
+    if ext.lower() not in IMAGE_EXTENSIONS:
+        return None
+
+    from PIL import Image, ImageOps
+
+    limit = max_long_edge(target_dpi)
+    with Image.open(path) as original:
+        image_format = original.format
+        rotated = original.getexif().get(EXIF_ORIENTATION, 1) != 1
+        oversized = max(original.size) > limit
+        needs_grayscale = grayscale and original.mode != 'L'
+        if not (rotated or oversized or needs_grayscale):
+            return None
+
+        if oversized and image_format == 'JPEG':
+            # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 (and drop colour) while decoding
+            original.draft('L' if grayscale else original.mode, (limit, limit))
+
+        # Phone cameras store the sensor orientation in EXIF instead of rotating pixels
+        image = ImageOps.exif_transpose(original)
+        if needs_grayscale and image.mode != 'L':
+            image = image.convert('L')
+        if max(image.size) > limit:
+            image.thumbnail((limit, limit), Image.Resampling.LANCZOS)
+
+        fd, normalized_path = tempfile.mkstemp(suffix=ext.lower())
+        with os.fdopen(fd, 'wb') as out:
+            if image_format == 'PNG':
+                image.save(out, format='PNG', compress_level=1)
+            else:
+                image.save(out, format='JPEG', quality=90)
+    return normalized_path
+
+
+@contextmanager
+def normalized_for_ocr(path, enabled=True, target_dpi=200, grayscale=True):
+    """Yield the path OCR should read: a normalised copy of an image upload, or `path` itself"""
+    normalized_path = None
+    if enabled:
+        try:
+            with stage('image_prep'):
+                normalized_path = normalize_image(path, target_dpi=target_dpi, grayscale=grayscale)
+        except Exception as e:
+            # Unreadable or unusual images go to docling untouched
+            log(f"Image normalisation skipped for {path}: {e}")
+    try:
+        yield normalized_path or path
+    finally:
+        if normalized_path:
+            try:
+                os.unlink(normalized_path)
+            except OSError:
+                pass
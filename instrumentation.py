@@ -0,0 +1,217 @@
+"""Request IDs in log lines, per-stage timing spans, Prometheus metrics and a slow-request profiler."""
+import bisect
+import contextvars
+import cProfile
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+current_request_id = contextvars.ContextVar('request_id', default='-')
+# (stage, seconds) spans recorded while handling the current request; None outside one
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+_REQUEST_ID_RE = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+# Seconds; OCR of a multi-page scan can take a minute
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def log(message):
+    """print() with the current request ID, so lines from one request can be grouped"""
+    print(f"[{current_request_id.get()}] {message}", flush=True)
+
+
+def begin_request(incoming_id=None):
+    """Adopt the caller's request ID when it looks safe to log, otherwise make one; returns it"""
+    request_id = incoming_id if incoming_id and _REQUEST_ID_RE.fullmatch(incoming_id) else uuid.uuid4().hex[:16]
+    current_request_id.set(request_id)
+    _request_spans.set([])
+    return request_id
+
+
+def request_spans():
+    return _request_spans.get() or []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination, rendered in the Prometheus text format"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted(self._series.items())
+        for labelvalues, counts in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                labels = _format_labels(self.labelnames, labelvalues, [('le', le)])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {counts[-1]}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """Value read from `fn()` at scrape time (`fn` returns a number, or {label value: number})"""
+
+    def __init__(self, name, documentation, fn, labelname=None):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.labelname = labelname
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        try:
+            value = self.fn()
+        except Exception:
+            return lines
+        if self.labelname:
+            for labelvalue, number in sorted(value.items()):
+                lines.append(f'{self.name}{_format_labels((self.labelname,), (labelvalue,))} {number}')
+        elif value is not None:
+            lines.append(f'{self.name} {value}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+STAGE_SECONDS = registry.register(Histogram(
+    'bill_scan_stage_seconds', 'Time spent in each stage of a scan.', ('stage',)
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    'bill_scan_request_seconds', 'HTTP request latency.', ('endpoint', 'method', 'status')
+))
+
+
+@contextmanager
+def stage(name):
+    """Time a block into bill_scan_stage_seconds{stage=name} and the request's Server-Timing spans"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, name)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((name, elapsed))
+
+
+@contextmanager
+def collected_spans():
+    """
+    Collect the stage() spans of the block into the yielded list instead of the current
+    request's, e.g. in an OCR worker process, which returns them to the web process
+    """
+    spans = []
+    token = _request_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _request_spans.reset(token)
+
+
+def span_recorder():
+    """
+    Return record(spans), which adds spans timed elsewhere (see collected_spans) to the
+    stage histogram and to the current request's Server-Timing; callable from any thread
+    """
+    spans_of_request = _request_spans.get()
+
+    def record(spans):
+        for name, seconds in spans:
+            STAGE_SECONDS.observe(seconds, name)
+            if spans_of_request is not None:
+                spans_of_request.append((name, seconds))
+    return record
+
+
+def server_timing_header(spans):
+    """Server-Timing value (durations in ms) so browser dev tools show where a request spent its time"""
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in spans)
+
+
+class SlowRequestProfiler:
+    """
+    Profiles each request with cProfile and writes a .prof snapshot (readable with
+    pstats or snakeviz) for those slower than `threshold` seconds. Only one cProfile
+    can run at a time on recent Pythons, so concurrent requests go unprofiled.
+    """
+
+    def __init__(self, threshold, directory):
+        self.threshold = threshold
+        self.directory = directory
+        self._active = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        """Return a running profiler for this request, or None if another request holds it"""
+        if not self._active.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError: # Another profiling tool is active
+            self._active.release()
+            return None
+        return profiler
+
+    def finish(self, profiler, elapsed, label):
+        """Stop `profiler` and dump it when the request was slow; returns the dump path or None"""
+        try:
+            profiler.disable()
+        finally:
+            self._active.release()
+        if elapsed < self.threshold:
+            return None
+        safe_label = re.sub(r'[^A-Za-z0-9_.-]+', '_', label)
+        path = os.path.join(
+            self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{safe_label}-{current_request_id.get()}.prof'
+        )
+        profiler.dump_stats(path)
+        return path
@@ -0,0 +1,141 @@
+"""Pool of OCR worker processes (docling) with a bounded queue and periodic worker recycling."""
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from converter_pool import init_process_converter
+from instrumentation import log
+
+# Thread-count knobs read by torch / OpenMP / MKL when they are first imported
+_THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+class OcrQueueFull(Exception):
+    """Every worker is busy and the queue is full; `retry_after` is a suggested wait in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"OCR workers are busy; retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def init_ocr_worker(threads_per_worker, warm=True):
+    """Worker initializer: cap native thread pools before docling imports torch, then load the models"""
+    if threads_per_worker:
+        for name in _THREAD_ENV_VARS:
+            os.environ[name] = str(threads_per_worker)
+    init_process_converter(warm=warm)
+
+
+def _ping():
+    return os.getpid()
+
+
+class OcrWorkerPool:
+    """
+    Runs conversions in `workers` spawned processes, so CPU-bound docling work never
+    holds the web process's GIL. At most `workers + max_queue` jobs are admitted at
+    once; submit() past that raises OcrQueueFull (or blocks, with wait=True). Each
+    process is replaced after `max_jobs_per_worker` jobs to cap memory growth.
+    """
+
+    def __init__(self, workers, max_queue, max_jobs_per_worker=100, threads_per_worker=1, warm=True):
+        self.workers = max(1, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        self.max_jobs_per_worker = max_jobs_per_worker or None
+        self.threads_per_worker = threads_per_worker
+        self.warm = warm
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._restarts = 0
+        self._latency_ewma = None # Seconds from submit to result, smoothed
+
+    def start(self):
+        """Spawn the worker processes now (they load their models in the background). Idempotent."""
+        with self._lock:
+            if self._executor is not None:
+                return self._executor
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_ocr_worker,
+                initargs=(self.threads_per_worker, self.warm),
+                max_tasks_per_child=self.max_jobs_per_worker
+            )
+            executor = self._executor
+        # Workers are spawned on demand; one quick job per worker brings them all up
+        for _ in range(self.workers):
+            executor.submit(_ping)
+        return executor
+
+    def submit(self, fn, *args, wait=False):
+        """Queue `fn(*args)` on a worker and return its Future; raises OcrQueueFull when the queue is full"""
+        if not self._slots.acquire(blocking=wait):
+            with self._lock:
+                self._rejected += 1
+            raise OcrQueueFull(self.retry_after())
+        submitted = time.monotonic()
+        with self._lock:
+            self._in_flight += 1
+        executor = None
+        try:
+            executor = self.start()
+            future = executor.submit(fn, *args)
+        except BaseException as e:
+            self._finished(submitted, e, executor, failed=True)
+            raise
+        future.add_done_callback(lambda done: self._finished(submitted, done.exception(), executor))
+        return future
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up: about one job's latency, at least 1"""
+        with self._lock:
+            latency = self._latency_ewma or 5.0
+        return max(1, math.ceil(latency))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'queued': max(0, self._in_flight - self.workers),
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'pool_restarts': self._restarts,
+                'max_jobs_per_worker': self.max_jobs_per_worker,
+                'latency_seconds_ewma': round(self._latency_ewma, 3) if self._latency_ewma else None,
+                'started': self._executor is not None,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _finished(self, submitted, error=None, executor=None, failed=False):
+        elapsed = time.monotonic() - submitted
+        with self._lock:
+            self._in_flight -= 1
+            if failed or error is not None:
+                self._failed += 1
+            else:
+                self._completed += 1
+                self._latency_ewma = elapsed if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * elapsed
+            if isinstance(error, BrokenProcessPool) and executor is not None and self._executor is executor:
+                # A worker died (e.g. killed for memory). A broken executor has already stopped its
+                # processes and cannot be reused; the next submit() starts a new one.
+                log(f"OCR worker pool broken, starting a new one: {error}")
+                self._executor = None
+                self._restarts += 1
+        self._slots.release()
@@ -0,0 +1,228 @@
+"""Admission control for the OCR endpoints: token-bucket rate limits and a cap on concurrent scans."""
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from instrumentation import log
+
+
+class RateLimited(Exception):
+    """A client used up its token bucket; `retry_after` is whole seconds until enough tokens refill"""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f"Rate limit exceeded ({scope}); retry in {retry_after}s")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class CostExceedsBurst(Exception):
+    """A request costs more tokens than a bucket holds when full, so waiting would never admit it"""
+
+    def __init__(self, scope, cost, burst):
+        super().__init__(f"Request costs {cost} tokens but the {scope} limit allows at most {burst} at once")
+        self.scope = scope
+        self.cost = cost
+        self.burst = burst
+
+
+class Overloaded(Exception):
+    """Too many scans are already running; `retry_after` is a suggested wait in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Server busy; retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class LocalBuckets:
+    """Token buckets in this process's memory (the least recently used keys are dropped past `max_keys`)"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict() # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, buckets, cost=1):
+        """
+        Take `cost` tokens from every bucket in `buckets` ([(key, rate, burst)]), or from
+        none if any is short. Returns each bucket's wait: all 0 if allowed, else the
+        seconds until that bucket would hold `cost` tokens.
+        """
+        now = time.monotonic()
+        with self._lock:
+            refilled = []
+            for key, rate, burst in buckets:
+                tokens, updated = self._buckets.pop(key, (burst, now))
+                refilled.append(min(burst, tokens + (now - updated) * rate))
+            waits = [max(0.0, (cost - tokens) / rate) for tokens, (_, rate, _) in zip(refilled, buckets)]
+            admitted = not any(waits)
+            for tokens, (key, _, _) in zip(refilled, buckets):
+                self._buckets[key] = (tokens - cost if admitted else tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return waits
+
+
+# KEYS = buckets; ARGV = cost, then rate per second and burst for each key. Charges every
+# bucket or none, atomically. Uses the Redis clock so every web host agrees.
+TOKEN_BUCKET_SCRIPT = """
+local cost = tonumber(ARGV[1])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tokens, waits, admitted = {}, {}, true
+for i, key in ipairs(KEYS) do
+  local rate, burst = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+  local state = redis.call('HMGET', key, 'tokens', 'updated')
+  local updated = tonumber(state[2]) or now
+  tokens[i] = math.min(burst, (tonumber(state[1]) or burst) + math.max(0, now - updated) * rate)
+  waits[i] = tostring(math.max(0, (cost - tokens[i]) / rate))
+  if tokens[i] < cost then
+    admitted = false
+  end
+end
+for i, key in ipairs(KEYS) do
+  local rate, burst = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+  if admitted then
+    tokens[i] = tokens[i] - cost
+  end
+  redis.call('HSET', key, 'tokens', tostring(tokens[i]), 'updated', tostring(now))
+  redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return waits
+"""
+
+
+class RedisBuckets:
+    """
+    Token buckets shared by every web process and host, kept in Redis and updated
+    atomically by TOKEN_BUCKET_SCRIPT. `client` is a redis.Redis (or a stand-in with
+    the same eval()); an idle bucket expires once it would be full again.
+    """
+
+    def __init__(self, client, prefix='bill_scan:rate:'):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, buckets, cost=1):
+        keys = [self.prefix + key for key, _, _ in buckets]
+        args = [value for _, rate, burst in buckets for value in (rate, burst)]
+        return [float(wait) for wait in self.client.eval(TOKEN_BUCKET_SCRIPT, len(keys), *keys, cost, *args)]
+
+
+class RateLimiter:
+    """
+    Checks requests against per-key token buckets. Buckets live in `shared` (e.g.
+    RedisBuckets) when given, so limits hold across processes; if the shared backend
+    fails, this process's own buckets are used for `cooldown` seconds before one
+    request tries it again (fail open, not closed: an outage of the limiter must not
+    stop scans, nor make every request wait for its timeouts).
+    """
+
+    def __init__(self, shared=None, cooldown=30.0):
+        self.shared = shared
+        self.cooldown = cooldown
+        self.local = LocalBuckets()
+        self._lock = threading.Lock()
+        self._allowed = 0
+        self._limited = {}
+        self._backend_errors = 0
+        self._backend_down = False
+        self._backend_retry_at = 0.0 # While down: when the next request may try the shared backend
+
+    def check(self, limits, cost=1):
+        """
+        `limits` is [(scope, key, rate_per_second, burst)]; every bucket is charged `cost`,
+        or none is: raises RateLimited with the longest wait if any is short, and
+        CostExceedsBurst if `cost` is more than a bucket can ever hold.
+        """
+        for scope, _, _, burst in limits:
+            if cost > burst:
+                raise CostExceedsBurst(scope, cost, burst)
+        waits = self._take([(f'{scope}:{key}', rate, burst) for scope, key, rate, burst in limits], cost)
+        longest_wait, limited_scope = 0.0, None
+        for (scope, _, _, _), wait in zip(limits, waits):
+            if wait > longest_wait:
+                longest_wait, limited_scope = wait, scope
+        with self._lock:
+            if limited_scope is None:
+                self._allowed += 1
+                return
+            self._limited[limited_scope] = self._limited.get(limited_scope, 0) + 1
+        raise RateLimited(limited_scope, max(1, math.ceil(longest_wait)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'allowed': self._allowed,
+                'limited': dict(self._limited),
+                'shared_backend': type(self.shared).__name__ if self.shared else None,
+                'shared_backend_errors': self._backend_errors,
+                'shared_backend_down': self._backend_down,
+            }
+
+    def _take(self, buckets, cost):
+        if self.shared is not None and self._try_shared():
+            try:
+                waits = self.shared.take(buckets, cost)
+            except Exception as e:
+                with self._lock:
+                    self._backend_errors += 1
+                    first_failure, self._backend_down = not self._backend_down, True
+                    self._backend_retry_at = time.monotonic() + self.cooldown
+                if first_failure:
+                    log(f"Shared rate-limit backend failed, limiting per process: {e}")
+            else:
+                with self._lock:
+                    recovered, self._backend_down = self._backend_down, False
+                if recovered:
+                    log("Shared rate-limit backend is answering again")
+                return waits
+        return self.local.take(buckets, cost)
+
+    def _try_shared(self):
+        """Whether to call the shared backend: always while it is up, once per cooldown while it is down"""
+        with self._lock:
+            if not self._backend_down:
+                return True
+            now = time.monotonic()
+            if now < self._backend_retry_at:
+                return False
+            # This request probes; the others keep using local buckets until it answers
+            self._backend_retry_at = now + self.cooldown
+            return True
+
+
+class AdmissionGate:
+    """
+    Caps how many expensive requests run at once. Past `limit`, admit() raises
+    Overloaded straight away instead of queueing, so a burst is turned away quickly
+    while admitted requests keep their normal latency.
+    """
+
+    def __init__(self, limit, retry_after=lambda: 1):
+        self.limit = limit
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+
+    @contextmanager
+    def admit(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise Overloaded(self.retry_after())
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {'limit': self.limit, 'in_flight': self._in_flight, 'rejected': self._rejected}
@@ -0,0 +1,170 @@
+"""SQLite-backed cache of OCR results keyed on the SHA-256 of the uploaded file."""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of the file at `path`, read in chunks; used as the cache key for an upload"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ScanResultCache:
+    """
+    Stores the exported markdown and extract_bill_info result per file digest, plus
+    the Storage object each user already uploaded for that digest and the HTTP
+    validators of URLs that downloaded to it, with LRU eviction once either
+    `max_entries` or `max_bytes` is exceeded. Results are stored with `pipeline_version`
+    (the OCR and extraction configuration that produced them) and only returned for the
+    same version, so a deploy that changes either does not serve stale results.
+    """
+
+    def __init__(self, path, max_entries=5000, max_bytes=256 * 1024 * 1024, pipeline_version=''):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.pipeline_version = pipeline_version
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS scan_result (
+                    digest TEXT PRIMARY KEY,
+                    markdown TEXT NOT NULL,
+                    bill_info TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            columns = {row[1] for row in self._conn.execute('PRAGMA table_info(scan_result)')}
+            if 'pipeline_version' not in columns:
+                # Caches from before versioning: their rows (NULL version) are never returned
+                self._conn.execute('ALTER TABLE scan_result ADD COLUMN pipeline_version TEXT')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS scan_result_last_used ON scan_result (last_used)')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS scan_object (
+                    digest TEXT NOT NULL,
+                    owner_id TEXT NOT NULL,
+                    storage_path TEXT NOT NULL,
+                    PRIMARY KEY (digest, owner_id)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS url_source (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    digest TEXT NOT NULL
+                )
+            """)
+
+    def get(self, digest):
+        """Return {'markdown', 'bill_info'} for a file converted before by this pipeline version, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT markdown, bill_info FROM scan_result WHERE digest = ? AND pipeline_version = ?',
+                (digest, self.pipeline_version)
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            with self._conn:
+                self._conn.execute('UPDATE scan_result SET last_used = ? WHERE digest = ?', (time.time(), digest))
+        return {'markdown': row[0], 'bill_info': json.loads(row[1])}
+
+    def put(self, digest, markdown, bill_info):
+        bill_info_json = json.dumps(bill_info)
+        size = len(markdown.encode('utf-8')) + len(bill_info_json)
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO scan_result '
+                    '(digest, markdown, bill_info, size, created_at, last_used, pipeline_version) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (digest, markdown, bill_info_json, size, now, now, self.pipeline_version)
+                )
+                self._evict()
+
+    def get_storage_path(self, digest, owner_id):
+        """Storage object this user already uploaded for the same file, if any"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT storage_path FROM scan_object WHERE digest = ? AND owner_id = ?', (digest, str(owner_id))
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_storage_path(self, digest, owner_id, storage_path):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO scan_object (digest, owner_id, storage_path) VALUES (?, ?, ?)',
+                    (digest, str(owner_id), storage_path)
+                )
+
+    def get_url_validators(self, url):
+        """{'etag', 'last_modified', 'digest'} of the last download of `url`, while its result is still cached"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT u.etag, u.last_modified, u.digest FROM url_source u '
+                'JOIN scan_result r ON r.digest = u.digest WHERE u.url = ? AND r.pipeline_version = ?',
+                (url, self.pipeline_version)
+            ).fetchone()
+        return {'etag': row[0], 'last_modified': row[1], 'digest': row[2]} if row else None
+
+    def set_url_validators(self, url, etag, last_modified, digest):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO url_source (url, etag, last_modified, digest) VALUES (?, ?, ?, ?)',
+                    (url, etag, last_modified, digest)
+                )
+
+    def stats(self):
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM scan_result'
+            ).fetchone()
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 4) if lookups else 0.0,
+                'evictions': self._evictions,
+                'entries': entries,
+                'bytes': total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'pipeline_version': self.pipeline_version,
+            }
+
+    def _evict(self):
+        """Drop least-recently-used results until both limits hold. Caller holds the lock and transaction."""
+        entries, total_bytes = self._conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM scan_result'
+        ).fetchone()
+        if entries <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+        evicted = []
+        for digest, size in self._conn.execute('SELECT digest, size FROM scan_result ORDER BY last_used'):
+            if entries <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            evicted.append((digest,))
+            entries -= 1
+            total_bytes -= size
+        self._conn.executemany('DELETE FROM scan_result WHERE digest = ?', evicted)
+        self._conn.executemany('DELETE FROM scan_object WHERE digest = ?', evicted)
+        self._conn.executemany('DELETE FROM url_source WHERE digest = ?', evicted)
+        self._evictions += len(evicted)
@@ -0,0 +1,197 @@
+"""Background job queue for long-running scans, with job state shared through SQLite."""
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import log
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+TERMINAL_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+JOB_FIELDS = ('job_id', 'owner_id', 'status', 'stage', 'progress', 'result', 'error', 'created_at', 'updated_at',
+              'version')
+
+
+class ScanJobQueue:
+    """
+    Runs scan pipelines on a local thread pool and keeps their status in a SQLite
+    database, so clients can poll (or stream) progress by job id from any worker
+    process sharing `path`. Each queue heartbeats while it is alive; the jobs of a
+    queue whose heartbeat stops (its process died or restarted) are marked failed
+    and their temp files removed. path=':memory:' keeps jobs to this process.
+    """
+
+    def __init__(self, path=':memory:', max_workers=2, result_ttl=3600, heartbeat=10.0, poll_interval=0.5):
+        self.path = path
+        self.result_ttl = result_ttl
+        self.heartbeat = heartbeat
+        self.poll_interval = poll_interval # How often a stream re-reads a job run by another process
+        self.runner_id = uuid.uuid4().hex
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix='scan-job')
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._local_changes = 0 # Bumped on every update made here, so waiters need not poll for local jobs
+        self._thread = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS scan_job (
+                job_id TEXT PRIMARY KEY,
+                owner_id TEXT,
+                status TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                progress INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                runner_id TEXT NOT NULL,
+                temp_path TEXT
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS scan_job_status ON scan_job (status, updated_at)')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS scan_job_runner (
+                runner_id TEXT PRIMARY KEY,
+                pid INTEGER NOT NULL,
+                heartbeat_at REAL NOT NULL
+            )
+        """)
+        self._beat()
+
+    def start(self):
+        """Start the heartbeat thread, which also fails jobs orphaned by dead processes"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run_heartbeat, name='scan-job-heartbeat', daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, fn, *args, owner_id=None, temp_path=None, **kwargs):
+        """
+        Queue `fn(*args, report_progress=..., **kwargs)` and return the new job id.
+        `fn` returns the job result (JSON-serializable); any exception marks the job
+        failed. `temp_path` is a file the job deletes itself, removed here instead if
+        the job is abandoned by a restart.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO scan_job (job_id, owner_id, status, stage, created_at, updated_at, runner_id, temp_path) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, owner_id, JOB_QUEUED, 'queued', now, now, self.runner_id, temp_path)
+            )
+        # Run in a copy of the submitter's context so the job logs under its request ID
+        self._executor.submit(contextvars.copy_context().run, self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def get(self, job_id):
+        """Return a snapshot of the job, or None if it is unknown or expired"""
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT {", ".join(JOB_FIELDS)} FROM scan_job WHERE job_id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def wait_for_change(self, job_id, last_version, timeout=15):
+        """Block until the job's version moves past `last_version` (or timeout), then return a snapshot"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._changed:
+                seen = self._local_changes
+            job = self.get(job_id)
+            if job is None or job['version'] > last_version or job['status'] in TERMINAL_STATES:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._changed:
+                if self._local_changes == seen:
+                    self._changed.wait(min(remaining, self.poll_interval))
+
+    def _update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'], default=str)
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f'UPDATE scan_job SET {assignments}, updated_at = ?, version = version + 1 WHERE job_id = ?',
+                (*fields.values(), time.time(), job_id)
+            )
+        with self._changed:
+            self._local_changes += 1
+            self._changed.notify_all()
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status=JOB_RUNNING, stage='starting')
+
+        def report_progress(stage, percent):
+            self._update(job_id, stage=stage, progress=percent)
+
+        try:
+            result = fn(*args, report_progress=report_progress, **kwargs)
+            self._update(job_id, status=JOB_SUCCEEDED, stage='done', progress=100, result=result)
+        except Exception as e:
+            log(f"Scan job {job_id} failed: {e}")
+            self._update(job_id, status=JOB_FAILED, stage='failed', error=str(e))
+
+    def _run_heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat)
+            try:
+                self._beat()
+            except Exception as e:
+                log(f"Scan job heartbeat error: {e}")
+
+    def _beat(self):
+        """Record that this queue is alive, fail other queues' orphaned jobs, and drop expired ones"""
+        now = time.time()
+        stale = now - 3 * self.heartbeat
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO scan_job_runner (runner_id, pid, heartbeat_at) VALUES (?, ?, ?)',
+                    (self.runner_id, os.getpid(), now)
+                )
+                self._conn.execute('DELETE FROM scan_job_runner WHERE heartbeat_at < ?', (stale,))
+                orphaned = self._conn.execute(
+                    'SELECT job_id, temp_path FROM scan_job WHERE status IN (?, ?) '
+                    'AND runner_id NOT IN (SELECT runner_id FROM scan_job_runner)',
+                    (JOB_QUEUED, JOB_RUNNING)
+                ).fetchall()
+                self._conn.executemany(
+                    'UPDATE scan_job SET status = ?, stage = ?, error = ?, updated_at = ?, version = version + 1 '
+                    'WHERE job_id = ?',
+                    [(JOB_FAILED, 'failed', 'The server restarted before the scan finished; please scan again',
+                      now, job_id) for job_id, _ in orphaned]
+                )
+                self._conn.execute(
+                    'DELETE FROM scan_job WHERE status IN (?, ?) AND updated_at < ?',
+                    (*TERMINAL_STATES, now - self.result_ttl)
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        for job_id, temp_path in orphaned:
+            log(f"Scan job {job_id} was abandoned by a stopped worker; marked failed")
+            if temp_path:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
@@ -1,60 +1,31 @@
 // static/sw.js
-const CACHE_NAME = 'electric-bill-scanner-v1';
+// Bump CACHE_VERSION whenever a precached file changes; activate drops the old caches
+const CACHE_VERSION = 'v2';
+const CACHE_PREFIX = 'electric-bill-scanner-';
+const CACHE_NAME = CACHE_PREFIX + CACHE_VERSION;
 const urlsToCache = [
   '/',
   '/static/css/style.css',
-  '/static/js/main.js',
   '/static/icons/icon_192x192.png',
   '/static/icons/icon_512x512.png',
-  '/static/manifest.json'
+  '/manifest.json'
 ];
+// The page is rendered per session, so it comes from the network when that answers quickly
+const NAVIGATION_TIMEOUT_MS = 3000;
+
+// Offline capture queue: bills that could not be sent are kept in IndexedDB and replayed
+const OUTBOX_DB = 'bill-scanner-outbox';
+const OUTBOX_STORE = 'captures';
+const SYNC_TAG = 'scan-outbox';
+const RETRY_BASE_MS = 5000;
+const RETRY_MAX_MS = 30 * 60 * 1000;
+const MAX_ATTEMPTS = 8; // Server errors only; offline and busy responses retry until they succeed
 
 self.addEventListener('install', (event) => {
   event.waitUntil(
     caches.open(CACHE_NAME)
-      .then((cache) => {
-        console.log('Opened cache');
-        return cache.addAll(urlsToCache);
-      })
-  );
-});
-
-self.addEventListener('fetch', (event) => {
-  // Skip caching for API calls and camera-related requests
-  if (event.request.url.includes('/scan') || 
-      event.request.url.includes('/process_url') ||
-      event.request.url.includes('/test_sample')) {
-    return fetch(event.request);
-  }
-
-  event.respondWith(
-    caches.match(event.request)
-      .then((response) => {
-        // Return cached version or fetch from network
-        if (response) {
-          return response;
-        }
-        return fetch(event.request).then((response) => {
-          // Check if we received a valid response
-          if (!response || response.status !== 200 || response.type !== 'basic') {
-            return response;
-          }
-
-          // Clone the response
-          const responseToCache = response.clone();
-
-          caches.open(CACHE_NAME)
-            .then((cache) => {
-              cache.put(event.request, responseToCache);
-            });
-
-          return response;
-        });
-      })
-      .catch(() => {
-        // If both cache and network fail, show offline page
-        return caches.match('/');
-      })
+      .then((cache) => cache.addAll(urlsToCache))
+      .then(() => self.skipWaiting())
   );
 });
 
@@ -63,12 +34,231 @@ self.addEventListener('activate', (event) => {
     caches.keys().then((cacheNames) => {
       return Promise.all(
         cacheNames.map((cacheName) => {
-          if (cacheName !== CACHE_NAME) {
+          if (cacheName.startsWith(CACHE_PREFIX) && cacheName !== CACHE_NAME) {
             console.log('Deleting old cache:', cacheName);
             return caches.delete(cacheName);
           }
         })
       );
-    })
+    }).then(() => self.clients.claim())
   );
-});
\ No newline at end of file
+});
+
+self.addEventListener('fetch', (event) => {
+  const url = new URL(event.request.url);
+  // API calls, uploads and other origins go straight to the network
+  if (event.request.method !== 'GET' || url.origin !== self.location.origin) {
+    return;
+  }
+
+  if (event.request.mode === 'navigate' && url.pathname === '/') {
+    event.respondWith(networkFirst(event.request));
+  } else if (url.pathname.startsWith('/static/') || url.pathname === '/manifest.json') {
+    event.respondWith(staleWhileRevalidate(event, url.pathname));
+  }
+});
+
+function networkFirst(request) {
+  const network = fetch(request).then((response) => {
+    if (response.ok) {
+      const responseToCache = response.clone();
+      caches.open(CACHE_NAME).then((cache) => cache.put('/', responseToCache));
+    }
+    return response;
+  });
+  const timeout = new Promise((resolve) => setTimeout(resolve, NAVIGATION_TIMEOUT_MS));
+  // A slow network falls back to the cached shell; a failed one waits for nothing
+  return Promise.race([network.catch(() => null), timeout])
+    .then((response) => response || caches.match('/'))
+    .then((response) => response || network);
+}
+
+function staleWhileRevalidate(event, path) {
+  return caches.open(CACHE_NAME).then((cache) => {
+    return cache.match(path).then((cached) => {
+      const network = fetch(event.request).then((response) => {
+        if (response && response.status === 200 && response.type === 'basic') {
+          cache.put(path, response.clone());
+        }
+        return response;
+      });
+      if (cached) {
+        event.waitUntil(network.catch(() => undefined));
+        return cached;
+      }
+      return network;
+    });
+  });
+}
+
+// --- OFFLINE CAPTURE QUEUE ---
+// The page posts {type: 'queue-capture', file, filename, fields, idempotencyKey} when a scan
+// cannot be sent (offline, or the server answered 429/503). Each capture is replayed to /scan
+// with its Idempotency-Key, so a replay whose first response was lost adds no second document.
+
+function openOutbox() {
+  return new Promise((resolve, reject) => {
+    const request = indexedDB.open(OUTBOX_DB, 1);
+    request.onupgradeneeded = () => request.result.createObjectStore(OUTBOX_STORE, { keyPath: 'id' });
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+function outbox(mode, operation) {
+  return openOutbox().then((db) => new Promise((resolve, reject) => {
+    const transaction = db.transaction(OUTBOX_STORE, mode);
+    const request = operation(transaction.objectStore(OUTBOX_STORE));
+    transaction.oncomplete = () => {
+      db.close();
+      resolve(request.result);
+    };
+    transaction.onerror = transaction.onabort = () => {
+      db.close();
+      reject(transaction.error);
+    };
+  }));
+}
+
+function notifyClients(message) {
+  return self.clients.matchAll({ includeUncontrolled: true }).then((clients) => {
+    clients.forEach((client) => client.postMessage(message));
+  });
+}
+
+function notifyOutboxStatus() {
+  return outbox('readonly', (store) => store.getAll()).then((captures) => {
+    const nextAttemptAt = captures.length ? Math.min(...captures.map((capture) => capture.nextAttemptAt)) : null;
+    return notifyClients({ type: 'outbox-status', pending: captures.length, nextAttemptAt });
+  });
+}
+
+function requestReplay() {
+  // Background Sync runs the replay once the device is online, even if the page was closed
+  if (self.registration.sync) {
+    return self.registration.sync.register(SYNC_TAG).catch(() => undefined);
+  }
+  return Promise.resolve();
+}
+
+function queueCapture(message) {
+  const capture = {
+    id: message.idempotencyKey,
+    file: message.file,
+    filename: message.filename,
+    fields: message.fields || {},
+    attempts: 0,
+    nextAttemptAt: Date.now(),
+    createdAt: Date.now()
+  };
+  return outbox('readwrite', (store) => store.put(capture))
+    .then(requestReplay)
+    .then(notifyOutboxStatus);
+}
+
+function retryDelay(attempts, retryAfterSeconds) {
+  // Full jitter, so queued devices do not all come back at once after an outage
+  const backoff = Math.random() * Math.min(RETRY_MAX_MS, RETRY_BASE_MS * 2 ** attempts);
+  return Math.max(backoff, (retryAfterSeconds || 0) * 1000);
+}
+
+async function sendCapture(capture) {
+  const formData = new FormData();
+  formData.append('file', capture.file, capture.filename);
+  Object.entries(capture.fields).forEach(([name, value]) => formData.append(name, value));
+
+  let response;
+  try {
+    response = await fetch('/scan', {
+      method: 'POST',
+      body: formData,
+      headers: { 'Idempotency-Key': capture.id },
+      credentials: 'same-origin'
+    });
+  } catch (networkError) {
+    return { outcome: 'retry' };
+  }
+  if (response.ok) {
+    return { outcome: 'sent', result: await response.json() };
+  }
+  if (response.status === 401) {
+    return { outcome: 'login' };
+  }
+  if (response.status === 429 || response.status === 503) {
+    return { outcome: 'retry', retryAfter: parseInt(response.headers.get('Retry-After'), 10) };
+  }
+  const body = await response.json().catch(() => ({}));
+  if (response.status >= 500) {
+    return { outcome: 'error', error: body.error };
+  }
+  return { outcome: 'failed', error: body.error || `Upload failed (${response.status})` };
+}
+
+let replaying = null;
+
+function replayOutbox() {
+  // One replay at a time: a sync event and a page message can arrive together
+  if (!replaying) {
+    replaying = runReplay().finally(() => {
+      replaying = null;
+    });
+  }
+  return replaying;
+}
+
+async function runReplay() {
+  const captures = await outbox('readonly', (store) => store.getAll());
+  let pending = 0;
+  for (const capture of captures.sort((a, b) => a.createdAt - b.createdAt)) {
+    if (capture.nextAttemptAt > Date.now()) {
+      pending++;
+      continue;
+    }
+    const sent = await sendCapture(capture);
+    const exhausted = sent.outcome === 'error' && capture.attempts + 1 >= MAX_ATTEMPTS;
+    if (sent.outcome === 'sent' || sent.outcome === 'failed' || exhausted) {
+      await outbox('readwrite', (store) => store.delete(capture.id));
+      await notifyClients({
+        type: sent.outcome === 'sent' ? 'capture-synced' : 'capture-failed',
+        filename: capture.filename,
+        result: sent.result,
+        error: sent.error || 'The server kept failing to process this bill.'
+      });
+      continue;
+    }
+    if (sent.outcome === 'login') {
+      // Nothing succeeds until the user logs in again; the page asks for a replay after that
+      await notifyClients({ type: 'capture-needs-login' });
+      await notifyOutboxStatus();
+      return 0;
+    }
+    capture.attempts++;
+    capture.nextAttemptAt = Date.now() + retryDelay(capture.attempts, sent.retryAfter);
+    await outbox('readwrite', (store) => store.put(capture));
+    pending++;
+  }
+  await notifyOutboxStatus();
+  return pending;
+}
+
+self.addEventListener('sync', (event) => {
+  if (event.tag !== SYNC_TAG) {
+    return;
+  }
+  // Rejecting asks the browser to fire the sync again later with its own backoff
+  event.waitUntil(replayOutbox().then((pending) => {
+    if (pending) {
+      throw new Error(`${pending} capture(s) still queued`);
+    }
+  }));
+});
+
+self.addEventListener('message', (event) => {
+  const message = event.data || {};
+  if (message.type === 'queue-capture') {
+    event.waitUntil(queueCapture(message));
+  } else if (message.type === 'replay-outbox') {
+    // Browsers without Background Sync: the page asks on load, when back online and when a retry is due
+    event.waitUntil(replayOutbox());
+  }
+});
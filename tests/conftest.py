@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app's modules live at the repository root (no package), as bench/ assumes too
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,104 @@
+import pytest
+
+from bill_parsers import (BillParser, ParserRegistry, SignatureMatcher, empty_bill_info, extract_bill_info,
+                          is_hk_electric_bill)
+
+BILL = (
+    "HK Electric\n"
+    "The Hongkong Electric Co., Ltd.\n"
+    "CHAN TAI MAN\n"
+    "Flat 12A, 8/F, Block 3\n"
+    "Residential Tariff\n"
+    "88 Hing Fat Street\n"
+    "North Point, Hong Kong\n"
+    "Account Number 1234567890\n"
+    "Date of Bill 05/09/2025\n"
+    "| 01/08/2025 | Units 7 kWh | Amount Due $0.00 |\n"
+    "Total Amount Due $1,234.50\n"
+    "Please Pay This Amount $1,234.50\n"
+)
+
+
+def test_extracts_hk_electric_fields():
+    info = extract_bill_info(BILL)
+    assert info == {
+        'recipient_name': 'CHAN TAI MAN',
+        'recipient_address': 'Flat 12A, 8/F, Block 3',
+        'account_number': '1234567890',
+        'date_of_bill': '05/09/2025',
+        'amount_due': '1234.50',
+        'is_electric_bill': True,
+        'provider': 'hk_electric',
+    }
+
+
+def test_amount_prefers_highest_priority_label():
+    text = BILL.replace("Please Pay This Amount $1,234.50\n", "")
+    assert extract_bill_info(text)['amount_due'] == '1234.50' # Total Amount Due beats the table's Amount Due
+
+    text = text.replace("Total Amount Due $1,234.50\n", "Amount Due $99\n")
+    assert extract_bill_info(text)['amount_due'] == '99'
+
+
+def test_missing_fields_stay_empty():
+    info = extract_bill_info("HK Electric\nThe Hongkong Electric Co., Ltd.\nno recipient here\n")
+    assert info['provider'] == 'hk_electric'
+    assert info['account_number'] == info['amount_due'] == info['recipient_name'] == ''
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    'Some other utility statement\n' * 100,
+    'The Hongkong Electric Co., Ltd. without the brand',
+    'HK Electric without the company name',
+])
+def test_other_documents_get_empty_info(text):
+    assert not is_hk_electric_bill(text)
+    assert extract_bill_info(text) == empty_bill_info()
+
+
+def test_pathological_address_block_is_linear():
+    text = "HK Electric\nThe Hongkong Electric Co., Ltd.\n" + "ABC DEF\n" * 20000 + "trailing"
+    info = extract_bill_info(text)
+    assert info['recipient_name'] == 'ABC DEF'
+
+
+def test_registry_picks_first_parser_with_all_signatures():
+    registry = ParserRegistry()
+    registry.register(BillParser('water', ('Water Supplies Department', 'Water Charge'), lambda text, info: info))
+    registry.register(BillParser('gas', ('Towngas',), lambda text, info: dict(info, account_number='gas')))
+
+    assert registry.detect('Towngas statement').provider == 'gas'
+    assert registry.detect('Water Supplies Department only') is None
+    assert registry.detect('Water Supplies Department / Water Charge / Towngas').provider == 'water'
+    assert registry.extract('Towngas')['account_number'] == 'gas'
+
+
+def test_parser_checks_longest_signature_first():
+    parser = BillParser('p', ('short', 'a much longer token'), lambda text, info: info)
+    assert parser.check_order == ('a much longer token', 'short')
+
+
+def test_substring_lookup_searches_only_what_is_asked():
+    searched = []
+
+    class Text(str):
+        def __contains__(self, token):
+            searched.append(token)
+            return str.__contains__(self, token)
+
+    registry = ParserRegistry()
+    registry.register(BillParser('p', ('Towngas', 'The Hong Kong and China Gas Co.'), lambda text, info: info))
+    assert registry.detect(Text('nothing to see')) is None
+    # Stopped at the first (longest) missing signature
+    assert searched == ['The Hong Kong and China Gas Co.']
+
+
+def test_signature_matcher_agrees_with_substring_search():
+    # Enough tokens for the Aho-Corasick automaton when pyahocorasick is installed
+    tokens = [f'<token {n}>' for n in range(SignatureMatcher.AUTOMATON_MIN_TOKENS + 4)]
+    matcher = SignatureMatcher(tokens)
+    text = 'prefix <token 3> middle <token 17> suffix'
+
+    present = matcher.lookup(text)
+    assert {token for token in tokens if present(token)} == {token for token in tokens if token in text}
@@ -0,0 +1,139 @@
+import io
+import os
+import time
+
+import pytest
+
+from chunked_uploads import ChunkedUploadStore, UploadError
+
+CHUNK = 1024
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkedUploadStore(str(tmp_path / 'uploads'), max_bytes=10 * CHUNK, chunk_bytes=CHUNK)
+
+
+class DisconnectingStream(io.BytesIO):
+    """A request body whose client goes away after `after` bytes"""
+
+    def __init__(self, data, after):
+        super().__init__(data)
+        self.after = after
+
+    def read(self, size=-1):
+        if self.tell() >= self.after:
+            raise ConnectionError('client disconnected')
+        return super().read(min(size, self.after - self.tell()))
+
+
+def upload(store, owner_id='u', size=3 * CHUNK):
+    return store.create(owner_id, 'bill.pdf', size)['upload_id']
+
+
+def test_chunks_append_in_order_until_complete(store):
+    data = os.urandom(2 * CHUNK + 100)
+    upload_id = upload(store, size=len(data))
+
+    offset = 0
+    for start in range(0, len(data), CHUNK):
+        chunk = data[start:start + CHUNK]
+        offset = store.append(upload_id, 'u', offset, io.BytesIO(chunk), len(chunk))
+    assert offset == len(data)
+
+    meta, path = store.claim(upload_id, 'u')
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert meta['filename'] == 'bill.pdf'
+
+
+def test_out_of_order_chunk_reports_current_offset(store):
+    upload_id = upload(store)
+    store.append(upload_id, 'u', 0, io.BytesIO(b'x' * CHUNK), CHUNK)
+
+    with pytest.raises(UploadError) as excinfo:
+        store.append(upload_id, 'u', 0, io.BytesIO(b'x' * CHUNK), CHUNK) # a retried chunk
+    assert (excinfo.value.status, excinfo.value.offset) == (409, CHUNK)
+
+
+@pytest.mark.parametrize('length, status', [(0, 400), (CHUNK + 1, 400), (None, 400)])
+def test_chunk_length_is_checked(store, length, status):
+    with pytest.raises(UploadError) as excinfo:
+        store.append(upload(store), 'u', 0, io.BytesIO(b''), length)
+    assert excinfo.value.status == status
+
+
+def test_chunk_past_declared_size_is_refused(store):
+    upload_id = upload(store, size=100)
+    with pytest.raises(UploadError) as excinfo:
+        store.append(upload_id, 'u', 0, io.BytesIO(b'x' * 200), 200)
+    assert excinfo.value.status == 400
+
+
+def test_short_body_is_discarded(store):
+    upload_id = upload(store)
+    with pytest.raises(UploadError) as excinfo:
+        store.append(upload_id, 'u', 0, io.BytesIO(b'x' * 100), CHUNK)
+    assert excinfo.value.offset == 0
+    assert store.get(upload_id, 'u')['offset'] == 0
+
+
+def test_disconnect_mid_chunk_is_discarded(store):
+    upload_id = upload(store)
+    store.append(upload_id, 'u', 0, io.BytesIO(b'a' * CHUNK), CHUNK)
+
+    with pytest.raises(ConnectionError):
+        store.append(upload_id, 'u', CHUNK, DisconnectingStream(b'b' * CHUNK, after=300), CHUNK)
+    assert store.get(upload_id, 'u')['offset'] == CHUNK
+    # The retry lines up at the recorded offset
+    assert store.append(upload_id, 'u', CHUNK, io.BytesIO(b'b' * CHUNK), CHUNK) == 2 * CHUNK
+
+
+def test_uploads_are_private_to_their_owner(store):
+    upload_id = upload(store, owner_id='u')
+    assert store.get(upload_id, 'someone-else') is None
+    assert store.get('../etc/passwd', 'u') is None
+    with pytest.raises(UploadError) as excinfo:
+        store.append(upload_id, 'someone-else', 0, io.BytesIO(b'x'), 1)
+    assert excinfo.value.status == 404
+
+
+def test_size_limit(store):
+    with pytest.raises(UploadError) as excinfo:
+        store.create('u', 'big.pdf', 11 * CHUNK)
+    assert excinfo.value.status == 413
+
+
+def test_incomplete_upload_cannot_be_claimed(store):
+    upload_id = upload(store)
+    with pytest.raises(UploadError) as excinfo:
+        store.claim(upload_id, 'u')
+    assert (excinfo.value.status, excinfo.value.offset) == (409, 0)
+
+
+def test_released_upload_can_be_claimed_again(store):
+    upload_id = upload(store, size=10)
+    store.append(upload_id, 'u', 0, io.BytesIO(b'x' * 10), 10)
+    _, path = store.claim(upload_id, 'u')
+    with pytest.raises(UploadError):
+        store.claim(upload_id, 'u') # Already being scanned
+
+    store.release(upload_id, path)
+    _, path = store.claim(upload_id, 'u')
+    store.forget(upload_id)
+    os.unlink(path)
+    assert store.get(upload_id, 'u') is None
+
+
+def test_expired_uploads_are_removed_but_claimed_ones_kept(tmp_path):
+    store = ChunkedUploadStore(str(tmp_path), max_bytes=10 * CHUNK, chunk_bytes=CHUNK, ttl=0.05)
+    stale = upload(store, size=10)
+    claimed = upload(store, size=10)
+    store.append(claimed, 'u', 0, io.BytesIO(b'x' * 10), 10)
+    _, claimed_path = store.claim(claimed, 'u')
+    time.sleep(0.1)
+
+    upload(store) # create() sweeps expired uploads
+    assert store.get(stale, 'u') is None
+    assert not os.path.exists(os.path.join(str(tmp_path), f'{stale}.part'))
+    assert os.path.exists(claimed_path)
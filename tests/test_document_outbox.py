@@ -0,0 +1,165 @@
+import sqlite3
+
+import pytest
+
+from document_outbox import OUTBOX_FAILED, OUTBOX_PENDING, OUTBOX_SENT, DocumentOutbox, is_transient
+
+
+class ApiError(Exception):
+    """Shaped like postgrest.APIError: a `code` that is a SQLSTATE, a PGRST code or an HTTP status"""
+
+    def __init__(self, code):
+        super().__init__(f'error {code}')
+        self.code = code
+
+
+class FakeDatabase:
+    """send() for the outbox: stores rows by idempotency_key, fails while `down`, rejects rows marked bad"""
+
+    def __init__(self):
+        self.down = False
+        self.rows = {}
+        self.calls = []
+
+    def send(self, rows):
+        self.calls.append(len(rows))
+        if self.down:
+            raise ConnectionError('database unreachable')
+        if any(row.get('bad') for row in rows):
+            raise ApiError('23502') # not_null_violation
+        stored = {}
+        for row in rows:
+            if row['idempotency_key'] not in self.rows:
+                self.rows[row['idempotency_key']] = row
+                stored[row['idempotency_key']] = len(self.rows)
+        return stored
+
+
+@pytest.fixture
+def database():
+    return FakeDatabase()
+
+
+@pytest.fixture
+def outbox(tmp_path, database):
+    return DocumentOutbox(str(tmp_path / 'outbox.sqlite3'), database.send, base_delay=0, max_attempts=3)
+
+
+@pytest.mark.parametrize('error, transient', [
+    (ConnectionError('reset'), True),
+    (TimeoutError(), True),
+    (ApiError(502), True),
+    (ApiError(429), True),
+    (ApiError(400), False),
+    (ApiError('PGRST000'), True),
+    (ApiError('PGRST301'), True),
+    (ApiError('PGRST204'), False),
+    (ApiError('57014'), True), # statement timeout
+    (ApiError('40001'), True), # serialization failure
+    (ApiError('23505'), False), # unique violation
+    (ApiError('22P02'), False), # invalid text representation
+    (ApiError('42501'), False), # insufficient privilege
+])
+def test_is_transient(error, transient):
+    assert is_transient(error) is transient
+
+
+def test_enqueue_then_flush_delivers_every_row(outbox, database):
+    keys = outbox.enqueue([{'user_id': 'u', 'n': n} for n in range(3)])
+
+    assert [outbox.status(key)['status'] for key in keys] == [OUTBOX_PENDING] * 3
+    assert outbox.flush() == 3
+    assert database.calls == [3]
+    assert [outbox.status(key)['status'] for key in keys] == [OUTBOX_SENT] * 3
+    assert outbox.status(keys[0])['document_id'] == 1
+    assert outbox.stats()['pending'] == 0
+
+
+def test_enqueue_keeps_client_keys_and_ignores_repeats(outbox, database):
+    row = {'user_id': 'u', 'idempotency_key': 'k1'}
+    assert outbox.enqueue([row]) == ['k1']
+    assert outbox.enqueue([row]) == ['k1']
+
+    assert outbox.flush() == 1
+    assert list(database.rows) == ['k1']
+
+
+def test_outage_retries_whole_batch_and_never_gives_up(outbox, database):
+    keys = outbox.enqueue([{'user_id': 'u', 'n': n} for n in range(4)])
+    database.down = True
+    for _ in range(10):
+        assert outbox.flush() == 0
+
+    # One request per attempt: the batch is not split into single sends during an outage
+    assert database.calls == [4] * 10
+    assert [outbox.status(key)['status'] for key in keys] == [OUTBOX_PENDING] * 4
+    assert outbox.status(keys[0])['attempts'] == 10
+    assert outbox.stats()['given_up'] == 0
+
+    database.down = False
+    assert outbox.flush() == 4
+    assert [outbox.status(key)['status'] for key in keys] == [OUTBOX_SENT] * 4
+
+
+def test_rejected_row_is_isolated_and_marked_failed(outbox, database):
+    good, bad = outbox.enqueue([{'user_id': 'u'}, {'user_id': 'u', 'bad': True}])
+
+    assert outbox.flush() == 1 # The batch is split; the good row goes through
+    assert outbox.status(good)['status'] == OUTBOX_SENT
+    assert outbox.status(bad)['status'] == OUTBOX_PENDING
+
+    outbox.flush()
+    outbox.flush()
+    status = outbox.status(bad)
+    assert status['status'] == OUTBOX_FAILED
+    assert 'error 23502' in status['last_error']
+    assert outbox.stats()['failed'] == 1
+    assert outbox.stats()['given_up'] == 1
+
+
+def test_flush_claims_each_row_once(outbox, database):
+    outbox.enqueue([{'user_id': 'u'}])
+    database.down = True
+
+    # base_delay=0 makes the failed row due again at once; flush must still return
+    assert outbox.flush() == 0
+    assert database.calls == [1]
+
+
+def test_stats_report_backlog_age(outbox, database):
+    outbox.enqueue([{'user_id': 'u'}])
+
+    stats = outbox.stats()
+    assert stats['pending'] == 1
+    assert stats['oldest_pending_age'] >= 0
+
+
+def test_rows_survive_reopening_the_journal(tmp_path, database):
+    path = str(tmp_path / 'outbox.sqlite3')
+    keys = DocumentOutbox(path, database.send).enqueue([{'user_id': 'u'}])
+
+    reopened = DocumentOutbox(path, database.send)
+    assert reopened.flush() == 1
+    assert reopened.status(keys[0])['status'] == OUTBOX_SENT
+
+
+def test_journal_without_rejections_column_is_migrated(tmp_path, database):
+    path = str(tmp_path / 'outbox.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE document_outbox (
+            idempotency_key TEXT PRIMARY KEY, owner_id TEXT, row TEXT NOT NULL, status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, last_error TEXT,
+            document_id INTEGER, created_at REAL NOT NULL, sent_at REAL
+        )
+    """)
+    conn.execute(
+        "INSERT INTO document_outbox (idempotency_key, owner_id, row, status, next_attempt_at, created_at) "
+        "VALUES ('old', 'u', '{\"idempotency_key\": \"old\"}', 'pending', 0, 0)"
+    )
+    conn.commit()
+    conn.close()
+
+    outbox = DocumentOutbox(path, database.send)
+    assert outbox.flush() == 1
+    assert outbox.status('old')['status'] == OUTBOX_SENT
@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+
+from bench.fake_redis import FakeRedis
+from rate_limits import AdmissionGate, CostExceedsBurst, LocalBuckets, Overloaded, RateLimited, RateLimiter, RedisBuckets
+
+SLOW = 1 / 3600 # tokens per second: nothing refills during a test
+
+
+def test_local_buckets_admit_up_to_burst_then_report_wait():
+    buckets = LocalBuckets()
+
+    assert buckets.take([('a', SLOW, 3)], 2) == [0.0]
+    assert buckets.take([('a', SLOW, 3)], 1) == [0.0]
+    wait, = buckets.take([('a', SLOW, 3)], 1)
+    assert wait == pytest.approx(3600, rel=0.01)
+
+
+def test_local_buckets_refill_at_rate():
+    buckets = LocalBuckets()
+    buckets.take([('a', 100, 1)], 1)
+    time.sleep(0.02)
+
+    assert buckets.take([('a', 100, 1)], 1) == [0.0]
+
+
+def test_local_buckets_charge_all_or_none():
+    buckets = LocalBuckets()
+    buckets.take([('user', SLOW, 1)], 1)
+
+    waits = buckets.take([('ip', SLOW, 5), ('user', SLOW, 1)], 1)
+    assert waits[0] == 0.0 and waits[1] > 0
+    # The refused request left the IP bucket full
+    assert buckets.take([('ip', SLOW, 5)], 5) == [0.0]
+
+
+def test_local_buckets_drop_least_recently_used_keys():
+    buckets = LocalBuckets(max_keys=2)
+    for key in ('a', 'b', 'c'):
+        buckets.take([(key, SLOW, 1)], 1)
+
+    # 'a' was evicted, so it starts full again
+    assert buckets.take([('a', SLOW, 1)], 1) == [0.0]
+    assert buckets.take([('c', SLOW, 1)], 1)[0] > 0
+
+
+@pytest.fixture(params=['local', 'redis'])
+def limiter(request):
+    return RateLimiter(shared=RedisBuckets(FakeRedis()) if request.param == 'redis' else None)
+
+
+def test_limiter_raises_with_scope_and_whole_seconds(limiter):
+    limits = [('ip', '10.0.0.1', SLOW, 10), ('user', 'u', SLOW, 2)]
+    limiter.check(limits, 2)
+
+    with pytest.raises(RateLimited) as excinfo:
+        limiter.check(limits)
+    assert excinfo.value.scope == 'user'
+    assert excinfo.value.retry_after == 3600
+    assert limiter.stats()['allowed'] == 1
+    assert limiter.stats()['limited'] == {'user': 1}
+
+
+def test_limiter_does_not_charge_ip_when_user_is_refused(limiter):
+    limits = [('ip', '10.0.0.1', SLOW, 3), ('user', 'u', SLOW, 1)]
+    limiter.check(limits)
+    for _ in range(3):
+        with pytest.raises(RateLimited):
+            limiter.check(limits)
+
+    # Two tokens are left in the IP bucket for another user behind the same address
+    limiter.check([('ip', '10.0.0.1', SLOW, 3), ('user', 'v', SLOW, 1)])
+    limiter.check([('ip', '10.0.0.1', SLOW, 3), ('user', 'w', SLOW, 1)])
+    with pytest.raises(RateLimited) as excinfo:
+        limiter.check([('ip', '10.0.0.1', SLOW, 3), ('user', 'x', SLOW, 1)])
+    assert excinfo.value.scope == 'ip'
+
+
+def test_limiter_rejects_cost_above_burst(limiter):
+    limits = [('ip', '10.0.0.1', SLOW, 10), ('user', 'u', SLOW, 2)]
+
+    with pytest.raises(CostExceedsBurst) as excinfo:
+        limiter.check(limits, 3)
+    assert (excinfo.value.scope, excinfo.value.cost, excinfo.value.burst) == ('user', 3, 2)
+    # Nothing was charged
+    limiter.check(limits, 2)
+
+
+def test_limiter_falls_back_to_local_buckets_while_redis_is_down():
+    redis = FakeRedis()
+    redis.down = True
+    limiter = RateLimiter(shared=RedisBuckets(redis), cooldown=60)
+    limits = [('user', 'u', SLOW, 1)]
+
+    limiter.check(limits)
+    with pytest.raises(RateLimited):
+        limiter.check(limits)
+    stats = limiter.stats()
+    assert stats['shared_backend_down'] is True
+    # Only the first request waited for Redis; the rest skip it until the cooldown ends
+    assert stats['shared_backend_errors'] == 1
+
+
+def test_limiter_probes_redis_again_after_cooldown():
+    redis = FakeRedis()
+    redis.down = True
+    limiter = RateLimiter(shared=RedisBuckets(redis), cooldown=0.01)
+    limiter.check([('user', 'u', SLOW, 5)])
+
+    redis.down = False
+    time.sleep(0.02)
+    limiter.check([('user', 'u', SLOW, 5)])
+    assert limiter.stats()['shared_backend_down'] is False
+
+
+def test_admission_gate_turns_away_past_limit():
+    gate = AdmissionGate(1, retry_after=lambda: 7)
+    entered, release = threading.Event(), threading.Event()
+
+    def hold():
+        with gate.admit():
+            entered.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    entered.wait()
+    with pytest.raises(Overloaded) as excinfo:
+        with gate.admit():
+            pass
+    assert excinfo.value.retry_after == 7
+    release.set()
+    holder.join()
+
+    with gate.admit():
+        pass
+    assert gate.stats() == {'limit': 1, 'in_flight': 0, 'rejected': 1}
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from scan_jobs import JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, ScanJobQueue
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'scan_jobs.sqlite3')
+
+
+def wait_until_done(queue, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    job = queue.get(job_id)
+    while job['status'] not in (JOB_SUCCEEDED, JOB_FAILED) and time.monotonic() < deadline:
+        job = queue.wait_for_change(job_id, job['version'], timeout=deadline - time.monotonic())
+    return job
+
+
+def test_job_reports_progress_and_result(db_path):
+    queue = ScanJobQueue(db_path)
+
+    def scan(name, report_progress=None):
+        report_progress('converting', 50)
+        return {'file': name}
+
+    job_id = queue.submit(scan, 'bill.pdf', owner_id='u')
+    job = wait_until_done(queue, job_id)
+    assert job['status'] == JOB_SUCCEEDED
+    assert job['progress'] == 100
+    assert job['result'] == {'file': 'bill.pdf'}
+    assert job['owner_id'] == 'u'
+
+
+def test_exception_marks_job_failed(db_path):
+    queue = ScanJobQueue(db_path)
+
+    def scan(report_progress=None):
+        raise ValueError('unreadable file')
+
+    job = wait_until_done(queue, queue.submit(scan))
+    assert job['status'] == JOB_FAILED
+    assert job['error'] == 'unreadable file'
+
+
+def test_unknown_job_is_none(db_path):
+    queue = ScanJobQueue(db_path)
+    assert queue.get('0' * 32) is None
+    assert queue.wait_for_change('0' * 32, 0, timeout=0.1) is None
+
+
+def test_another_process_sees_and_streams_the_job(db_path):
+    runner, other = ScanJobQueue(db_path), ScanJobQueue(db_path, poll_interval=0.01)
+    release = threading.Event()
+
+    def scan(report_progress=None):
+        report_progress('converting', 40)
+        release.wait()
+        return {'ok': True}
+
+    job_id = runner.submit(scan, owner_id='u')
+    job = other.wait_for_change(job_id, 0, timeout=5)
+    assert job['status'] in (JOB_QUEUED, JOB_RUNNING)
+    release.set()
+    assert wait_until_done(other, job_id)['result'] == {'ok': True}
+
+
+def test_jobs_of_a_stopped_queue_are_failed_and_their_files_removed(db_path, tmp_path):
+    upload = tmp_path / 'upload.pdf'
+    upload.write_bytes(b'%PDF')
+    stopped = ScanJobQueue(db_path, heartbeat=0.05) # never start()ed, so it stops heartbeating
+    release = threading.Event()
+    job_id = stopped.submit(lambda report_progress=None: release.wait(), temp_path=str(upload))
+
+    try:
+        time.sleep(0.2)
+        survivor = ScanJobQueue(db_path, heartbeat=0.05) # a restarted worker recovers on startup
+        job = survivor.get(job_id)
+        assert job['status'] == JOB_FAILED
+        assert 'restarted' in job['error']
+        assert not upload.exists()
+    finally:
+        release.set()
+
+
+def test_live_queue_keeps_its_jobs(db_path):
+    runner = ScanJobQueue(db_path, heartbeat=0.05).start()
+    release = threading.Event()
+    job_id = runner.submit(lambda report_progress=None: release.wait() and {'ok': True})
+
+    try:
+        time.sleep(0.2)
+        ScanJobQueue(db_path, heartbeat=0.05)
+        assert runner.get(job_id)['status'] == JOB_RUNNING
+    finally:
+        release.set()
+    assert wait_until_done(runner, job_id)['status'] == JOB_SUCCEEDED
+
+
+def test_finished_jobs_expire(db_path):
+    queue = ScanJobQueue(db_path, result_ttl=0)
+    job_id = queue.submit(lambda report_progress=None: {})
+    wait_until_done(queue, job_id)
+    time.sleep(0.01)
+
+    ScanJobQueue(db_path, result_ttl=0) # Expired jobs are dropped on every heartbeat, starting with the first
+    assert queue.get(job_id) is None
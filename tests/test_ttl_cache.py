@@ -0,0 +1,74 @@
+import time
+
+from bench.fake_redis import FakeRedis
+from ttl_cache import MISSING, SharedGenerations, TTLCache
+
+
+def test_get_returns_missing_until_set():
+    cache = TTLCache()
+    assert cache.get('k') is MISSING
+    cache.set('k', None) # None is a value worth caching (e.g. "no such account")
+    assert cache.get('k') is None
+    assert cache.stats() == {'entries': 1, 'hits': 1, 'misses': 1}
+
+
+def test_entries_expire():
+    cache = TTLCache(ttl=0.05)
+    cache.set('short', 1)
+    cache.set('long', 2, ttl=10)
+    time.sleep(0.1)
+
+    assert cache.get('short') is MISSING
+    assert cache.get('long') == 2
+    assert cache.stats()['entries'] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is MISSING
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_invalidate_drops_matching_keys():
+    cache = TTLCache()
+    for key in (('u1', 'x'), ('u1', 'y'), ('u2', 'x')):
+        cache.set(key, True)
+
+    assert cache.invalidate(lambda key: key[0] == 'u1') == 2
+    assert cache.get(('u2', 'x')) is True
+
+
+def test_generations_start_at_zero_and_bump():
+    generations = SharedGenerations(FakeRedis())
+    assert generations.get('u') == 0
+    assert generations.bump('u') == 1
+    assert generations.get('u') == 1
+    assert generations.get('other') == 0
+
+
+def test_generations_bypass_redis_during_cooldown():
+    redis = FakeRedis()
+    generations = SharedGenerations(redis, cooldown=60)
+    redis.down = True
+    assert generations.get('u') is None
+    assert generations.bump('u') is None
+
+    redis.down = False
+    # Still cooling down: callers keep bypassing their cache rather than risk stale entries
+    assert generations.get('u') is None
+
+
+def test_generations_retry_redis_after_cooldown():
+    redis = FakeRedis()
+    generations = SharedGenerations(redis, cooldown=0.01)
+    redis.down = True
+    generations.get('u')
+
+    redis.down = False
+    time.sleep(0.02)
+    assert generations.get('u') == 0
@@ -0,0 +1,94 @@
+"""Small in-process cache with per-entry expiry and LRU eviction, plus shared generations to invalidate it everywhere."""
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentation import log
+
+MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe mapping whose entries expire after `ttl` seconds; the least recently used go first when full"""
+
+    def __init__(self, max_entries=10000, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Cached value for `key`, or MISSING (cached values may legitimately be None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate):
+        """Drop every entry whose key satisfies `predicate`; returns how many were dropped"""
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class SharedGenerations:
+    """
+    Per-key generation numbers kept in Redis, for invalidating caches in every process:
+    put get(key) in the cache keys and bump(key) on change, and entries cached under
+    the old generation are never read again. get() returns None when Redis fails (the
+    caller should bypass its cache) and skips Redis for `cooldown` seconds after that.
+    """
+
+    def __init__(self, client, prefix='bill_scan:generation:', cooldown=30.0):
+        self.client = client
+        self.prefix = prefix
+        self.cooldown = cooldown
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if time.monotonic() < self._retry_at:
+                return None
+        try:
+            return int(self.client.get(self.prefix + key) or 0)
+        except Exception as e:
+            self._failed(e)
+            return None
+
+    def bump(self, key):
+        """Start a new generation for `key`; returns it, or None when Redis failed"""
+        try:
+            return int(self.client.incr(self.prefix + key))
+        except Exception as e:
+            self._failed(e)
+            return None
+
+    def _failed(self, error):
+        with self._lock:
+            first_failure = time.monotonic() >= self._retry_at
+            self._retry_at = time.monotonic() + self.cooldown
+        if first_failure:
+            log(f"Cache generations unavailable, bypassing shared-invalidation caches: {error}")
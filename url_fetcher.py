@@ -0,0 +1,187 @@
+"""Bounded downloads for /process_url: pooled connections, timeouts, a size cap and conditional GETs."""
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx  # Already installed with supabase (postgrest and storage use it)
+
+# Extensions docling picks its input format from; anything else is named after the Content-Type
+_KNOWN_SUFFIXES = {'.pdf', '.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp', '.webp', '.html', '.htm', '.docx'}
+
+
+class UrlFetchError(Exception):
+    """Download refused or failed; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=502, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class FetchedDocument:
+    """
+    One download. `path` is a temp file removed by close(); it is None when the origin
+    answered 304 Not Modified, in which case `digest` is the earlier download's.
+    """
+
+    def __init__(self, digest, path=None, etag=None, last_modified=None, not_modified=False):
+        self.digest = digest
+        self.path = path
+        self.etag = etag
+        self.last_modified = last_modified
+        self.not_modified = not_modified
+
+    def close(self):
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+
+class UrlFetcher:
+    """
+    Downloads with one pooled httpx client (kept-alive connections per origin), connect
+    and read timeouts plus an overall `deadline` per download, and `max_bytes` enforced
+    while streaming. At most `max_concurrent` downloads run at once; more are refused
+    with a 503 so a slow origin cannot hold every web thread. fetch() with the
+    `validators` of an earlier download sends If-None-Match / If-Modified-Since.
+    """
+
+    def __init__(self, max_bytes, connect_timeout=5.0, read_timeout=15.0, deadline=60.0, max_concurrent=8,
+                 max_redirects=5):
+        self.max_bytes = max_bytes
+        self.deadline = deadline
+        self.max_concurrent = max_concurrent
+        self._client = httpx.Client(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_concurrent, max_keepalive_connections=max_concurrent),
+            follow_redirects=True,
+            max_redirects=max_redirects,
+            headers={'User-Agent': 'bill-scan/1.0'}
+        )
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._downloads = 0
+        self._not_modified = 0
+        self._bytes = 0
+        self._failed = 0
+        self._rejected = 0
+
+    def fetch(self, url, validators=None):
+        """
+        Download `url` into a temp file and return a FetchedDocument (close it when done).
+        `validators` is {'etag', 'last_modified', 'digest'} from an earlier download of the
+        same URL. Raises UrlFetchError.
+        """
+        if urlsplit(url).scheme not in ('http', 'https'):
+            raise UrlFetchError('Only http and https URLs can be processed', 400)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise UrlFetchError('Too many downloads in progress. Please retry shortly.', 503, retry_after=5)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            fetched = self._download(url, validators)
+        except UrlFetchError:
+            self._count_failure()
+            raise
+        except httpx.TimeoutException:
+            self._count_failure()
+            raise UrlFetchError('Timed out downloading the document', 504)
+        except httpx.HTTPError as e:
+            self._count_failure()
+            raise UrlFetchError(f'Download failed: {e}', 502)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+        with self._lock:
+            if fetched.not_modified:
+                self._not_modified += 1
+            else:
+                self._downloads += 1
+        return fetched
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'max_concurrent': self.max_concurrent,
+                'downloads': self._downloads,
+                'not_modified': self._not_modified,
+                'bytes_downloaded': self._bytes,
+                'failed': self._failed,
+                'rejected': self._rejected,
+            }
+
+    def close(self):
+        self._client.close()
+
+    def _download(self, url, validators):
+        headers = {}
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        deadline = time.monotonic() + self.deadline
+
+        with self._client.stream('GET', url, headers=headers) as response:
+            if response.status_code == 304 and validators:
+                return FetchedDocument(
+                    validators['digest'], etag=validators.get('etag'),
+                    last_modified=validators.get('last_modified'), not_modified=True
+                )
+            if response.status_code != 200:
+                raise UrlFetchError(f'The document URL answered HTTP {response.status_code}', 502)
+            declared = response.headers.get('Content-Length', '')
+            if declared.isdigit() and int(declared) > self.max_bytes:
+                raise UrlFetchError(self._too_large_message(), 413)
+
+            fd, path = tempfile.mkstemp(suffix=_suffix_for(url, response.headers.get('Content-Type')))
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_bytes():
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise UrlFetchError(self._too_large_message(), 413)
+                        if time.monotonic() > deadline:
+                            # Each read is bounded by the read timeout; this caps a slow trickle
+                            raise UrlFetchError('Timed out downloading the document', 504)
+                        digest.update(chunk)
+                        f.write(chunk)
+            except BaseException:
+                os.unlink(path)
+                raise
+            with self._lock:
+                self._bytes += size
+            return FetchedDocument(
+                digest.hexdigest(), path, etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified')
+            )
+
+    def _too_large_message(self):
+        return f'The document is larger than the {self.max_bytes // (1024 * 1024)} MB limit'
+
+    def _count_failure(self):
+        with self._lock:
+            self._failed += 1
+
+
+def _suffix_for(url, content_type):
+    """File extension for the download, so docling and image prep recognise its format"""
+    suffix = os.path.splitext(urlsplit(url).path)[1].lower()
+    if suffix in _KNOWN_SUFFIXES:
+        return suffix
+    guessed = mimetypes.guess_extension((content_type or '').split(';')[0].strip())
+    return guessed or ''
@@ -0,0 +1,149 @@
+"""Per-user authenticated Supabase clients, cached so requests never share auth state."""
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from supabase import ClientOptions, create_client
+
+
+def token_expiry(access_token):
+    """`exp` claim of a Supabase JWT, or 0 if it cannot be read. Not verified here: PostgREST verifies it."""
+    try:
+        payload = access_token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except Exception:
+        return 0
+
+
+class UserClientPool:
+    """
+    LRU cache of Supabase clients that send one user's access token as their
+    Authorization header. A cached client keeps its HTTP connections open across
+    requests, and no per-request set_session() round trip is needed. Tokens close
+    to expiry are refreshed before a client is handed out.
+    """
+
+    def __init__(self, url, key, max_clients=256, refresh_margin=60, rotation_grace=10):
+        self.url = url
+        self.key = key
+        self.max_clients = max_clients
+        self.refresh_margin = refresh_margin
+        self.rotation_grace = rotation_grace
+        self._clients = OrderedDict() # user_id -> (access_token, client)
+        # Refresh tokens are single-use: remember what each one was exchanged for, so a
+        # concurrent request still holding the old token reuses the result. Only for
+        # `rotation_grace` seconds (the concurrent-refresh race), and never after logout:
+        # a replayed old session cookie must not keep receiving new tokens.
+        self._rotated = OrderedDict() # old refresh_token -> (user_id, access_token, refresh_token, rotated_at)
+        # Tokens rotated by callers that cannot update the session (background jobs), kept
+        # until the user's next request collects them or the user logs out.
+        self._handoffs = OrderedDict() # session's refresh_token -> (user_id, access_token, refresh_token)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._evictions = 0
+
+    def get(self, user_id, access_token, refresh_token, store_back=True):
+        """
+        Return (client, access_token, refresh_token) for the user. The returned tokens
+        differ from the ones passed in when they had to be refreshed; callers should
+        store them back in the user's session. Callers that cannot (store_back=False)
+        leave a refresh with the pool, which hands it to the next call that can.
+        Raises if a needed refresh fails.
+        """
+        session_refresh_token = refresh_token
+        with self._lock:
+            handoff = self._handoffs.get(refresh_token)
+            if handoff and handoff[0] == user_id and store_back:
+                del self._handoffs[refresh_token]
+        if handoff and handoff[0] == user_id:
+            # The session's refresh token was already spent on the user's behalf
+            access_token, refresh_token = handoff[1:]
+        if self._expiring(access_token):
+            with self._lock:
+                rotated = self._rotated.get(refresh_token)
+            if (rotated and rotated[0] == user_id and time.monotonic() - rotated[3] < self.rotation_grace
+                    and not self._expiring(rotated[1])):
+                access_token, refresh_token = rotated[1:3]
+            else:
+                access_token, refresh_token = self._refresh(user_id, refresh_token)
+            if not store_back:
+                with self._lock:
+                    self._handoffs[session_refresh_token] = (user_id, access_token, refresh_token)
+                    self._handoffs.move_to_end(session_refresh_token)
+                    while len(self._handoffs) > self.max_clients:
+                        self._handoffs.popitem(last=False)
+
+        with self._lock:
+            entry = self._clients.get(user_id)
+            if entry and entry[0] == access_token:
+                self._clients.move_to_end(user_id)
+                self._hits += 1
+                return entry[1], access_token, refresh_token
+            self._misses += 1
+
+        client = self._create_client(access_token)
+        with self._lock:
+            self._clients[user_id] = (access_token, client)
+            self._clients.move_to_end(user_id)
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+                self._evictions += 1
+        return client, access_token, refresh_token
+
+    def discard(self, user_id):
+        """Forget the user's client and token rotations (on logout)"""
+        with self._lock:
+            self._clients.pop(user_id, None)
+            for old_token in [token for token, rotated in self._rotated.items() if rotated[0] == user_id]:
+                del self._rotated[old_token]
+            for old_token in [token for token, handoff in self._handoffs.items() if handoff[0] == user_id]:
+                del self._handoffs[old_token]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._clients),
+                'max_clients': self.max_clients,
+                'hits': self._hits,
+                'misses': self._misses,
+                'refreshes': self._refreshes,
+                'handoffs': len(self._handoffs),
+                'evictions': self._evictions,
+            }
+
+    def _expiring(self, access_token):
+        return token_expiry(access_token) - time.time() < self.refresh_margin
+
+    def _create_client(self, access_token):
+        options = ClientOptions(
+            headers={'Authorization': f'Bearer {access_token}'},
+            auto_refresh_token=False,
+            persist_session=False
+        )
+        return create_client(self.url, self.key, options=options)
+
+    def _refresh(self, user_id, refresh_token):
+        # A throwaway client so the refresh never touches another request's auth state
+        auth_client = create_client(
+            self.url, self.key, options=ClientOptions(auto_refresh_token=False, persist_session=False)
+        )
+        response = auth_client.auth.refresh_session(refresh_token)
+        if not response or not response.session:
+            raise RuntimeError('Session refresh failed')
+        tokens = (response.session.access_token, response.session.refresh_token)
+        now = time.monotonic()
+        with self._lock:
+            self._refreshes += 1
+            self._rotated[refresh_token] = (user_id,) + tokens + (now,)
+            # Oldest first: drop rotations past their grace period, and any beyond max_clients
+            while self._rotated and (
+                len(self._rotated) > self.max_clients
+                or now - next(iter(self._rotated.values()))[3] >= self.rotation_grace
+            ):
+                self._rotated.popitem(last=False)
+        return tokens